@@ -1,8 +1,17 @@
+from django.conf import settings
 from django.contrib import admin
-from django.utils.html import format_html
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseBadRequest, HttpResponseRedirect
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 from django.contrib import messages
 from django import forms
-from .models import Semester, Subject, Note, Comment, Rating, Feedback
+from .cache import bump_generation
+from .exports import FORMATS, export_response
+from .models import Semester, Subject, Note, Comment, Rating, Feedback, Tag
+from .uploads import CREATED, DUPLICATE, create_notes_from_uploads, title_from_filename
 
 class MultipleFileInput(forms.ClearableFileInput):
     allow_multiple_selected = True
@@ -25,6 +34,10 @@ class BulkNoteForm(forms.ModelForm):
         required=False,
         help_text="Select multiple files to upload as separate notes"
     )
+    skip_duplicates = forms.BooleanField(
+        required=False,
+        help_text="Skip files whose content is already uploaded to this subject, or repeated in this upload"
+    )
     
     class Meta:
         model = Note
@@ -45,12 +58,59 @@ class BulkNoteForm(forms.ModelForm):
     # The actual bulk creation is handled in NoteAdmin.save_model
      return super().save(commit=commit)
 
+class ExportChangeList(ChangeList):
+    def get_results(self, request):
+        # An export needs the filtered queryset, not a page of it and counts
+        pass
+
+class ExportMixin:
+    """Export actions, and an export/ URL that streams every row the
+    changelist's filters and search select (see notes.exports):
+    /admin/notes/comment/export/?format=ndjson&created_at__gte=2024-01-01"""
+    actions = ['export_csv', 'export_ndjson']
+    
+    def get_urls(self):
+        name = f'{self.opts.app_label}_{self.opts.model_name}_export'
+        return [path('export/', self.admin_site.admin_view(self.export_view), name=name)] + super().get_urls()
+    
+    def get_changelist(self, request, **kwargs):
+        if getattr(request, '_exporting', False):
+            return ExportChangeList
+        return super().get_changelist(request, **kwargs)
+    
+    def export_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        format = request.GET.get('format', 'csv')
+        if format not in FORMATS:
+            return HttpResponseBadRequest(f'format must be one of: {", ".join(FORMATS)}')
+        # The changelist would read format as a filter
+        request.GET = request.GET.copy()
+        request.GET.pop('format', None)
+        request._exporting = True
+        try:
+            queryset = self.get_changelist_instance(request).queryset
+        except IncorrectLookupParameters as e:
+            return HttpResponseBadRequest(str(e))
+        return export_response(queryset, format, asynchronous=settings.ASYNC_VIEWS)
+    
+    def export_csv(self, request, queryset):
+        return export_response(queryset, 'csv', asynchronous=settings.ASYNC_VIEWS)
+    export_csv.short_description = "Export selected as CSV"
+    
+    def export_ndjson(self, request, queryset):
+        return export_response(queryset, 'ndjson', asynchronous=settings.ASYNC_VIEWS)
+    export_ndjson.short_description = "Export selected as NDJSON"
+
 @admin.register(Semester)
 class SemesterAdmin(admin.ModelAdmin):
     list_display = ['number', 'name', 'total_subjects', 'total_notes', 'is_active']
     list_filter = ['is_active']
     search_fields = ['name']
     readonly_fields = ['total_subjects', 'total_notes', 'created_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_counts()
 
 @admin.register(Subject)
 class SubjectAdmin(admin.ModelAdmin):
@@ -58,6 +118,9 @@ class SubjectAdmin(admin.ModelAdmin):
     list_filter = ['semester', 'is_active']
     search_fields = ['name', 'code']
     readonly_fields = ['total_notes', 'total_downloads', 'created_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_rollups()
 
 class NoteInline(admin.StackedInline):
     model = Note
@@ -69,7 +132,7 @@ class NoteInline(admin.StackedInline):
 SubjectAdmin.inlines = [NoteInline]
 
 @admin.register(Note)
-class NoteAdmin(admin.ModelAdmin):
+class NoteAdmin(ExportMixin, admin.ModelAdmin):
     form = BulkNoteForm
     list_display = ['title', 'subject', 'note_type', 'downloads', 'is_featured', 'created_at']
     list_filter = ['subject__semester', 'subject', 'note_type', 'is_featured']
@@ -99,7 +162,7 @@ class NoteAdmin(admin.ModelAdmin):
                     'description': 'Select subject and upload multiple files. Each file will create a separate note with auto-generated title.'
                 }),
                 ('Optional Settings (applies to all uploaded files)', {
-                    'fields': ('chapter', 'tags'),
+                    'fields': ('chapter', 'tags', 'skip_duplicates'),
                     'classes': ('collapse',)
                 }),
             )
@@ -124,69 +187,88 @@ class NoteAdmin(admin.ModelAdmin):
             files = form.cleaned_data.get('files', [])
             if not isinstance(files, list):
                 files = [files] if files else []
+            files = [file for file in files if file]
             
             if files:
-                # Create multiple notes from files
-                notes_created = []
-                for file in files:
-                    if file:
-                        # Create a new note for each file
-                        note = Note(
-                            subject=form.cleaned_data['subject'],
-                            note_type=form.cleaned_data['note_type'],
-                            chapter=form.cleaned_data.get('chapter', ''),
-                            tags=form.cleaned_data.get('tags', ''),
-                            file=file
-                        )
-                        # Auto-generate title from filename
-                        filename = file.name.rsplit('.', 1)[0]
-                        note.title = filename.replace('_', ' ').replace('-', ' ').title()
-                        note.description = f"Notes for {note.title}"
-                        note.save()
-                        notes_created.append(note)
-                
-                if notes_created:
-                    count = len(notes_created)
-                    messages.success(request, f'Successfully created {count} notes from uploaded files.')
-                    return
+                # One bulk insert; see notes.uploads
+                results = create_notes_from_uploads(
+                    files,
+                    subject=form.cleaned_data['subject'],
+                    note_type=form.cleaned_data['note_type'],
+                    chapter=form.cleaned_data.get('chapter', ''),
+                    tags=form.cleaned_data.get('tags', ''),
+                    skip_duplicates=form.cleaned_data.get('skip_duplicates', False),
+                )
+                request._bulk_upload_results = results
+                self.report_upload(request, results)
+                return
         
         # Handle single note save (editing or single file upload)
         if not obj.title and obj.file:
-            filename = obj.file.name.rsplit('.', 1)[0]
-            obj.title = filename.replace('_', ' ').replace('-', ' ').title()
+            obj.title = title_from_filename(obj.file.name)
         if not obj.description and obj.title:
             obj.description = f"Notes for {obj.title}"
         
         super().save_model(request, obj, form, change)
-
-    actions = ['mark_featured', 'unmark_featured']
+    
+    def report_upload(self, request, results):
+        created = [name for name, status, _ in results if status == CREATED]
+        skipped = [(name, status) for name, status, _ in results if status != CREATED]
+        if created:
+            messages.success(request, f'Successfully created {len(created)} notes from uploaded files.')
+        if skipped:
+            messages.warning(request, format_html(
+                'Skipped {} {}:<ul>{}</ul>',
+                len(skipped),
+                'file' if len(skipped) == 1 else 'files',
+                format_html_join('', '<li>{} ({})</li>', (
+                    (name, 'already uploaded to this subject' if status == DUPLICATE else 'could not be stored')
+                    for name, status in skipped
+                )),
+            ))
+    
+    def response_add(self, request, obj, post_url_continue=None):
+        # A bulk upload has no single object to show
+        if getattr(request, '_bulk_upload_results', None) is not None:
+            return HttpResponseRedirect(reverse('admin:notes_note_changelist'))
+        return super().response_add(request, obj, post_url_continue)
+    
+    actions = ExportMixin.actions + ['mark_featured', 'unmark_featured']
     
     def mark_featured(self, request, queryset):
         updated = queryset.update(is_featured=True)
+        # update() skips the signals that invalidate cached API responses
+        bump_generation(Note)
         self.message_user(request, f'{updated} notes marked as featured.')
     mark_featured.short_description = "Mark selected notes as featured"
     
     def unmark_featured(self, request, queryset):
         updated = queryset.update(is_featured=False)
+        bump_generation(Note)
         self.message_user(request, f'{updated} notes unmarked as featured.')
     unmark_featured.short_description = "Remove featured status"
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
+
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ExportMixin, admin.ModelAdmin):
     list_display = ['note', 'author_name', 'created_at']
     list_filter = ['created_at', 'note__subject']
     search_fields = ['author_name', 'content']
     readonly_fields = ['created_at']
 
 @admin.register(Rating)
-class RatingAdmin(admin.ModelAdmin):
+class RatingAdmin(ExportMixin, admin.ModelAdmin):
     list_display = ['note', 'author_name', 'score', 'created_at']
     list_filter = ['score', 'created_at']
     search_fields = ['author_name']
     readonly_fields = ['created_at']
 
 @admin.register(Feedback)
-class FeedbackAdmin(admin.ModelAdmin):
+class FeedbackAdmin(ExportMixin, admin.ModelAdmin):
     list_display = ['subject', 'feedback_type', 'name', 'created_at']
     list_filter = ['feedback_type', 'created_at']
     search_fields = ['name', 'subject']
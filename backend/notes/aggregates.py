@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import stats
+from .cache import bump_generation
+from .models import Note, Rating
+
+
+def apply_rating_delta(note_id, count, total):
+    """Shift a note's stored rating aggregates by the given amounts"""
+    if not count and not total:
+        return
+    Note.objects.filter(pk=note_id).update(
+        rating_count=F('rating_count') + count,
+        rating_sum=F('rating_sum') + total,
+    )
+
+
+def rebuild_rating_aggregates(note_ids):
+    """Recompute rating_count/rating_sum for the given notes from the Rating table"""
+    note_ids = list(note_ids)
+    totals = {
+        row['note_id']: row
+        for row in Rating.objects.filter(note_id__in=note_ids)
+        .order_by()
+        .values('note_id')
+        .annotate(count=Count('id'), total=Sum('score'))
+    }
+    notes = []
+    for note in Note.objects.filter(pk__in=note_ids).only('id', 'rating_count', 'rating_sum'):
+        row = totals.get(note.pk, {'count': 0, 'total': 0})
+        if (note.rating_count, note.rating_sum) != (row['count'], row['total']):
+            note.rating_count = row['count']
+            note.rating_sum = row['total']
+            notes.append(note)
+    Note.objects.bulk_update(notes, ['rating_count', 'rating_sum'])
+    return len(notes)
+
+
+def recount_rating_aggregates(note_ids):
+    """Recompute rating_count/rating_sum for the given notes in one UPDATE,
+    for after bulk writes to the Rating table"""
+    ratings = Rating.objects.filter(note_id=OuterRef('pk')).order_by().values('note_id')
+    Note.objects.filter(pk__in=note_ids).update(
+        rating_count=Coalesce(Subquery(ratings.annotate(count=Count('id')).values('count')), Value(0)),
+        rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum('score')).values('total')), Value(0)),
+    )
+
+
+def upsert_rating(note_id, author_name, author_email, score):
+    """Save ``author_email``'s rating of a note, replacing their earlier one,
+    with a single INSERT ... ON CONFLICT DO UPDATE, and shift the note's
+    aggregates to match. Signals don't fire, so this also updates the stats
+    and cache generations. Returns (rating, created, note), where ``note``
+    has the new rating_count/rating_sum. Raises Note.DoesNotExist."""
+    previous = Rating.objects.filter(note_id=OuterRef('pk'), author_email=author_email)
+    with transaction.atomic():
+        # A no-op UPDATE locks the note's row on PostgreSQL, and the database
+        # on SQLite, where select_for_update() does nothing, so ratings of one
+        # note are serialized. It is a statement of its own: the SELECT below
+        # then starts a fresh snapshot, and sees a rating committed while this
+        # one waited for the lock
+        if not Note.objects.filter(pk=note_id).update(rating_count=F('rating_count')):
+            raise Note.DoesNotExist('Note matching query does not exist.')
+        note = (
+            Note.objects.only('id', 'rating_count', 'rating_sum')
+            .annotate(
+                previous_score=Subquery(previous.values('score')[:1]),
+                previous_created_at=Subquery(previous.values('created_at')[:1]),
+            )
+            .get(pk=note_id)
+        )
+        rating = Rating(note_id=note.pk, author_name=author_name, author_email=author_email, score=score)
+        Rating.objects.bulk_create(
+            [rating],
+            update_conflicts=True,
+            unique_fields=['note', 'author_email'],
+            update_fields=['author_name', 'score'],
+        )
+        created = note.previous_score is None
+        if not created:
+            # The update leaves created_at alone; bulk_create set it to now
+            rating.created_at = note.previous_created_at
+        count, total = int(created), score - (note.previous_score or 0)
+        apply_rating_delta(note.pk, count, total)
+        note.rating_count += count
+        note.rating_sum += total
+        stats.adjust('total_ratings', count)
+        bump_generation(Note, Rating)
+    return rating, created, note
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class NotesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notes'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from . import metrics, signals
+        
+        post_migrate.connect(signals.reinstall_search_index, sender=self)
+        connection_created.connect(metrics.install_query_timer, dispatch_uid='notes.metrics.install_query_timer')
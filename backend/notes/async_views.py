@@ -0,0 +1,197 @@
+"""
+Async variants of the read-only endpoints and of the file download.
+
+notes.urls routes to these instead of the DRF views when ASYNC_VIEWS is on,
+which notes_platform.asgi does by default. They reuse the querysets,
+serializers and paginators of the views in notes.views and fetch rows with
+the async ORM, and negotiate the same renderers, so the responses are the
+same.
+
+Serializers run on the event loop, where a lazy query would raise
+SynchronousOnlyOperation, so the querysets must fetch everything up front.
+They already do, to avoid N+1 queries. The pending download counts are
+looked up in a thread too and handed to the serializers in their context.
+
+Downloads are streamed by an async iterator (see notes.files), so a slow
+client holds a suspended coroutine rather than a worker.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.cache import cache_control
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import views
+from .cache import DOWNLOADS, cache_response
+from .counters import download_counter
+from .files import is_new_download
+from .metrics import serializing
+from .models import Semester, Subject, Note, Comment, Rating
+from .serializers import NoteListSerializer
+from .stats import get_snapshot as get_stats_snapshot, snapshot_etag
+
+renderers = [renderer_class() for renderer_class in api_settings.DEFAULT_RENDERER_CLASSES]
+negotiator = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS()
+
+
+def _render(request, data, status=200):
+    renderer = request.accepted_renderer
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    content = renderer.render(data, request.accepted_media_type)
+    response = HttpResponse(content, status=status, content_type=content_type)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def api_view(view_func):
+    """Async counterpart of DRF's ``@api_view(['GET'])``: other methods get a
+    405, the renderer is chosen from the Accept header, and Http404 and API
+    exceptions become error responses"""
+    @wraps(view_func)
+    async def wrapped(request, *args, **kwargs):
+        # Errors before negotiation, such as a 406, use the default renderer
+        request.accepted_renderer, request.accepted_media_type = renderers[0], renderers[0].media_type
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise exceptions.MethodNotAllowed(request.method)
+            request.accepted_renderer, request.accepted_media_type = negotiator.select_renderer(
+                Request(request), renderers
+            )
+            return await view_func(request, *args, **kwargs)
+        except Http404:
+            error = exceptions.NotFound()
+        except exceptions.APIException as exc:
+            error = exc
+        detail = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+        return _render(request, detail, status=error.status_code)
+    return wrapped
+
+
+def _view(view_class, request, kwargs):
+    """A DRF view from notes.views, for its queryset, serializer and paginator"""
+    return view_class(request=Request(request), args=(), kwargs=kwargs, format_kwarg=None)
+
+
+async def _context(rows, context=None):
+    """Serializer context with the pending download counts of the notes in
+    ``rows``, including a subject's prefetched notes"""
+    note_ids = []
+    for row in rows:
+        if isinstance(row, Note):
+            note_ids.append(row.pk)
+        elif 'notes' in getattr(row, '_prefetched_objects_cache', {}):
+            note_ids.extend(note.pk for note in row.notes.all())
+    # pending() talks to the cache and may wait for a flush
+    pending = await sync_to_async(download_counter.pending)(note_ids) if note_ids else {}
+    return {**(context or {}), 'pending_downloads': pending}
+
+
+async def _list(view_class, request, kwargs):
+    view = _view(view_class, request, kwargs)
+    queryset = view.filter_queryset(view.get_queryset())
+    paginator = view.paginator
+    if paginator is None:
+        rows = [row async for row in queryset]
+        context = await _context(rows, view.get_serializer_context())
+        with serializing():
+            data = view.get_serializer(rows, many=True, context=context).data
+        return _render(request, data)
+    page = await paginator.apaginate_queryset(queryset, view.request, view=view)
+    context = await _context(page, view.get_serializer_context())
+    with serializing():
+        data = view.get_serializer(page, many=True, context=context).data
+    return _render(request, paginator.get_paginated_response(data).data)
+
+
+async def _retrieve(view_class, request, kwargs):
+    view = _view(view_class, request, kwargs)
+    queryset = view.filter_queryset(view.get_queryset())
+    lookup = {view.lookup_field: kwargs[view.lookup_url_kwarg or view.lookup_field]}
+    try:
+        instance = await queryset.aget(**lookup)
+    except queryset.model.DoesNotExist:
+        raise Http404
+    context = await _context([instance], view.get_serializer_context())
+    with serializing():
+        data = view.get_serializer(instance, context=context).data
+    return _render(request, data)
+
+
+@cache_response(Semester, Subject, Note)
+@api_view
+async def semester_list(request):
+    return await _list(views.SemesterListView, request, {})
+
+
+@cache_response(Semester, Subject, Note, Rating, DOWNLOADS)
+@api_view
+async def semester_detail(request, pk):
+    return await _retrieve(views.SemesterDetailView, request, {'pk': pk})
+
+
+@cache_response(Semester, Subject, Note, Rating, DOWNLOADS)
+@api_view
+async def subject_list(request, semester_id=None):
+    return await _list(views.SubjectListView, request, {'semester_id': semester_id})
+
+
+@cache_response(Semester, Subject, Note, Rating, DOWNLOADS)
+@api_view
+async def subject_detail(request, pk):
+    return await _retrieve(views.SubjectDetailView, request, {'pk': pk})
+
+
+@cache_response(Subject, Note, Rating, DOWNLOADS)
+@api_view
+async def note_list(request, subject_id=None):
+    return await _list(views.NoteListView, request, {'subject_id': subject_id})
+
+
+@cache_response(Semester, Subject, Note, Comment, Rating, DOWNLOADS)
+@api_view
+async def note_detail(request, pk):
+    return await _retrieve(views.NoteDetailView, request, {'pk': pk})
+
+
+@cache_response(Subject, Note, Rating, DOWNLOADS)
+@api_view
+async def featured_notes(request):
+    notes = NoteListSerializer.prune_queryset(Note.objects.filter(is_featured=True), request)[:6]
+    notes = [note async for note in notes]
+    serializer = NoteListSerializer(
+        notes, many=True, fields=NoteListSerializer.requested_fields(request), context=await _context(notes),
+    )
+    with serializing():
+        data = serializer.data
+    return _render(request, data)
+
+
+@cache_control(public=True, max_age=60)
+@api_view
+async def stats(request):
+    """Platform totals, served from the snapshot row in notes.stats"""
+    snapshot = await sync_to_async(get_stats_snapshot)()
+    response = _render(request, snapshot)
+    response['ETag'] = snapshot_etag(snapshot)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+@api_view
+async def download_note(request, pk):
+    """Download note file, streamed without holding a thread"""
+    try:
+        note = await Note.objects.aget(pk=pk)
+        # Checks and stats the file on disk, so not on the event loop
+        response = await sync_to_async(views.note_file_response)(request, note, asynchronous=True)
+    except Exception as e:
+        raise Http404(f"Download error: {str(e)}")
+    if is_new_download(request, response):
+        # Buffered; applied to the row in bulk by notes.counters
+        await sync_to_async(download_counter.record)(note.pk)
+    return response
@@ -0,0 +1,162 @@
+"""
+Versioned response cache for the read-only catalog endpoints.
+
+Every model has a generation number in the cache. Save/delete signals bump
+it (see notes.signals), and so does any code path that changes rows with
+queryset.update(). A cached response's key includes the generations of the
+models it was built from, so any edit to one of them makes old entries
+unreachable. Nothing is deleted explicitly.
+
+Download counts are the exception. A download is buffered (notes.counters)
+and shown as the stored count plus the pending one, without bumping Note.
+When a flush writes the counts to the notes it bumps only DOWNLOADS, which
+the endpoints that show counts list among their models; their cached
+counts are at most one flush interval old.
+
+Hits, including If-None-Match revalidations answered with 304, are served
+from the cache alone without touching the database.
+
+The generations only invalidate every worker's entries if the workers share
+one cache. With a per-process cache (LocMemCache), an edit handled by one
+worker would leave the others serving their old entries, so caching is off
+unless settings.RESPONSE_CACHE is set; it defaults to on only with Redis.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from . import replicas
+
+GENERATION_KEY = 'generation:{}'
+RESPONSE_KEY = 'response:{}'
+DEFAULT_TIMEOUT = 60 * 15
+# Stands in for a model in cache_response() and bump_generation()
+DOWNLOADS = 'notes.downloads'
+
+
+def _generation_key(model):
+    return GENERATION_KEY.format(model if isinstance(model, str) else model._meta.label_lower)
+
+
+def _bump(models):
+    for model in models:
+        key = _generation_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Start from the clock so an evicted counter can't repeat old values
+            cache.set(key, time.time_ns(), timeout=None)
+    replicas.record_write()
+
+
+def bump_generation(*models):
+    """Invalidate cached responses built from ``models`` once the current
+    transaction commits"""
+    transaction.on_commit(lambda: _bump(models))
+
+
+def get_generations(models):
+    keys = [_generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, time.time_ns(), timeout=None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def response_key(request, models):
+    parts = [
+        request.scheme,
+        request.get_host(),
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        request.META.get('HTTP_ACCEPT', ''),
+        *map(str, get_generations(models)),
+    ]
+    return RESPONSE_KEY.format(hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest())
+
+
+def _etag(content):
+    return '"%s"' % hashlib.md5(content, usedforsecurity=False).hexdigest()
+
+
+def _matches(request, etag):
+    # Weak comparison: compressed responses carry the weak form of the ETag
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    return bool(if_none_match) and etag in [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+
+
+def _build(request, content, content_type, etag):
+    if _matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _lookup(request, models):
+    key = response_key(request, models)
+    return key, cache.get(key)
+
+
+def _store(request, key, response, timeout):
+    if response.status_code != 200 or response.streaming:
+        return response
+    if replicas.may_be_stale():
+        # Built from a replica that may lag behind the write that bumped the generation
+        return response
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    content = response.content
+    etag = _etag(content)
+    cache.set(key, (content, response['Content-Type'], etag), timeout)
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept'])
+    if _matches(request, etag):
+        return _build(request, content, response['Content-Type'], etag)
+    return response
+
+
+def cache_response(*models, timeout=DEFAULT_TIMEOUT):
+    """Cache successful GET responses until one of ``models`` changes.
+
+    Works on function views, async views and, via method_decorator, on a
+    view's dispatch.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def awrapped(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or not settings.RESPONSE_CACHE:
+                    return await view_func(request, *args, **kwargs)
+
+                key, cached = await sync_to_async(_lookup)(request, models)
+                if cached is not None:
+                    return _build(request, *cached)
+                response = await view_func(request, *args, **kwargs)
+                return await sync_to_async(_store)(request, key, response, timeout)
+            return awrapped
+
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not settings.RESPONSE_CACHE:
+                return view_func(request, *args, **kwargs)
+
+            key, cached = _lookup(request, models)
+            if cached is not None:
+                return _build(request, *cached)
+            response = view_func(request, *args, **kwargs)
+            return _store(request, key, response, timeout)
+        return wrapped
+    return decorator
@@ -0,0 +1,208 @@
+"""
+Write-behind download counters.
+
+Downloads are recorded as pending increments in the cache, which is shared
+between workers when a shared backend such as Redis is configured. If the
+cache is unavailable, or is the dummy backend, increments go to an
+in-process buffer instead. Pending increments are applied in bulk with
+``F('downloads') + n``:
+
+* from a timer thread in each worker every DOWNLOAD_COUNTER_FLUSH_INTERVAL
+  seconds, and when the process exits;
+* by ``manage.py flush_download_counters``, for shared cache backends.
+
+A flush decrements the cached counts only after its update has committed,
+so a failed flush leaves them for the next one. Readers add the pending
+delta to the stored value (see NoteListSerializer.downloads), so clients
+still see fresh counts; within a process, pending() waits for a running
+flush so a download isn't counted both in the row and in the buffer.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.db import connections, transaction
+from django.db.models import F
+
+from . import stats
+from .cache import DOWNLOADS, bump_generation
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'note-downloads:pending:{}'
+FLUSH_LOCK_KEY = 'note-downloads:flush-lock'
+
+
+class DownloadCounter:
+    def __init__(self, cache_alias=None, flush_interval=None):
+        self.cache_alias = cache_alias
+        self.flush_interval = flush_interval
+        # _lock guards the buffers; _flush_lock is held by flush() from reading
+        # the buffers until the cache has been decremented
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = defaultdict(int)
+        self._dirty = set()
+        self._timer_pid = None
+        self._atexit_registered = False
+
+    @property
+    def cache(self):
+        alias = self.cache_alias or getattr(settings, 'DOWNLOAD_COUNTER_CACHE', 'default')
+        return caches[alias]
+
+    @property
+    def interval(self):
+        if self.flush_interval is not None:
+            return self.flush_interval
+        return getattr(settings, 'DOWNLOAD_COUNTER_FLUSH_INTERVAL', 30)
+
+    def _cache_usable(self, cache):
+        return not isinstance(cache, DummyCache)
+
+    def record(self, note_id, amount=1):
+        """Buffer ``amount`` downloads for a note"""
+        cache = self.cache
+        buffered = False
+        if self._cache_usable(cache):
+            key = PENDING_KEY.format(note_id)
+            try:
+                try:
+                    cache.incr(key, amount)
+                except ValueError:
+                    # Missing key; add() loses to a concurrent add, so retry the incr
+                    if not cache.add(key, amount, timeout=None):
+                        cache.incr(key, amount)
+                buffered = True
+            except Exception:
+                logger.warning('Download counter cache unavailable, buffering in-process', exc_info=True)
+        with self._lock:
+            if not buffered:
+                self._local[note_id] += amount
+            self._dirty.add(note_id)
+            if not self._atexit_registered:
+                atexit.register(self._flush_logged)
+                self._atexit_registered = True
+            # Threads don't survive a fork, so each worker starts its own
+            if self._timer_pid != os.getpid():
+                self._timer_pid = os.getpid()
+                threading.Thread(target=self._run_timer, daemon=True).start()
+
+    def pending(self, note_ids):
+        """Map of note id -> increments not yet written to the database"""
+        note_ids = list(note_ids)
+        result = {}
+        cache = self.cache
+        with self._flush_lock:
+            if note_ids and self._cache_usable(cache):
+                keys = {PENDING_KEY.format(note_id): note_id for note_id in note_ids}
+                try:
+                    for key, value in cache.get_many(list(keys)).items():
+                        if value:
+                            result[keys[key]] = value
+                except Exception:
+                    logger.warning('Download counter cache unavailable', exc_info=True)
+            with self._lock:
+                for note_id in note_ids:
+                    if self._local.get(note_id):
+                        result[note_id] = result.get(note_id, 0) + self._local[note_id]
+        return result
+
+    def flush(self, note_ids=None):
+        """Apply pending increments to the database; returns the number applied.
+
+        Without ``note_ids`` only the notes this process has recorded are
+        flushed. Must not be called inside a transaction.
+        """
+        from .models import Note
+
+        cache = self.cache
+        use_cache = self._cache_usable(cache)
+        # Only one process drains the shared buffer at a time, so a value read
+        # here can't also be applied by another worker
+        if use_cache and not cache.add(FLUSH_LOCK_KEY, 1, timeout=60):
+            return 0
+        try:
+            with self._flush_lock:
+                with self._lock:
+                    if note_ids is None:
+                        ids, self._dirty = self._dirty, set()
+                    else:
+                        ids = set(note_ids)
+                        self._dirty -= ids
+                    local = {
+                        note_id: self._local.pop(note_id)
+                        for note_id in list(self._local)
+                        if note_ids is None or note_id in ids
+                    }
+
+                cached = {}
+                try:
+                    if use_cache and ids:
+                        keys = {PENDING_KEY.format(note_id): note_id for note_id in ids}
+                        for key, value in cache.get_many(list(keys)).items():
+                            if value:
+                                cached[keys[key]] = value
+
+                    deltas = defaultdict(int, local)
+                    for note_id, value in cached.items():
+                        deltas[note_id] += value
+                    by_delta = defaultdict(list)
+                    for note_id, delta in deltas.items():
+                        by_delta[delta].append(note_id)
+                    applied = 0
+                    # durable: the decrements below must follow a real commit
+                    with transaction.atomic(durable=True):
+                        for delta, delta_ids in by_delta.items():
+                            rows = Note.objects.filter(pk__in=delta_ids).update(downloads=F('downloads') + delta)
+                            applied += rows * delta
+                        stats.adjust('total_downloads', applied)
+                        # Only cached responses that show download counts
+                        if applied:
+                            bump_generation(DOWNLOADS)
+                except Exception:
+                    # Nothing was applied; the cached counts were never touched
+                    # and the in-process ones go back for the next attempt
+                    with self._lock:
+                        self._dirty |= ids
+                        for note_id, delta in local.items():
+                            self._local[note_id] += delta
+                    raise
+
+                # decr rather than delete: increments that arrived after the
+                # read stay buffered for the next flush
+                for note_id, value in cached.items():
+                    try:
+                        cache.decr(PENDING_KEY.format(note_id), value)
+                    except Exception:
+                        logger.exception('Applied %s downloads of note %s but could not remove them from the cache',
+                                         value, note_id)
+                return sum(deltas.values())
+        finally:
+            if use_cache:
+                cache.delete(FLUSH_LOCK_KEY)
+
+    def _flush_logged(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to flush download counters')
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                idle = not self._dirty
+            if not idle:
+                self._flush_logged()
+                # The flush opened this thread's own database connection
+                connections.close_all()
+
+
+download_counter = DownloadCounter()
@@ -0,0 +1,214 @@
+"""
+File responses with HTTP caching and byte-range support.
+
+serve_file() answers conditional requests (If-None-Match / If-Modified-Since)
+with 304 and Range requests with 206, using multipart/byteranges for several
+ranges. PDF viewers can then fetch pages incrementally and revalidate
+instead of downloading the whole file again.
+
+With ``asynchronous=True`` the body is an async iterator that reads each
+chunk in a worker thread. Under ASGI a slow client then holds a suspended
+coroutine rather than a thread. Django would otherwise buffer a sync
+iterator's whole body in memory before sending it.
+"""
+import asyncio
+import mimetypes
+import os
+import secrets
+
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+# More ranges than this is treated as abuse and answered with the whole file
+MAX_RANGES = 16
+
+
+def file_etag(stat):
+    """Strong validator from the file's size and modification time"""
+    return quote_etag('%x-%x' % (stat.st_size, stat.st_mtime_ns))
+
+
+def parse_range_header(header, size):
+    """Return a list of (start, end) inclusive byte ranges, [] if unsatisfiable,
+    or None if the header should be ignored"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        start, sep, end = part.partition('-')
+        if not sep:
+            return None
+        try:
+            if start:
+                start = int(start)
+                end = int(end) if end else size - 1
+                if end < start and start < size:
+                    return None
+            else:
+                # Suffix range: the last N bytes
+                length = int(end)
+                start, end = max(size - length, 0), size - 1
+                if length == 0:
+                    continue
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in etags]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _range_applies(request, etag, mtime):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Strong comparison only
+        return not if_range.startswith('W/') and if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and int(mtime) <= if_range_date
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fh.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _aread_range(path, start, end):
+    fh = await asyncio.to_thread(open, path, 'rb')
+    try:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(fh.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+def _part_header(boundary, content_type, start, end, size):
+    return (
+        f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+        f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+    ).encode()
+
+
+def _multipart(path, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield _part_header(boundary, content_type, start, end, size)
+        yield from _read_range(path, start, end)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+async def _amultipart(path, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield _part_header(boundary, content_type, start, end, size)
+        async for chunk in _aread_range(path, start, end):
+            yield chunk
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def serve_file(request, path, filename, etag=None, as_attachment=True, asynchronous=False):
+    """Build a 200/206/304/416 response for ``path``; ``asynchronous`` streams
+    the body through an async iterator, for async views"""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = etag or file_etag(stat)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    validators = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': 'public, max-age=0, must-revalidate',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        ranges = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and _range_applies(request, etag, stat.st_mtime):
+            ranges = parse_range_header(range_header, size)
+
+        if ranges is None and asynchronous:
+            response = StreamingHttpResponse(_aread_range(path, 0, size - 1), content_type=content_type)
+            response['Content-Length'] = str(size)
+        elif ranges is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            read = _aread_range if asynchronous else _read_range
+            response = StreamingHttpResponse(read(path, start, end), status=206, content_type=content_type)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            boundary = secrets.token_hex(16)
+            body_length = sum(
+                len(_part_header(boundary, content_type, start, end, size)) + (end - start + 1) + 2
+                for start, end in ranges
+            ) + len(f'--{boundary}--\r\n')
+            multipart = _amultipart if asynchronous else _multipart
+            response = StreamingHttpResponse(
+                multipart(path, ranges, size, content_type, boundary),
+                status=206,
+                content_type=f'multipart/byteranges; boundary={boundary}',
+            )
+            response['Content-Length'] = str(body_length)
+
+        if response.status_code in (200, 206):
+            disposition = 'attachment' if as_attachment else 'inline'
+            response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+
+    for header, value in validators.items():
+        response[header] = value
+    return response
+
+
+def is_new_download(request, response):
+    """Whether a served response should count as a download: full bodies and
+    range requests starting at the first byte, but not revalidations"""
+    if response.status_code == 200:
+        return True
+    if response.status_code == 206:
+        _, _, spec = request.META.get('HTTP_RANGE', '').partition('=')
+        return spec.strip().startswith('0-')
+    return False
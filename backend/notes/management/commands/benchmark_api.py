@@ -0,0 +1,207 @@
+import json
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from notes import urls as note_urls
+from notes.models import Comment, Note, Rating, Semester, Subject
+
+# Extra query strings to time per route, besides the bare URL
+VARIANTS = {
+    'note-list': ['?search=algorithm', '?tag=algorithm', '?type=exam&chapter=Chapter 3',
+                  '?pagination=cursor', '?page=50'],
+    'subject-notes': ['?pagination=cursor', '?search=network'],
+    'note-facets': ['?search=algorithm'],
+    'note-detail': ['?slim=true'],
+}
+
+# Routes that only accept POST, with a request body factory
+WRITES = {
+    'increment-download': lambda i: {},
+    'create-comment': lambda i: {'author_name': 'Bench', 'author_email': f'bench{i}@example.com', 'content': 'Benchmark'},
+    'create-rating': lambda i: {'author_name': 'Bench', 'author_email': f'bench{i}@example.com', 'score': 4},
+    'create-feedback': lambda i: {'name': 'Bench', 'email': 'bench@example.com', 'subject': 'Benchmark',
+                                  'message': 'Benchmark'},
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every route in notes/urls.py through the test client and report p50/p95/p99 '
+        'latency, query count and response size. Save with --output and diff two runs '
+        'with --compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warm', action='store_true',
+                            help='Keep the response cache between requests (default: clear it before each one)')
+        parser.add_argument('--include-writes', action='store_true',
+                            help='Also time the POST-only routes; their writes are rolled back')
+        parser.add_argument('--routes', nargs='*', help='Only these route names')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='A previous --output file to diff against')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative p95 slowdown reported as a regression (default 0.2 = 20%%)')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('--iterations must be at least 2.')
+        self.options = options
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+        self.client = Client(HTTP_HOST=hosts[0] if hosts else 'testserver')
+        samples = self.sample_ids()
+
+        endpoints = {}
+        for pattern in note_urls.urlpatterns:
+            name = pattern.name
+            if options['routes'] and name not in options['routes']:
+                continue
+            kwargs = {key: samples[self.sample_kind(name, key)] for key in pattern.pattern.converters}
+            if None in kwargs.values():
+                self.stderr.write(f'Skipping {name}: no data to fill {kwargs}')
+                continue
+            path = reverse(name, kwargs=kwargs)
+            if name in WRITES:
+                if options['include_writes']:
+                    endpoints[name] = self.measure('POST', path, WRITES[name])
+                continue
+            endpoints[name] = self.measure('GET', path)
+            for query in VARIANTS.get(name, []):
+                endpoints[f'{name}{query}'] = self.measure('GET', path + query)
+
+        results = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'cache': 'warm' if options['warm'] else 'cold',
+                'rows': {model.__name__: model.objects.count()
+                         for model in (Semester, Subject, Note, Rating, Comment)},
+            },
+            'endpoints': endpoints,
+        }
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(f'Saved results to {options["output"]}')
+        if options['compare']:
+            with open(options['compare']) as fh:
+                regressions = self.compare(json.load(fh), results)
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} endpoints regressed: {", ".join(regressions)}')
+
+    def sample_ids(self):
+        """Representative rows: the busiest subject and the most-rated note"""
+        subject = Subject.objects.annotate(n=Count('notes')).order_by('-n').values_list('pk', 'semester_id').first()
+        note = Note.objects.order_by('-rating_count').values_list('pk', flat=True).first()
+        with_file = Note.objects.exclude(file='').exclude(file__isnull=True).values_list('pk', flat=True).first()
+        return {
+            'semester': subject[1] if subject else None,
+            'subject': subject[0] if subject else None,
+            'note': note,
+            'note-with-file': with_file,
+        }
+
+    def sample_kind(self, name, key):
+        if key != 'pk':
+            return key.removesuffix('_id')
+        if name == 'download-note':
+            return 'note-with-file'
+        for kind in ('semester', 'subject'):
+            if name.startswith(kind):
+                return kind
+        return 'note'
+
+    def request(self, method, path, data, i):
+        if method == 'GET':
+            return self.client.get(path, secure=True)
+        # A different client address each time, so the write throttles don't reject them
+        address = f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'
+        try:
+            with transaction.atomic():
+                response = self.client.post(path, data, content_type='application/json', secure=True,
+                                            REMOTE_ADDR=address)
+                raise Rollback
+        except Rollback:
+            return response
+
+    def measure(self, method, path, body=None):
+        timings, queries = [], []
+        size = status = None
+        for i in range(self.options['iterations']):
+            if not self.options['warm']:
+                cache.clear()
+            data = body(i) if body else None
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = self.request(method, path, data, i)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            size, status = len(content), response.status_code
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'method': method,
+            'path': path,
+            'status': status,
+            'p50_ms': round(cuts[49], 3),
+            'p95_ms': round(cuts[94], 3),
+            'p99_ms': round(cuts[98], 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'queries': max(queries),
+            'bytes': size,
+        }
+
+    def report(self, results):
+        meta = results['meta']
+        rows = ', '.join(f'{count} {name.lower()}s' for name, count in meta['rows'].items())
+        self.stdout.write(f'{meta["database"]}, {rows}; {meta["iterations"]} iterations, {meta["cache"]} cache')
+        self.stdout.write(f'{"endpoint":<48} {"status":>6} {"p50":>9} {"p95":>9} {"p99":>9} {"queries":>7} {"bytes":>9}')
+        for name, row in results['endpoints'].items():
+            self.stdout.write(
+                f'{name[:48]:<48} {row["status"]:>6} {row["p50_ms"]:>9.2f} {row["p95_ms"]:>9.2f} '
+                f'{row["p99_ms"]:>9.2f} {row["queries"]:>7} {row["bytes"]:>9}'
+            )
+
+    def compare(self, baseline, results):
+        tolerance = self.options['tolerance']
+        regressions = []
+        self.stdout.write(f'\nCompared with {baseline["meta"]["created_at"]}:')
+        for name, row in results['endpoints'].items():
+            old = baseline['endpoints'].get(name)
+            if old is None:
+                self.stdout.write(f'  {name}: new endpoint')
+                continue
+            change = (row['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0
+            flags = []
+            if change > tolerance:
+                flags.append(f'p95 {old["p95_ms"]:.2f} -> {row["p95_ms"]:.2f} ms ({change:+.0%})')
+            if row['queries'] > old['queries']:
+                flags.append(f'queries {old["queries"]} -> {row["queries"]}')
+            if flags:
+                regressions.append(name)
+                self.stdout.write(self.style.WARNING(f'  {name}: ' + '; '.join(flags)))
+        if not self.options['routes']:
+            for name in sorted(baseline['endpoints'].keys() - results['endpoints'].keys()):
+                self.stdout.write(f'  {name}: not measured in this run')
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('  No regressions.'))
+        return regressions
@@ -0,0 +1,92 @@
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from notes import renderers
+from notes_platform.middleware import CompressionMiddleware, brotli
+
+
+class Command(BaseCommand):
+    help = (
+        'Time serializer.data and each available renderer (stdlib JSON, orjson, '
+        'MessagePack) on one API page, and report the body size uncompressed, gzipped '
+        'and brotli-compressed as CompressionMiddleware would send it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/notes/?page_size=100')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('--iterations must be at least 2.')
+        self.iterations = options['iterations']
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+        self.host = hosts[0] if hosts else 'testserver'
+
+        serialize = self.serializer_call(options['path'])
+        data = serialize()
+        results = len(data['results']) if isinstance(data, dict) and 'results' in data else len(data)
+        self.stdout.write(
+            f'{options["path"]}: {results} results, serializer.data p50 '
+            f'{self.p50(serialize):.2f} ms over {self.iterations} iterations'
+        )
+
+        candidates = [('json (stdlib)', JSONRenderer())]
+        if renderers.orjson is not None:
+            candidates.append(('json (orjson)', renderers.FastJSONRenderer()))
+        if renderers.msgpack is not None:
+            candidates.append(('msgpack', renderers.MessagePackRenderer()))
+        encodings = ['gzip'] + (['br'] if brotli is not None else [])
+        middleware = CompressionMiddleware(lambda request: None)
+
+        header = f'{"renderer":<14} {"render p50":>10} {"bytes":>8}'
+        for encoding in encodings:
+            header += f' {encoding + " bytes":>10} {encoding + " p50":>9}'
+        self.stdout.write(header)
+        for label, renderer in candidates:
+            body = renderer.render(data, renderer.media_type)
+            row = f'{label:<14} {self.p50(lambda: renderer.render(data, renderer.media_type)):>10.2f} {len(body):>8}'
+            for encoding in encodings:
+                request = RequestFactory().get(options['path'], HTTP_ACCEPT_ENCODING=encoding)
+
+                def compress():
+                    return middleware.compress(request, HttpResponse(body, content_type=renderer.media_type))
+                row += f' {len(compress().content):>10} {self.p50(compress):>9.2f}'
+            self.stdout.write(row)
+        self.stdout.write(
+            f'Times in ms. Responses under COMPRESSION_MIN_SIZE ({middleware.min_size} bytes) are sent '
+            f'uncompressed; brotli quality is {middleware.brotli_quality}.'
+        )
+
+    def serializer_call(self, path):
+        """A function that runs the view's serializer over the page ``path``
+        selects, returning what the view would render"""
+        match = resolve(urlsplit(path).path)
+        view_class = getattr(match.func, 'view_class', None)
+        if view_class is None:
+            raise CommandError(f'{path} is not served by a class-based DRF view.')
+        request = Request(RequestFactory().get(path, secure=True, HTTP_HOST=self.host))
+        view = view_class(request=request, args=(), kwargs=match.kwargs, format_kwarg=None)
+        queryset = view.filter_queryset(view.get_queryset())
+        page = view.paginate_queryset(queryset)
+        if page is None:
+            rows = list(queryset)
+            return lambda: view.get_serializer(rows, many=True).data
+        return lambda: view.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+    def p50(self, func):
+        timings = []
+        for _ in range(self.iterations):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,113 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.models import Note, Semester, Subject
+from notes.search import build_search_text, search_notes
+
+BENCH_SUBJECT_CODE = 'BENCH-SEARCH'
+
+WORDS = (
+    'algorithm analysis binary circuit compiler database differential digital '
+    'electronics engineering equation fourier graph integral kernel laplace '
+    'linear logic machine matrix mechanics network operating probability '
+    'processor protocol quantum recursion signal statistics structure system '
+    'thermodynamics transform tree vector voltage wave'
+).split()
+
+SYLLABLES = 'ba ce di fo gu ka le mi no pu ra se ti vo zu'.split()
+
+
+def vocabulary(size=5000):
+    """Topical words followed by deterministic pseudo-words, most common first"""
+    words = list(WORDS)
+    n = len(SYLLABLES)
+    i = 0
+    while len(words) < size:
+        words.append(SYLLABLES[i % n] + SYLLABLES[(i // n) % n] + SYLLABLES[(i // n // n) % n] + 'x')
+        i += 1
+    return words
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare p50/p95 latency of the ranked full-text search against the old '
+        'title__icontains filter. Use a scratch database: --seed inserts notes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Insert this many synthetic notes under a dedicated subject first')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the synthetic notes when done')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'])
+        if not Note.objects.exists():
+            raise CommandError('No notes to search; pass --seed N.')
+
+        rng = random.Random(42)
+        words = vocabulary()
+        terms = [' '.join(rng.sample(words, rng.choice([1, 1, 2]))) for _ in range(options['queries'])]
+        page_size = options['page_size']
+        base = Note.objects.select_related('subject')
+
+        results = {
+            'icontains': self.measure(terms, lambda term: base.filter(title__icontains=term)[:page_size]),
+            'fulltext': self.measure(terms, lambda term: search_notes(base, term)[:page_size]),
+        }
+        self.stdout.write(f'{Note.objects.count()} notes, {len(terms)} queries, page size {page_size}')
+        for name, timings in results.items():
+            self.stdout.write(
+                f'{name:>10}: p50 {self.percentile(timings, 50):8.2f} ms'
+                f'   p95 {self.percentile(timings, 95):8.2f} ms'
+            )
+
+        if options['cleanup']:
+            Subject.objects.filter(code=BENCH_SUBJECT_CODE).delete()
+
+    def seed(self, count):
+        semester = Semester.objects.order_by('number').first()
+        if semester is None:
+            semester = Semester.objects.create(number=1, name='Benchmark')
+        subject, _ = Subject.objects.get_or_create(
+            code=BENCH_SUBJECT_CODE, defaults={'semester': semester, 'name': 'Search Benchmark'}
+        )
+        rng = random.Random(7)
+        words = vocabulary()
+        # Zipf-like word frequencies, so queries range from common to rare terms
+        weights = [1 / (rank + 1) for rank in range(len(words))]
+        batch = []
+        for i in range(count):
+            note = Note(
+                subject=subject,
+                title=' '.join(rng.choices(words, weights, k=3)).title(),
+                description=' '.join(rng.choices(words, weights, k=25)),
+                content=' '.join(rng.choices(words, weights, k=120)),
+                tags=','.join(rng.choices(words, weights, k=3)),
+                chapter=f'Chapter {rng.randint(1, 12)}',
+            )
+            # bulk_create bypasses Note.save(), so fill the indexed text here
+            note.search_text = build_search_text(note)
+            batch.append(note)
+            if len(batch) == 1000:
+                Note.objects.bulk_create(batch)
+                batch = []
+        Note.objects.bulk_create(batch)
+        self.stdout.write(f'Seeded {count} notes under {BENCH_SUBJECT_CODE}.')
+
+    def measure(self, terms, build_queryset):
+        timings = []
+        for term in terms:
+            start = time.perf_counter()
+            list(build_queryset(term))
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def percentile(self, timings, pct):
+        return statistics.quantiles(timings, n=100)[pct - 1]
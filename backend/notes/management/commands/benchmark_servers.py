@@ -0,0 +1,216 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from notes.models import Note, Semester, Subject
+
+BENCH_SUBJECT_CODE = 'BENCH-SERVERS'
+READ_PATHS = ['/api/notes/', '/api/subjects/', '/api/semesters/', '/api/featured-notes/', '/api/stats/']
+# Small client receive buffers, so a slow reader pushes back on the server
+# instead of the kernel buffering the whole file
+RECEIVE_BUFFER = 64 * 1024
+READ_CHUNK = 16 * 1024
+
+SERVERS = {
+    'wsgi': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'notes_platform.wsgi:application',
+        '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'error',
+    ],
+    'asgi': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'notes_platform.asgi:application',
+        '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port), '--log-level', 'error',
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the app under gunicorn sync workers (WSGI) and under uvicorn (ASGI, '
+        'async views), with the same number of workers. Slow clients download a note '
+        'file at a throttled rate while other clients poll the read endpoints. The '
+        'report gives download throughput and read latency for each server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--duration', type=float, default=20, help='Seconds of load per server')
+        parser.add_argument('--slow-clients', type=int, default=200, help='Concurrent throttled downloads')
+        parser.add_argument('--rate', type=int, default=256, help='Download speed of each slow client, in KB/s')
+        parser.add_argument('--readers', type=int, default=10, help='Concurrent clients polling the read endpoints')
+        parser.add_argument('--timeout', type=float, default=10, help='A read slower than this counts as an error')
+        parser.add_argument('--file-size', type=int, default=0,
+                            help='Download a temporary note with a random file of this many MB '
+                                 '(default: the largest existing note file)')
+
+    def handle(self, *args, **options):
+        self.options = options
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+        self.host = hosts[0] if hosts else 'localhost'
+
+        note = self.temporary_note(options['file_size']) if options['file_size'] else self.largest_note()
+        if note is None:
+            raise CommandError('No note has a file to download; pass --file-size MB.')
+        self.download_path = f'/api/notes/{note.pk}/download/'
+        self.stdout.write(
+            f'{options["slow_clients"]} downloads of {note.file.size / 1024 ** 2:.1f} MB at {options["rate"]} KB/s '
+            f'and {options["readers"]} readers, {options["workers"]} workers, {options["duration"]:.0f}s per server'
+        )
+        try:
+            results = {name: self.run_server(name) for name in options['servers']}
+        finally:
+            if options['file_size']:
+                Subject.objects.filter(code=BENCH_SUBJECT_CODE).delete()
+        self.report(results)
+
+    def largest_note(self):
+        notes = Note.objects.exclude(Q(file='') | Q(file__isnull=True))
+        sized = [(note.file.size, note.pk, note) for note in notes.iterator() if note.file.storage.exists(note.file.name)]
+        return max(sized)[2] if sized else None
+
+    def temporary_note(self, megabytes):
+        semester = Semester.objects.order_by('number').first()
+        if semester is None:
+            semester = Semester.objects.create(number=1, name='Benchmark')
+        subject, _ = Subject.objects.get_or_create(
+            code=BENCH_SUBJECT_CODE, defaults={'semester': semester, 'name': 'Server Benchmark'}
+        )
+        note = Note(subject=subject, title='Server benchmark', description='Temporary')
+        with tempfile.TemporaryFile() as fh:
+            for _ in range(megabytes):
+                fh.write(os.urandom(1024 ** 2))
+            fh.seek(0)
+            note.file.save('benchmark.bin', File(fh), save=False)
+        note.save()
+        return note
+
+    def run_server(self, name):
+        port = self.options['port']
+        env = {**os.environ, 'ASYNC_VIEWS': 'true' if name == 'asgi' else 'false'}
+        command = SERVERS[name](port, self.options['workers'])
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+        try:
+            self.wait_until_listening(port, process)
+            return asyncio.run(self.load(port))
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def wait_until_listening(self, port, process):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'{" ".join(process.args[:4])} exited with status {process.returncode}.')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Nothing is listening on port {port} after 30 seconds.')
+
+    async def request(self, port, path, rate=None):
+        """GET ``path``; returns (status, bytes, seconds to first byte).
+        ``rate`` throttles reading the body to that many bytes per second."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        sock.setblocking(False)
+        start = time.perf_counter()
+        await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        try:
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: close\r\n\r\n'.encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            first_byte = time.perf_counter() - start
+            status = int(status_line.split()[1])
+            received = len(status_line)
+            while chunk := await reader.read(READ_CHUNK):
+                received += len(chunk)
+                if rate:
+                    await asyncio.sleep(len(chunk) / rate)
+            return status, received, first_byte
+        finally:
+            writer.close()
+
+    async def load(self, port):
+        deadline = time.monotonic() + self.options['duration']
+        downloads, reads = [], []
+        errors = {'downloads': 0, 'reads': 0}
+
+        async def slow_client():
+            while time.monotonic() < deadline:
+                try:
+                    status, size, first_byte = await self.request(port, self.download_path, self.options['rate'] * 1024)
+                    downloads.append((status, size, first_byte))
+                except (OSError, ValueError, IndexError):
+                    errors['downloads'] += 1
+                    await asyncio.sleep(0.1)
+
+        async def reader(offset):
+            i = offset
+            while time.monotonic() < deadline:
+                path = READ_PATHS[i % len(READ_PATHS)]
+                i += 1
+                started = time.perf_counter()
+                try:
+                    status, _, _ = await asyncio.wait_for(self.request(port, path), self.options['timeout'])
+                    if status != 200:
+                        raise ValueError(status)
+                    reads.append(time.perf_counter() - started)
+                except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+                    errors['reads'] += 1
+
+        tasks = [asyncio.create_task(slow_client()) for _ in range(self.options['slow_clients'])]
+        tasks += [asyncio.create_task(reader(i)) for i in range(self.options['readers'])]
+        started = time.monotonic()
+        # Downloads still in progress at the deadline are abandoned
+        await asyncio.wait(tasks, timeout=self.options['duration'] + self.options['timeout'])
+        elapsed = time.monotonic() - started
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        completed = [row for row in downloads if row[0] == 200]
+        return {
+            'downloads': len(completed),
+            'download_mb_s': sum(size for _, size, _ in completed) / 1024 ** 2 / elapsed,
+            'ttfb': [first_byte * 1000 for _, _, first_byte in completed],
+            'reads': len(reads),
+            'reads_s': len(reads) / elapsed,
+            'latency': [seconds * 1000 for seconds in reads],
+            'errors': errors,
+        }
+
+    def percentile(self, values, pct):
+        if len(values) < 2:
+            return values[0] if values else float('nan')
+        return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"server":<6} {"downloads":>9} {"MB/s":>7} {"ttfb p50":>9} {"ttfb p95":>9} '
+            f'{"reads/s":>8} {"read p50":>9} {"read p95":>9} {"read p99":>9} {"errors":>7}'
+        )
+        for name, row in results.items():
+            self.stdout.write(
+                f'{name:<6} {row["downloads"]:>9} {row["download_mb_s"]:>7.1f} '
+                f'{self.percentile(row["ttfb"], 50):>9.1f} {self.percentile(row["ttfb"], 95):>9.1f} '
+                f'{row["reads_s"]:>8.1f} {self.percentile(row["latency"], 50):>9.1f} '
+                f'{self.percentile(row["latency"], 95):>9.1f} {self.percentile(row["latency"], 99):>9.1f} '
+                f'{row["errors"]["downloads"] + row["errors"]["reads"]:>7}'
+            )
+        self.stdout.write('Latencies in ms. Errors are failed downloads plus reads that timed out or did not return 200.')
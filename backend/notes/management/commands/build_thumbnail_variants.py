@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from notes.cache import bump_generation
+from notes.models import Note, Subject
+from notes.thumbnails import refresh_variants
+
+
+def _init_worker():
+    # Safe under both fork and spawn; forked children must not reuse the
+    # parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+def _refresh_batch(label, pks, force):
+    model = apps.get_model(label)
+    updated = failed = 0
+    for pk in pks:
+        try:
+            updated += refresh_variants(model, pk, force=force)
+        except Exception:
+            failed += 1
+    return updated, failed
+
+
+class Command(BaseCommand):
+    help = 'Build missing or outdated thumbnail variants for subjects and notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--force', action='store_true', help='Rebuild variants that look up to date')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        force = options['force']
+        jobs = []
+        for model in (Subject, Note):
+            rows = model.objects.exclude(Q(thumbnail='') | Q(thumbnail__isnull=True)).order_by('pk')
+            pks = [
+                pk for pk, thumbnail, source in rows.values_list('pk', 'thumbnail', 'thumbnail_variants__source')
+                if force or thumbnail != source
+            ]
+            jobs += [(model._meta.label, pks[i:i + batch_size]) for i in range(0, len(pks), batch_size)]
+
+        updated = failed = 0
+        if jobs:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=max(options['processes'], 1), initializer=_init_worker) as pool:
+                futures = [pool.submit(_refresh_batch, label, pks, force) for label, pks in jobs]
+                for future in as_completed(futures):
+                    batch_updated, batch_failed = future.result()
+                    updated += batch_updated
+                    failed += batch_failed
+            # Workers bump their own cache, which is not shared with a local-memory backend
+            bump_generation(Subject, Note)
+
+        self.stdout.write(self.style.SUCCESS(f'Built thumbnail variants for {updated} rows.'))
+        if failed:
+            self.stderr.write(f'{failed} thumbnails could not be processed.')
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from notes.cache import bump_generation
+from notes.models import Note
+from notes.storage import blob_name, digest_from_name, note_storage
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest(), os.path.getsize(path)
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Move note files stored under their upload names into the content-addressed '
+        'layout of notes.storage, sharing one blob between identical files'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without moving anything')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        directory = Note._meta.get_field('file').upload_to.strip('/')
+
+        # Legacy names -> the notes using them
+        legacy = defaultdict(list)
+        for pk, name in Note.objects.exclude(Q(file='') | Q(file__isnull=True)).values_list('pk', 'file'):
+            if not digest_from_name(name):
+                legacy[name].append(pk)
+
+        missing = [name for name in legacy if not note_storage.exists(name)]
+        names = [name for name in legacy if name not in missing]
+        paths = [note_storage.path(name) for name in names]
+        with ProcessPoolExecutor(max_workers=max(options['processes'], 1)) as pool:
+            hashes = list(pool.map(_hash_file, paths, chunksize=16))
+
+        moved = deduplicated = saved = 0
+        planned = set()
+        for name, path, (digest, size) in zip(names, paths, hashes):
+            target = blob_name(directory, digest, os.path.splitext(name)[1])
+            duplicate = target in planned or note_storage.exists(target)
+            planned.add(target)
+            if duplicate:
+                deduplicated += 1
+                saved += size
+            else:
+                moved += 1
+            if dry_run:
+                continue
+
+            if not duplicate:
+                target_path = note_storage.path(target)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                try:
+                    # Keep the old name valid until the rows point at the blob
+                    os.link(path, target_path)
+                except OSError:
+                    shutil.copy2(path, target_path)
+            Note.objects.filter(pk__in=legacy[name]).update(file=target, file_sha256=digest)
+            os.remove(path)
+
+        if not dry_run and (moved or deduplicated):
+            # update() skips the signals that invalidate cached API responses
+            bump_generation(Note)
+
+        prefix = 'Would move' if dry_run else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {moved} files into blobs and {"would merge" if dry_run else "merged"} '
+            f'{deduplicated} duplicates, saving {_format_size(saved)}.'
+        ))
+        if missing:
+            self.stderr.write(f'{len(missing)} note files are missing from storage and were left as they are.')
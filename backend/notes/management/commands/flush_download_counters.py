@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from notes.counters import download_counter
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = (
+        'Apply buffered download increments to the database. Only useful with a '
+        'shared cache backend; workers flush their in-process buffers themselves.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # This process never recorded anything itself, so check every note's key
+        batch_size = options['batch_size']
+        applied = 0
+        batch = []
+        for note_id in Note.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size):
+            batch.append(note_id)
+            if len(batch) == batch_size:
+                applied += download_counter.flush(batch)
+                batch = []
+        if batch:
+            applied += download_counter.flush(batch)
+        self.stdout.write(self.style.SUCCESS(f'Applied {applied} buffered downloads.'))
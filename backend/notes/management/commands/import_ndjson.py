@@ -0,0 +1,188 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from notes import stats
+from notes.aggregates import recount_rating_aggregates
+from notes.cache import bump_generation
+from notes.models import Comment, Note, Rating
+
+KINDS = {
+    'ratings': (Rating, ['author_name', 'author_email', 'score']),
+    'comments': (Comment, ['author_name', 'author_email', 'content']),
+}
+MAX_REPORTED_ERRORS = 20
+
+
+@contextmanager
+def keep_created_at(model):
+    """Let bulk_create store the created_at set on each row instead of the
+    current time"""
+    field = model._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Import ratings or comments from an NDJSON file, one object per line: '
+        '{"note": 12, "author_name": ..., "author_email": ..., "score": 4} for ratings, '
+        'with "content" instead of "score" for comments, and an optional ISO 8601 '
+        '"created_at". Rows are inserted with bulk_create, one transaction per batch. '
+        'A rating for a note and email that is already stored replaces it (or is '
+        'skipped with --keep-existing); a comment identical in note, email and '
+        'created_at to a stored one is skipped, so an interrupted import can be re-run. '
+        'Invalid lines and lines for missing notes are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(KINDS))
+        parser.add_argument('path', help='NDJSON file, or - for standard input')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keep-existing', action='store_true',
+                            help='Ratings: keep the stored rating when a line rates the same note and email')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        self.model, self.fields = KINDS[options['kind']]
+        self.keep_existing = options['keep_existing']
+        self.totals = {'read': 0, 'inserted': 0, 'updated': 0, 'skipped': 0}
+        started = time.monotonic()
+
+        try:
+            stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            with keep_created_at(self.model):
+                batch = []
+                for number, line in enumerate(stream, 1):
+                    if not line.strip():
+                        continue
+                    self.totals['read'] += 1
+                    row = self.parse(number, line)
+                    if row is not None:
+                        batch.append(row)
+                    if len(batch) == options['batch_size']:
+                        self.flush(batch)
+                        batch = []
+                if batch:
+                    self.flush(batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # bulk_create skips the signals that maintain these
+        stats.reconcile()
+        bump_generation(Note, self.model)
+        elapsed = time.monotonic() - started
+        totals = self.totals
+        unchanged = totals['read'] - totals['skipped'] - totals['inserted'] - totals['updated']
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {totals["read"]} {options["kind"]}: inserted {totals["inserted"]}, updated {totals["updated"]}, '
+            f'unchanged {unchanged}, skipped {totals["skipped"]} in {elapsed:.1f}s '
+            f'({totals["read"] / max(elapsed, 1e-9):.0f} lines/s).'
+        ))
+
+    def parse(self, number, line):
+        """The model instance for one line, or None if it is invalid"""
+        try:
+            data = json.loads(line)
+            row = self.model(note_id=int(data['note']), **{name: data[name] for name in self.fields})
+            row.created_at = self.parse_created_at(data.get('created_at'))
+            row.clean_fields(exclude=['note'])
+        except KeyError as exc:
+            return self.skip(number, f'missing {exc}')
+        except ValidationError as exc:
+            return self.skip(number, '; '.join(f'{name}: {" ".join(errors)}' for name, errors in exc.message_dict.items()))
+        except (ValueError, TypeError) as exc:
+            return self.skip(number, exc)
+        row.line_number = number
+        return row
+
+    def parse_created_at(self, value):
+        if value is None:
+            return timezone.now()
+        created_at = parse_datetime(value)
+        if created_at is None:
+            raise ValueError(f'created_at: not an ISO 8601 date and time: {value!r}')
+        if settings.USE_TZ and timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        return created_at
+
+    def skip(self, number, reason):
+        self.totals['skipped'] += 1
+        if self.totals['skipped'] <= MAX_REPORTED_ERRORS:
+            self.stderr.write(f'Line {number}: {reason}')
+        elif self.totals['skipped'] == MAX_REPORTED_ERRORS + 1:
+            self.stderr.write('Not reporting further skipped lines.')
+        return None
+
+    def flush(self, batch):
+        with transaction.atomic():
+            note_ids = set(Note.objects.filter(pk__in={row.note_id for row in batch}).values_list('pk', flat=True))
+            rows = []
+            for row in batch:
+                if row.note_id in note_ids:
+                    rows.append(row)
+                else:
+                    self.skip(row.line_number, f'note {row.note_id} does not exist')
+            write = self.write_ratings if self.model is Rating else self.write_comments
+            inserted, updated = write(rows)
+            self.totals['inserted'] += inserted
+            self.totals['updated'] += updated
+        self.stdout.write(f'  {self.totals["read"]} lines, {self.totals["inserted"]} inserted')
+
+    def write_ratings(self, rows):
+        """Returns (inserted, updated). bulk_create can't tell inserts from
+        conflicts, so the notes' ratings are counted before and after."""
+        # Postgres refuses to upsert one row twice in a statement, so a repeated
+        # note and email within the batch keeps only its last line
+        ratings = list({(row.note_id, row.author_email): row for row in rows}.values())
+        note_ratings = Rating.objects.filter(note_id__in={rating.note_id for rating in ratings})
+        before = note_ratings.count()
+        if self.keep_existing:
+            Rating.objects.bulk_create(ratings, ignore_conflicts=True)
+        else:
+            Rating.objects.bulk_create(
+                ratings,
+                update_conflicts=True,
+                unique_fields=['note', 'author_email'],
+                update_fields=['author_name', 'score'],
+            )
+        recount_rating_aggregates({rating.note_id for rating in ratings})
+        inserted = note_ratings.count() - before
+        return inserted, 0 if self.keep_existing else len(ratings) - inserted
+
+    def write_comments(self, rows):
+        # Comments have no unique key; an exact repeat of a stored comment's
+        # note, email and time is taken to be the same comment
+        if not rows:
+            return 0, 0
+        times = [row.created_at for row in rows]
+        seen = set(
+            Comment.objects.filter(
+                note_id__in={row.note_id for row in rows},
+                created_at__range=(min(times), max(times)),
+            ).order_by().values_list('note_id', 'author_email', 'created_at')
+        )
+        comments = []
+        for row in rows:
+            key = (row.note_id, row.author_email, row.created_at)
+            if key not in seen:
+                seen.add(key)
+                comments.append(row)
+        Comment.objects.bulk_create(comments)
+        return len(comments), 0
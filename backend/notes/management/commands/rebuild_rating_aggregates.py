@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notes.aggregates import rebuild_rating_aggregates
+from notes.cache import bump_generation
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating_count/rating_sum columns on every note'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        note_ids = Note.objects.order_by('pk').values_list('pk', flat=True)
+        fixed = processed = 0
+        batch = []
+        for note_id in note_ids.iterator(chunk_size=batch_size):
+            batch.append(note_id)
+            if len(batch) == batch_size:
+                fixed += self._rebuild(batch)
+                processed += len(batch)
+                batch = []
+        if batch:
+            fixed += self._rebuild(batch)
+            processed += len(batch)
+        if fixed:
+            bump_generation(Note)
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {processed} notes, corrected {fixed}.'
+        ))
+
+    def _rebuild(self, note_ids):
+        with transaction.atomic():
+            return rebuild_rating_aggregates(note_ids)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from notes.models import Note
+from notes.search import build_search_text, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute Note.search_text and rebuild the full-text index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        using = options['database']
+        notes = Note.objects.using(using).select_related('subject').order_by('pk')
+        updated = 0
+        batch = []
+        with transaction.atomic(using=using):
+            for note in notes.iterator(chunk_size=batch_size):
+                text = build_search_text(note)
+                if text != note.search_text:
+                    note.search_text = text
+                    batch.append(note)
+                if len(batch) == batch_size:
+                    updated += len(batch)
+                    Note.objects.using(using).bulk_update(batch, ['search_text'])
+                    batch = []
+            updated += len(batch)
+            Note.objects.using(using).bulk_update(batch, ['search_text'])
+            rebuild_search_index(connections[using])
+        self.stdout.write(self.style.SUCCESS(f'Updated search text for {updated} notes and rebuilt the index.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from notes import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the platform stats snapshot row from the database'
+
+    def handle(self, *args, **options):
+        before = stats.get_snapshot()
+        after = stats.reconcile()
+        for name in stats.STAT_FIELDS:
+            marker = '' if before[name] == after[name] else f'  (was {before[name]})'
+            self.stdout.write(f'{name}: {after[name]}{marker}')
+        self.stdout.write(self.style.SUCCESS('Stats snapshot reconciled.'))
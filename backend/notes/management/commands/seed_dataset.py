@@ -0,0 +1,154 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notes import stats
+from notes.cache import bump_generation
+from notes.models import Comment, Note, Rating, Semester, Subject, Tag, parse_tags
+from notes.search import build_search_text
+
+from .benchmark_search import vocabulary
+
+SEED_CODE_PREFIX = 'SEED-'
+NOTE_TYPES = [choice for choice, _ in Note._meta.get_field('note_type').choices]
+
+
+class Command(BaseCommand):
+    help = (
+        'Insert a large synthetic dataset with bulk_create, for benchmarking. Use a '
+        'scratch database. Seeded subjects have codes starting with SEED-.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=400)
+        parser.add_argument('--notes', type=int, default=100_000)
+        parser.add_argument('--ratings', type=int, default=2_000_000)
+        parser.add_argument('--comments', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--random-seed', type=int, default=1)
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded data first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['random_seed'])
+        self.words = vocabulary()
+        # Zipf-like frequencies: a few popular words, subjects and notes, a long tail
+        self.word_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(self.words))))
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        if options['clear']:
+            deleted, _ = Subject.objects.filter(code__startswith=SEED_CODE_PREFIX).delete()
+            self.stdout.write(f'Deleted {deleted} previously seeded rows.')
+
+        subjects = self.seed_subjects(options['subjects'])
+        tag_ids = self.seed_tags()
+        notes_per_batch = self.batch_size
+        remaining = options['notes']
+        ratings_per_note = options['ratings'] / max(options['notes'], 1)
+        comments_per_note = options['comments'] / max(options['notes'], 1)
+        subject_weights = [1 / (rank + 1) ** 0.5 for rank in range(len(subjects))]
+        totals = {'notes': 0, 'ratings': 0, 'comments': 0}
+
+        while remaining > 0:
+            count = min(notes_per_batch, remaining)
+            with transaction.atomic():
+                notes = self.seed_notes(count, subjects, subject_weights, ratings_per_note)
+                self.seed_tag_index(notes, tag_ids)
+                totals['ratings'] += self.seed_ratings(notes)
+                totals['comments'] += self.seed_comments(notes, comments_per_note)
+            totals['notes'] += len(notes)
+            remaining -= count
+            self.stdout.write(f'  {totals["notes"]} notes, {totals["ratings"]} ratings, {totals["comments"]} comments')
+
+        # bulk_create skips the signals that maintain these
+        stats.reconcile()
+        bump_generation(Semester, Subject, Note, Comment, Rating)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(subjects)} subjects, {totals["notes"]} notes, {totals["ratings"]} ratings and '
+            f'{totals["comments"]} comments in {time.monotonic() - started:.0f}s.'
+        ))
+
+    def phrase(self, k):
+        return ' '.join(self.rng.choices(self.words, cum_weights=self.word_weights, k=k))
+
+    def seed_subjects(self, count):
+        semesters = []
+        for number in range(1, 9):
+            semester, _ = Semester.objects.get_or_create(number=number, defaults={'name': f'Semester {number}'})
+            semesters.append(semester)
+        start = Subject.objects.filter(code__startswith=SEED_CODE_PREFIX).count()
+        Subject.objects.bulk_create([
+            Subject(
+                semester=semesters[i % len(semesters)],
+                name=self.phrase(2).title(),
+                code=f'{SEED_CODE_PREFIX}{i:05d}',
+                description=self.phrase(30),
+                credits=self.rng.choice([2, 3, 3, 4]),
+            )
+            for i in range(start, start + count)
+        ], batch_size=self.batch_size)
+        return list(Subject.objects.filter(code__startswith=SEED_CODE_PREFIX).order_by('code'))
+
+    def seed_tags(self):
+        names = parse_tags(','.join(self.words[:300]))
+        Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        return dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+
+    def seed_notes(self, count, subjects, subject_weights, ratings_per_note):
+        notes = []
+        for subject in self.rng.choices(subjects, subject_weights, k=count):
+            # Ratings are generated up front so the stored aggregates can be set directly
+            n_ratings = min(int(self.rng.expovariate(1 / ratings_per_note)), 5000) if ratings_per_note else 0
+            scores = self.rng.choices((1, 2, 3, 4, 5), (1, 1, 3, 5, 4), k=n_ratings)
+            note = Note(
+                subject=subject,
+                title=self.phrase(4).title(),
+                description=self.phrase(25),
+                content=self.phrase(120),
+                tags=', '.join(self.rng.sample(self.words[:300], self.rng.randint(0, 4))),
+                chapter=f'Chapter {self.rng.randint(1, 12)}',
+                note_type=self.rng.choice(NOTE_TYPES),
+                downloads=int(self.rng.paretovariate(1.2) * 10),
+                is_featured=self.rng.random() < 0.002,
+                rating_count=len(scores),
+                rating_sum=sum(scores),
+            )
+            note.search_text = build_search_text(note)
+            note._seed_scores = scores
+            notes.append(note)
+        return Note.objects.bulk_create(notes, batch_size=self.batch_size)
+
+    def seed_tag_index(self, notes, tag_ids):
+        through = Note.tag_index.through
+        through.objects.bulk_create([
+            through(note_id=note.pk, tag_id=tag_ids[name])
+            for note in notes
+            for name in parse_tags(note.tags)
+            if name in tag_ids
+        ], batch_size=self.batch_size)
+
+    def seed_ratings(self, notes):
+        ratings = [
+            Rating(note_id=note.pk, author_name=f'User {i}', author_email=f'user{i}@example.com', score=score)
+            for note in notes
+            for i, score in enumerate(note._seed_scores)
+        ]
+        Rating.objects.bulk_create(ratings, batch_size=self.batch_size)
+        return len(ratings)
+
+    def seed_comments(self, notes, comments_per_note):
+        comments = [
+            Comment(
+                note_id=note.pk,
+                author_name=f'User {i}',
+                author_email=f'user{i}@example.com',
+                content=self.phrase(self.rng.randint(5, 60)),
+            )
+            for note in notes
+            for i in range(min(int(self.rng.expovariate(1 / comments_per_note)), 2000) if comments_per_note else 0)
+        ]
+        Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+        return len(comments)
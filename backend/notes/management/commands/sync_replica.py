@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from notes.replicas import replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database over the replica, to try the read-replica '
+        'routing locally. With --every the copy repeats, like a lagging replica. '
+        'Production replicas are kept in sync by the database server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=0,
+                            help='Keep copying every this many seconds until interrupted')
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError('No replica is configured; set DATABASE_REPLICA_URL.')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied.')
+        if primary.settings_dict['NAME'] == replica.settings_dict['NAME']:
+            raise CommandError('The primary and the replica are the same database.')
+
+        while True:
+            started = time.monotonic()
+            primary.ensure_connection()
+            replica.ensure_connection()
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f'Copied {primary.settings_dict["NAME"]} to {replica.settings_dict["NAME"]} '
+                              f'in {time.monotonic() - started:.2f}s.')
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,329 @@
+"""
+Per-request performance metrics.
+
+RequestMetricsMiddleware instruments a random sample of requests. The
+fraction is REQUEST_METRICS_SAMPLE_RATE, so unsampled requests cost one
+random() call. For each sampled request it measures:
+
+* SQL query count and time, through an execute_wrapper installed on every
+  database connection as it opens. Connections are per thread, and under
+  ASGI the async ORM runs queries in worker threads, so the wrapper finds
+  the request through a context variable;
+* view time, from the view being called until it returns;
+* serializer time, spent in the views' ``serializer.data`` calls, which
+  they wrap in serializing() (this includes queries that run lazily during
+  serialization);
+* render time and response size.
+
+The numbers are sent back in a ``Server-Timing`` header and added to
+per-route histograms. Each worker publishes its histograms to the cache
+every REQUEST_METRICS_PUBLISH_INTERVAL seconds, in one of MAX_SLOTS slots.
+The metrics view merges the published workers into Prometheus text format.
+A worker that stops publishing drops out when its entry expires, and its
+slot is free for a new worker.
+"""
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2)
+
+HISTOGRAMS = {
+    'notes_request_duration_seconds': ('Total time spent handling the request', DURATION_BUCKETS),
+    'notes_request_view_seconds': ('Time spent in the view', DURATION_BUCKETS),
+    'notes_request_db_seconds': ('Time spent executing SQL', DURATION_BUCKETS),
+    'notes_request_serialize_seconds': ('Time spent in serializer.data', DURATION_BUCKETS),
+    'notes_request_render_seconds': ('Time spent rendering the response', DURATION_BUCKETS),
+    'notes_request_queries': ('SQL queries per request', QUERY_BUCKETS),
+    'notes_response_size_bytes': ('Response body size', SIZE_BUCKETS),
+}
+
+SLOT_KEY = 'metrics:slot:{}'
+# Workers publishing at once; more than this and the extra ones aren't shown
+MAX_SLOTS = 256
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.view_start = None
+        self.render_start = None
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timings is not None:
+            timings.queries += 1
+            timings.db += time.perf_counter() - start
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created handler that adds _record_query to the connection"""
+    if _record_query not in connection.execute_wrappers:
+        # First, so execute_wrapper() blocks that are open while the
+        # connection is created pop their own wrapper when they exit
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+@contextmanager
+def serializing():
+    """Add the time spent in the block to the sampled request's serializer
+    time"""
+    timings = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.serialize += time.perf_counter() - start
+
+
+class SerializationTimingMixin:
+    """list(), retrieve() and create() as in DRF's mixins, with
+    serializer.data timed by serializing()"""
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(queryset if page is None else page, many=True)
+        with serializing():
+            data = serializer.data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        with serializing():
+            data = serializer.data
+        return Response(data)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        with serializing():
+            data = serializer.data
+        return Response(data, status=201, headers=self.get_success_headers(data))
+
+
+class Registry:
+    """Cumulative histograms keyed by (metric, route, method)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+        self._id = uuid.uuid4().hex
+        self._slot = None
+        self._last_publish = 0.0
+
+    def observe(self, route, method, status, values):
+        with self._lock:
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for metric, value in values.items():
+                buckets = HISTOGRAMS[metric][1]
+                counts, total = self.histograms.get((metric, route, method), ([0] * (len(buckets) + 1), 0.0))
+                counts = list(counts)
+                counts[next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))] += 1
+                self.histograms[(metric, route, method)] = (counts, total + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {'histograms': dict(self.histograms), 'requests': dict(self.requests), 'worker': self._id}
+
+    def publish(self, force=False):
+        interval = getattr(settings, 'REQUEST_METRICS_PUBLISH_INTERVAL', 15)
+        now = time.monotonic()
+        if not force and now - self._last_publish < interval:
+            return
+        self._last_publish = now
+        timeout = max(interval * 20, 300)
+        snapshot = self.snapshot()
+        try:
+            if self._slot is not None:
+                # Expired while this worker was idle, and maybe taken since
+                published = cache.get(SLOT_KEY.format(self._slot))
+                if published is None or published.get('worker') != self._id:
+                    self._slot = None
+            if self._slot is None:
+                # The first free slot; add() fails on one another worker holds
+                self._slot = next(
+                    (slot for slot in range(MAX_SLOTS) if cache.add(SLOT_KEY.format(slot), snapshot, timeout)),
+                    None,
+                )
+            else:
+                cache.set(SLOT_KEY.format(self._slot), snapshot, timeout)
+        except Exception:
+            # No usable shared cache; the metrics view falls back to this worker
+            pass
+
+    def collect(self):
+        """Snapshots of every worker that has published recently"""
+        self.publish(force=True)
+        try:
+            snapshots = list(cache.get_many([SLOT_KEY.format(slot) for slot in range(MAX_SLOTS)]).values())
+        except Exception:
+            snapshots = []
+        return snapshots or [self.snapshot()]
+
+
+registry = Registry()
+
+
+def _merge(snapshots):
+    histograms, requests = {}, {}
+    for snapshot in snapshots:
+        for key, count in snapshot['requests'].items():
+            requests[key] = requests.get(key, 0) + count
+        for key, (counts, total) in snapshot['histograms'].items():
+            previous = histograms.get(key)
+            if previous:
+                counts = [a + b for a, b in zip(previous[0], counts)]
+                total += previous[1]
+            histograms[key] = (counts, total)
+    return histograms, requests
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels.items())
+
+
+def render_prometheus(snapshots):
+    histograms, requests = _merge(snapshots)
+    lines = [
+        '# HELP notes_request_sample_rate Fraction of requests that are measured',
+        '# TYPE notes_request_sample_rate gauge',
+        f'notes_request_sample_rate {sample_rate()}',
+        '# HELP notes_requests_sampled_total Measured requests',
+        '# TYPE notes_requests_sampled_total counter',
+    ]
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f'notes_requests_sampled_total{{{_labels(route=route, method=method, status=status)}}} {count}')
+    for metric, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        for (name, route, method), (counts, total) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            labels = _labels(route=route, method=method)
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{labels}}} {total}')
+            lines.append(f'{metric}_count{{{labels}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def sample_rate():
+    return getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 0.1)
+
+
+def _sampled():
+    rate = sample_rate()
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def _ms(seconds):
+    return f'{seconds * 1000:.1f}'
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not _sampled():
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings)
+
+    async def __acall__(self, request):
+        if not _sampled():
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings)
+
+    def record(self, request, response, timings):
+        total = time.perf_counter() - timings.start
+        view_end = timings.render_start or (timings.start + total)
+        view = view_end - timings.view_start if timings.view_start else 0.0
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={_ms(timings.db)};desc="{timings.queries} queries"',
+            f'view;dur={_ms(view)}',
+            f'serialize;dur={_ms(timings.serialize)}',
+            f'render;dur={_ms(timings.render)}',
+            f'total;dur={_ms(total)}',
+        ])
+
+        match = request.resolver_match
+        registry.observe(match.route if match else 'unmatched', request.method, response.status_code, {
+            'notes_request_duration_seconds': total,
+            'notes_request_view_seconds': view,
+            'notes_request_db_seconds': timings.db,
+            'notes_request_serialize_seconds': timings.serialize,
+            'notes_request_render_seconds': timings.render,
+            'notes_request_queries': timings.queries,
+            'notes_response_size_bytes': size,
+        })
+        registry.publish()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _current.get()
+        if timings is not None:
+            timings.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns and this hook runs
+        timings = _current.get()
+        if timings is not None:
+            timings.render_start = time.perf_counter()
+
+            def rendered(response):
+                timings.render = time.perf_counter() - timings.render_start
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:30
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_rating_aggregates(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    Rating = apps.get_model('notes', 'Rating')
+    rows = Rating.objects.order_by().values('note_id').annotate(count=Count('id'), total=Sum('score'))
+    for row in rows.iterator():
+        Note.objects.filter(pk=row['note_id']).update(rating_count=row['count'], rating_sum=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+# Frozen copies of notes.search as of this migration, so that later changes
+# to that module don't change what it does
+
+FTS_TABLE = 'notes_note_fts'
+
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE notes_note ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(search_text, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS notes_note_search_vector_gin ON notes_note USING GIN (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS notes_note_search_vector_gin",
+    "ALTER TABLE notes_note DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_INSTALL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, search_text, content='notes_note', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS notes_note_fts_insert AFTER INSERT ON notes_note BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, search_text)
+        VALUES (new.id, new.title, new.search_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS notes_note_fts_delete AFTER DELETE ON notes_note BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, search_text)
+        VALUES ('delete', old.id, old.title, old.search_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS notes_note_fts_update AFTER UPDATE OF title, search_text ON notes_note BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, search_text)
+        VALUES ('delete', old.id, old.title, old.search_text);
+        INSERT INTO {FTS_TABLE}(rowid, title, search_text)
+        VALUES (new.id, new.title, new.search_text);
+    END
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS notes_note_fts_insert",
+    "DROP TRIGGER IF EXISTS notes_note_fts_delete",
+    "DROP TRIGGER IF EXISTS notes_note_fts_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+STATEMENTS = {
+    'postgresql': (POSTGRES_INSTALL, POSTGRES_UNINSTALL),
+    'sqlite': (SQLITE_INSTALL, SQLITE_UNINSTALL),
+}
+
+
+def build_search_text(note):
+    parts = [note.description, note.content, note.tags]
+    if note.subject_id:
+        parts += [note.subject.name, note.subject.code]
+    return '\n'.join(part for part in parts if part)
+
+
+def execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def populate_search_text(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    notes = Note.objects.select_related('subject')
+    batch = []
+    for note in notes.iterator(chunk_size=500):
+        note.search_text = build_search_text(note)
+        batch.append(note)
+        if len(batch) == 500:
+            Note.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    Note.objects.bulk_update(batch, ['search_text'])
+
+
+def create_search_index(apps, schema_editor):
+    populate_search_text(apps, schema_editor)
+    connection = schema_editor.connection
+    execute(connection, STATEMENTS.get(connection.vendor, ([], []))[0])
+    if connection.vendor == 'sqlite':
+        execute(connection, [f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"])
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    execute(connection, STATEMENTS.get(connection.vendor, ([], []))[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0002_note_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='search_text',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
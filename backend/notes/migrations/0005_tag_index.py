@@ -0,0 +1,57 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+def parse_tags(value):
+    # Frozen copy of notes.models.parse_tags as of this migration
+    names = []
+    for part in (value or '').split(','):
+        name = ' '.join(part.split()).lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def populate_tag_index(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    Tag = apps.get_model('notes', 'Tag')
+    Through = Note.tag_index.through
+    parsed = {
+        note_id: parse_tags(tags)
+        for note_id, tags in Note.objects.exclude(tags='').values_list('id', 'tags').iterator()
+    }
+    names = {name for tag_names in parsed.values() for name in tag_names}
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True, batch_size=500)
+    tag_ids = dict(Tag.objects.values_list('name', 'id'))
+    Through.objects.bulk_create(
+        [Through(note_id=note_id, tag_id=tag_ids[name]) for note_id, tag_names in parsed.items() for name in tag_names],
+        ignore_conflicts=True,
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0004_note_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='tag_index',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='notes', to='notes.tag'),
+        ),
+        migrations.RunPython(populate_tag_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0005_tag_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['note', '-created_at', '-id'], name='comment_note_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['note', '-created_at', '-id'], name='rating_note_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0007_thumbnail_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='file_sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
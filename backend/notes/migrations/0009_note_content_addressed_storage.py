@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:58
+
+import notes.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_note_file_sha256'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='note',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=notes.storage.get_note_storage, upload_to='notes/'),
+        ),
+    ]
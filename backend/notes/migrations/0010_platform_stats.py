@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0009_note_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlatformStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_semesters', models.BigIntegerField(default=0)),
+                ('total_subjects', models.BigIntegerField(default=0)),
+                ('total_notes', models.BigIntegerField(default=0)),
+                ('total_downloads', models.BigIntegerField(default=0)),
+                ('total_comments', models.BigIntegerField(default=0)),
+                ('total_ratings', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'platform stats',
+            },
+        ),
+    ]
@@ -1,6 +1,26 @@
-from django.db import models
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models import Avg, Case, Count, F, FloatField, Prefetch, Sum, When
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .search import build_search_text
+from .storage import digest_from_name, get_note_storage
+
+class SemesterQuerySet(models.QuerySet):
+    def with_counts(self):
+        """Annotate subject_count and note_count with one grouped query"""
+        return self.annotate(
+            subject_count=Count('subjects', distinct=True),
+            note_count=Count('subjects__notes'),
+        ).order_by('number')
+    
+    def with_tree(self):
+        """Prefetch every subject with its rollups; semester totals are summed in memory"""
+        subjects = Subject.objects.with_rollups().order_by('code')
+        return self.prefetch_related(Prefetch('subjects', queryset=subjects))
+
 class Semester(models.Model):
     number = models.IntegerField(unique=True, validators=[MinValueValidator(1), MaxValueValidator(8)])
     name = models.CharField(max_length=100)
@@ -8,20 +28,52 @@ class Semester(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = SemesterQuerySet.as_manager()
+    
     class Meta:
         ordering = ['number']
     
     def __str__(self):
         return f"Semester {self.number} - {self.name}"
     
+    def _prefetched_subjects(self):
+        return getattr(self, '_prefetched_objects_cache', {}).get('subjects')
+    
     @property
     def total_subjects(self):
+        if hasattr(self, 'subject_count'):
+            return self.subject_count
+        subjects = self._prefetched_subjects()
+        if subjects is not None:
+            return len(subjects)
         return self.subjects.count()
     
     @property
     def total_notes(self):
+        if hasattr(self, 'note_count'):
+            return self.note_count
+        subjects = self._prefetched_subjects()
+        if subjects is not None:
+            return sum(subject.total_notes for subject in subjects)
         return Note.objects.filter(subject__semester=self).count()
 
+class SubjectQuerySet(models.QuerySet):
+    def with_rollups(self):
+        """Annotate note_count, download_sum and rating_avg in the same query"""
+        # Per-note average from the stored aggregates; unrated notes count as 0
+        # to match Note.average_rating
+        note_average = Case(
+            When(notes__rating_count__gt=0,
+                 then=F('notes__rating_sum') * 1.0 / F('notes__rating_count')),
+            default=0.0,
+            output_field=FloatField(),
+        )
+        return self.annotate(
+            note_count=Count('notes'),
+            download_sum=Coalesce(Sum('notes__downloads'), 0),
+            rating_avg=Coalesce(Avg(note_average), 0.0),
+        )
+
 class Subject(models.Model):
     semester = models.ForeignKey(Semester, on_delete=models.CASCADE, related_name='subjects')
     name = models.CharField(max_length=200)
@@ -29,39 +81,84 @@ class Subject(models.Model):
     description = models.TextField(blank=True)
     credits = models.IntegerField(default=3)
     thumbnail = models.ImageField(upload_to='subject_thumbnails/', null=True, blank=True)
+    # Resized copies of ``thumbnail``, maintained by notes.thumbnails
+    thumbnail_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = SubjectQuerySet.as_manager()
+    
     class Meta:
         ordering = ['code']
     
     def __str__(self):
         return f"{self.code} - {self.name}"
     
+    def _rollup(self, name):
+        # Use the with_rollups() annotation when present, otherwise run it for this row
+        if not hasattr(self, name):
+            rollups = Subject.objects.with_rollups().filter(pk=self.pk).values(
+                'note_count', 'download_sum', 'rating_avg'
+            ).get()
+            for key, value in rollups.items():
+                setattr(self, key, value)
+        return getattr(self, name)
+    
     @property
     def total_notes(self):
-        return self.notes.count()
+        return self._rollup('note_count')
     
     @property
     def total_downloads(self):
-        return sum(note.downloads for note in self.notes.all())
+        return self._rollup('download_sum')
     
     @property
     def average_rating(self):
-        notes = self.notes.all()
-        if not notes:
-            return 0
-        total_rating = sum(note.average_rating for note in notes)
-        return total_rating / len(notes) if notes else 0
+        return self._rollup('rating_avg')
+
+def parse_tags(value):
+    """Split a comma-separated tag string into unique, normalized tag names"""
+    names = []
+    for part in (value or '').split(','):
+        name = ' '.join(part.split()).lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+
+class NoteQuerySet(models.QuerySet):
+    def tagged(self, names, match_any=False):
+        """Notes carrying all (or, with match_any, any) of the given tag names"""
+        through = Note.tag_index.through.objects
+        if match_any:
+            return self.filter(id__in=through.filter(tag__name__in=names).values('note_id'))
+        for name in names:
+            self = self.filter(id__in=through.filter(tag__name=name).values('note_id'))
+        return self
 
 class Note(models.Model):
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='notes')
     title = models.CharField(max_length=200)
     description = models.TextField()
     content = models.TextField(blank=True)
-    file = models.FileField(upload_to='notes/', null=True, blank=True)
+    # Stored by content digest, shared between notes; see notes.storage
+    file = models.FileField(upload_to='notes/', storage=get_note_storage, null=True, blank=True)
+    # SHA-256 of ``file``; also the blob's name and the download's ETag
+    file_sha256 = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
     thumbnail = models.ImageField(upload_to='note_thumbnails/', null=True, blank=True)
+    # Resized copies of ``thumbnail``, maintained by notes.thumbnails
+    thumbnail_variants = models.JSONField(default=dict, blank=True, editable=False)
     tags = models.CharField(max_length=200, blank=True, help_text="Comma-separated tags")
+    # Normalized copy of ``tags`` for indexed filtering, kept in sync by save()
+    tag_index = models.ManyToManyField(Tag, related_name='notes', blank=True, editable=False)
     chapter = models.CharField(max_length=100, blank=True)
     note_type = models.CharField(max_length=50, default='lecture', choices=[
         ('lecture', 'Lecture Notes'),
@@ -74,23 +171,72 @@ class Note(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     downloads = models.PositiveIntegerField(default=0)
     is_featured = models.BooleanField(default=False)
+    # Denormalized rating aggregates, maintained by the Rating signals in notes.signals
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    # Indexed by notes.search alongside the title
+    search_text = models.TextField(blank=True, editable=False)
+    
+    SEARCH_SOURCE_FIELDS = {'description', 'content', 'tags', 'subject', 'subject_id'}
+    
+    objects = NoteQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        # Match the (created_at, id) keyset used by notes.pagination
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='note_created_id_idx'),
+            models.Index(fields=['subject', '-created_at', '-id'], name='note_subject_created_id_idx'),
+            models.Index(fields=['is_featured', '-created_at', '-id'], name='note_featured_created_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.subject.code} - {self.title}"
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        stored = None
+        if self.file and not self.file._committed:
+            # Store the file first: its digest is only known once it is written
+            content = self.file.file
+            self.file.save(self.file.name, content, save=False)
+            stored = (self.file.name, content)
+        if update_fields is None or 'file' in update_fields:
+            if not self.file:
+                self.file_sha256 = ''
+            elif digest_from_name(self.file.name):
+                self.file_sha256 = digest_from_name(self.file.name)
+            if update_fields is not None:
+                kwargs['update_fields'] = update_fields = {*update_fields, 'file_sha256'}
+        if update_fields is None:
+            self.search_text = build_search_text(self)
+        elif self.SEARCH_SOURCE_FIELDS.intersection(update_fields):
+            self.search_text = build_search_text(self)
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
+        super().save(*args, **kwargs)
+        if stored:
+            # The blob may have been shared with a note whose release committed
+            # before this row did
+            transaction.on_commit(partial(self.file.storage.ensure, *stored))
+        if update_fields is None or 'tags' in update_fields:
+            self.sync_tag_index()
+    
+    def sync_tag_index(self):
+        """Point tag_index at the Tag rows named in ``tags``, creating missing ones"""
+        names = parse_tags(self.tags)
+        if names:
+            Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        self.tag_index.set(Tag.objects.filter(name__in=names))
+    
     @property
     def average_rating(self):
-        ratings = self.ratings.all()
-        if ratings:
-            return sum(rating.score for rating in ratings) / len(ratings)
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return 0
     
     @property
     def total_ratings(self):
-        return self.ratings.count()
+        return self.rating_count
 
 class Comment(models.Model):
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='comments')
@@ -101,6 +247,9 @@ class Comment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['note', '-created_at', '-id'], name='comment_note_created_id_idx'),
+        ]
     
     def __str__(self):
         return f'Comment by {self.author_name} on {self.note.title}'
@@ -114,6 +263,9 @@ class Rating(models.Model):
     
     class Meta:
         unique_together = ['note', 'author_email']
+        indexes = [
+            models.Index(fields=['note', '-created_at', '-id'], name='rating_note_created_id_idx'),
+        ]
     
     def __str__(self):
         return f'{self.score} stars by {self.author_name} for {self.note.title}'
@@ -137,3 +289,19 @@ class Feedback(models.Model):
     
     def __str__(self):
         return f'{self.feedback_type} - {self.subject}'
+
+class PlatformStats(models.Model):
+    """The one row behind /api/stats/, kept current by notes.stats"""
+    total_semesters = models.BigIntegerField(default=0)
+    total_subjects = models.BigIntegerField(default=0)
+    total_notes = models.BigIntegerField(default=0)
+    total_downloads = models.BigIntegerField(default=0)
+    total_comments = models.BigIntegerField(default=0)
+    total_ratings = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'platform stats'
+    
+    def __str__(self):
+        return 'Platform stats'
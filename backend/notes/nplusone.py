@@ -0,0 +1,182 @@
+"""
+N+1 query detection.
+
+While a detection scope is active, every SQL statement is reduced to a
+fingerprint (placeholders, literals and IN lists collapsed), and
+fingerprints are counted. One that repeats N_PLUS_ONE_THRESHOLD times or
+more is reported together with where the repetition came from: the
+innermost DRF serializer field being rendered, the innermost project frame
+(often a model property such as Subject.average_rating) and the view-level
+call site.
+
+Scopes are opened by
+
+* NPlusOneMiddleware, per request, when N_PLUS_ONE_MODE is 'log' or
+  'raise'. N_PLUS_ONE_SAMPLE_RATE limits logging to a fraction of requests
+  in production;
+* ``detect_n_plus_one()``, a context manager and decorator for tests. It
+  raises NPlusOneError by default.
+"""
+import logging
+import os
+import random
+import re
+import sys
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)', re.IGNORECASE), 'IN (...)'),
+    (re.compile(r'\s+'), ' '),
+]
+_IGNORED = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT')
+# Instrumentation frames are never the cause
+_SKIPPED_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.py'),
+}
+# Entry points that sit below every call site
+_ENTRY_POINTS = {'manage.py', 'wsgi.py', 'asgi.py'}
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def _is_project_file(filename):
+    base = str(settings.BASE_DIR)
+    return (
+        filename.startswith(base)
+        and 'site-packages' not in filename
+        and os.path.abspath(filename) not in _SKIPPED_FILES
+        and os.path.basename(filename) not in _ENTRY_POINTS
+    )
+
+
+def _relative(filename):
+    return os.path.relpath(filename, settings.BASE_DIR)
+
+
+def _origin(frame):
+    """(serializer field, innermost project frame, outermost project frame)"""
+    field_name = None
+    project_frames = []
+    while frame is not None:
+        code = frame.f_code
+        if field_name is None and code.co_name == 'to_representation' and 'field' in frame.f_locals:
+            field = frame.f_locals['field']
+            parent = getattr(field, 'parent', None)
+            if parent is not None and getattr(field, 'field_name', None):
+                field_name = f'{type(parent).__name__}.{field.field_name}'
+        if _is_project_file(code.co_filename):
+            project_frames.append(f'{_relative(code.co_filename)}:{frame.f_lineno} in {code.co_name}')
+        frame = frame.f_back
+    if not project_frames:
+        return field_name, None, None
+    return field_name, project_frames[0], project_frames[-1]
+
+
+class Finding:
+    def __init__(self, sql, count, field, inner, outer):
+        self.sql = sql
+        self.count = count
+        self.field = field
+        self.inner = inner
+        self.outer = outer
+
+    def __str__(self):
+        lines = [f'{self.count}x {self.sql[:300]}']
+        if self.field:
+            lines.append(f'  serializer field: {self.field}')
+        if self.inner:
+            lines.append(f'  from: {self.inner}')
+        if self.outer and self.outer != self.inner:
+            lines.append(f'  called at: {self.outer}')
+        return '\n'.join(lines)
+
+
+class QueryRecorder:
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(_IGNORED):
+            key = fingerprint(sql)
+            self.counts[key] += 1
+            # The second occurrence is the first sign of a loop; remember where it ran
+            if self.counts[key] == 2:
+                self.origins[key] = _origin(sys._getframe(1))
+        return execute(sql, params, many, context)
+
+    def findings(self):
+        return [
+            Finding(sql, count, *self.origins.get(sql, (None, None, None)))
+            for sql, count in self.counts.most_common()
+            if count >= self.threshold
+        ]
+
+
+class detect_n_plus_one(ContextDecorator):
+    """Fail (or log) when a block repeats a query ``threshold`` times or more::
+
+        @detect_n_plus_one(threshold=3)
+        def test_subject_list(self):
+            self.client.get('/api/subjects/')
+    """
+
+    def __init__(self, threshold=None, mode='raise', label=''):
+        self.threshold = threshold or getattr(settings, 'N_PLUS_ONE_THRESHOLD', 5)
+        self.mode = mode
+        self.label = label
+
+    def __enter__(self):
+        self.recorder = QueryRecorder(self.threshold)
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self.recorder))
+        return self.recorder
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stack.close()
+        findings = self.recorder.findings()
+        if findings and exc_type is None:
+            report = self.format(findings)
+            if self.mode == 'raise':
+                raise NPlusOneError(report)
+            logger.warning(report)
+        return False
+
+    def format(self, findings):
+        heading = f'Repeated queries{" in " + self.label if self.label else ""}:'
+        return '\n'.join([heading, *map(str, findings)])
+
+
+class NPlusOneMiddleware:
+    def __init__(self, get_response):
+        self.mode = getattr(settings, 'N_PLUS_ONE_MODE', 'off')
+        if self.mode not in ('log', 'raise'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, 'N_PLUS_ONE_SAMPLE_RATE', 1.0)
+        if rate < 1 and random.random() >= rate:
+            return self.get_response(request)
+        with detect_n_plus_one(mode=self.mode, label=f'{request.method} {request.get_full_path()}'):
+            return self.get_response(request)
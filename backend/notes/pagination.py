@@ -0,0 +1,206 @@
+"""
+Pagination classes.
+
+KeysetPagination pages by the position of the last row seen, e.g.
+(created_at, id) < (last.created_at, last.id). Deep pages cost the same as
+the first one, with no OFFSET and no COUNT(*). An approximate total can be
+requested with ``?count=approximate``: the planner's row estimate on
+PostgreSQL, or an exact COUNT elsewhere.
+
+NoteListPagination keeps the default page-number behaviour. It switches to
+keyset mode when the request carries ``?cursor=`` or ``?pagination=cursor``.
+Both modes take ``?page_size=``, up to 100.
+
+Each class also has ``apaginate_queryset()``, which fetches the page with the
+async ORM for the views in notes.async_views.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def approximate_count(queryset):
+    """Planner row estimate on PostgreSQL, exact COUNT(*) elsewhere"""
+    if connections[queryset.db].vendor == 'postgresql':
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset.count()
+
+
+class KeysetPagination(pagination.BasePagination):
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size = api_settings.PAGE_SIZE
+    # Both fields must sort in the same direction, and the cursor must
+    # decode to (aware datetime, int); see decode_cursor()
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.approximate_count = approximate_count(queryset)
+        queryset = self.window(queryset, request)
+        return self.select(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.approximate_count = await sync_to_async(approximate_count)(queryset)
+        queryset = self.window(queryset, request)
+        return self.select([row async for row in queryset[:self.page_size + 1]])
+
+    def window(self, queryset, request):
+        """Filter and order ``queryset`` to the rows after the cursor"""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.descending = self.ordering[0].startswith('-')
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.position, self.reverse = self.decode_cursor(request)
+        if self.position is not None:
+            try:
+                queryset = queryset.filter(self.after(self.position, self.reverse))
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        if self.reverse:
+            return queryset.order_by(*self.flipped_ordering())
+        return queryset.order_by(*self.ordering)
+
+    def select(self, rows):
+        """The page from the page_size + 1 rows fetched after the cursor"""
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = self.position is not None, has_more
+        self.page = rows
+        return rows
+
+    def flipped_ordering(self):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def after(self, position, reverse):
+        """Rows strictly past ``position`` in the direction of travel"""
+        backwards = self.descending != reverse
+        lookup = 'lt' if backwards else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            ties = {name: value for name, value in zip(self.fields[:i], position[:i])}
+            condition |= Q(**ties, **{f'{field}__{lookup}': position[i]})
+        return condition
+
+    def position_of(self, row):
+        return [getattr(row, field) for field in self.fields]
+
+    def encode_cursor(self, row, reverse):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in self.position_of(row)]
+        payload = json.dumps({'p': values, 'r': reverse}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            created_at, pk = payload['p']
+            created_at = parse_datetime(created_at)
+            if created_at is None or timezone.is_naive(created_at) != (not settings.USE_TZ):
+                raise ValueError
+            # Rejects bools, and ids no database column could hold
+            if type(pk) is not int or not 0 <= pk < 2 ** 63:
+                raise ValueError
+            return [created_at, pk], bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        body = OrderedDict()
+        if self.approximate_count is not None:
+            body['approximate_count'] = self.approximate_count
+        body['next'] = self.get_next_link()
+        body['previous'] = self.get_previous_link()
+        body['results'] = data
+        return Response(body)
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    """DRF's page-number pagination, plus apaginate_queryset()"""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached_property; filled in here, page() runs no query
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        self.page.object_list = [row async for row in self.page.object_list]
+        return list(self.page)
+
+
+class NoteListPagination(PageNumberPagination):
+    mode_query_param = 'pagination'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def use_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.get_page_size(request)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.get_page_size(request)
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
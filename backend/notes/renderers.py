@@ -0,0 +1,56 @@
+"""
+API renderers.
+
+FastJSONRenderer produces the same compact UTF-8 JSON as DRF's
+JSONRenderer, several times faster when orjson is installed. Values orjson
+does not handle natively, and dates and times, go through DRF's encoder so
+they come out the same. Indented output (``Accept: application/json;
+indent=2``) and non-default COMPACT_JSON/UNICODE_JSON settings fall back to
+the stdlib encoder. orjson writes dicts in insertion order, so an
+OrderedDict reordered with move_to_end() comes out in its original order.
+
+MessagePackRenderer answers ``Accept: application/msgpack`` (or
+``?format=msgpack``). Settings only enable it when msgpack is installed.
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        content = orjson.dumps(data, default=_encoder.default, option=options)
+        # Escaped like JSONRenderer does, so the output is safe inside <script>
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encoder.default)
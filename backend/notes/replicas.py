@@ -0,0 +1,128 @@
+"""
+Read-replica routing.
+
+When DATABASES has a DATABASE_REPLICA_ALIAS entry (set from
+DATABASE_REPLICA_URL), ReplicaMiddleware marks GET/HEAD/OPTIONS requests as
+replica reads, and ReplicaRouter sends their queries on notes models there.
+Everything else reads from the primary:
+
+* writes, and reads inside a transaction on the primary;
+* sessions, auth and admin models, which the same requests write;
+* requests from a client that sent a POST/PUT/PATCH/DELETE within the last
+  DATABASE_REPLICA_PIN_SECONDS, so clients read their own writes. Clients are
+  identified by address, the way notes.throttling identifies them, and the
+  pins live in the cache.
+
+A response built from the replica shortly after any write is served but not
+put in the response cache (notes.cache). Otherwise replication lag could
+keep a stale page cached under the new generation.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .throttling import client_ip
+
+PIN_KEY = 'replica:pin:{}'
+RECENT_WRITE_KEY = 'replica:recent-write'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICA_APPS = {'notes'}
+
+_reading = ContextVar('replica_reading', default=False)
+
+
+def replica_alias():
+    """The replica's alias, or None when none is configured"""
+    alias = getattr(settings, 'DATABASE_REPLICA_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def pin_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+
+
+def _client_key(request):
+    return PIN_KEY.format(client_ip(request))
+
+
+def record_write():
+    """Called when cached generations are bumped, i.e. after every commit
+    that changes the catalog"""
+    if replica_alias():
+        cache.set(RECENT_WRITE_KEY, True, timeout=pin_seconds())
+
+
+def may_be_stale():
+    """Whether the current request reads from a replica that may not have
+    caught up with a recent write"""
+    return _reading.get() and cache.get(RECENT_WRITE_KEY) is not None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = replica_alias()
+        if (
+            alias
+            and _reading.get()
+            and model._meta.app_label in REPLICA_APPS
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replica_alias():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _reading.set(self.use_replica(request))
+        try:
+            return self.get_response(request)
+        finally:
+            _reading.reset(token)
+            self.pin(request)
+
+    async def __acall__(self, request):
+        token = _reading.set(self.use_replica(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            _reading.reset(token)
+            self.pin(request)
+
+    def use_replica(self, request):
+        return request.method in SAFE_METHODS and cache.get(_client_key(request)) is None
+
+    def pin(self, request):
+        if request.method not in SAFE_METHODS:
+            cache.set(_client_key(request), True, timeout=pin_seconds())
@@ -0,0 +1,185 @@
+"""
+Full-text search for notes.
+
+Notes carry a denormalized ``search_text`` column (description, content, tags
+and subject) that Note.save() keeps current. The database indexes it together
+with the title:
+
+* PostgreSQL: a generated ``search_vector`` tsvector column with a GIN index
+  (title weighted above the rest), queried with ``websearch_to_tsquery``.
+* SQLite: an external-content FTS5 table maintained by triggers, ranked
+  with ``bm25``.
+
+Other backends fall back to ``icontains`` matching without ranking.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'notes_note_fts'
+
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE notes_note ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(search_text, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS notes_note_search_vector_gin ON notes_note USING GIN (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS notes_note_search_vector_gin",
+    "ALTER TABLE notes_note DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_INSTALL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, search_text, content='notes_note', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS notes_note_fts_insert AFTER INSERT ON notes_note BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, search_text)
+        VALUES (new.id, new.title, new.search_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS notes_note_fts_delete AFTER DELETE ON notes_note BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, search_text)
+        VALUES ('delete', old.id, old.title, old.search_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS notes_note_fts_update AFTER UPDATE OF title, search_text ON notes_note BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, search_text)
+        VALUES ('delete', old.id, old.title, old.search_text);
+        INSERT INTO {FTS_TABLE}(rowid, title, search_text)
+        VALUES (new.id, new.title, new.search_text);
+    END
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS notes_note_fts_insert",
+    "DROP TRIGGER IF EXISTS notes_note_fts_delete",
+    "DROP TRIGGER IF EXISTS notes_note_fts_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def _statements(vendor, install=True):
+    if vendor == 'postgresql':
+        return POSTGRES_INSTALL if install else POSTGRES_UNINSTALL
+    if vendor == 'sqlite':
+        return SQLITE_INSTALL if install else SQLITE_UNINSTALL
+    return []
+
+
+def install_search_index(conn=None):
+    """Create the search index objects for the connection's backend (idempotent)"""
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        for statement in _statements(conn.vendor):
+            cursor.execute(statement)
+
+
+def ensure_search_index(conn=None):
+    """Reinstall the index objects if the notes table has the search_text column.
+
+    Run after migrations: SQLite rebuilds notes_note for most schema changes,
+    which silently drops the FTS triggers.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        tables = conn.introspection.table_names(cursor)
+        if 'notes_note' not in tables:
+            return
+        columns = [col.name for col in conn.introspection.get_table_description(cursor, 'notes_note')]
+    if 'search_text' in columns:
+        install_search_index(conn)
+
+
+def uninstall_search_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        for statement in _statements(conn.vendor, install=False):
+            cursor.execute(statement)
+
+
+def rebuild_search_index(conn=None):
+    """Re-read every row into the index (SQLite FTS only; Postgres is generated)"""
+    conn = conn or connection
+    if conn.vendor == 'sqlite':
+        install_search_index(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def build_search_text(note):
+    """The text indexed for a note besides its title"""
+    parts = [note.description, note.content, note.tags]
+    if note.subject_id:
+        parts += [note.subject.name, note.subject.code]
+    return '\n'.join(part for part in parts if part)
+
+
+def _fts5_query(text):
+    # Quote every term so user input can't use FTS5 syntax; prefix-match each one
+    terms = re.findall(r'\w+', text)
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+def search_notes(queryset, text, rank=True):
+    """Filter a Note queryset by ``text`` and order it by relevance.
+
+    The result is annotated with ``search_rank`` (higher is better). With
+    ``rank=False`` it is only filtered, through an ``id IN (...)`` subquery
+    that stays valid when the queryset is itself nested in another query.
+    """
+    vendor = connections[queryset.db].vendor
+    if not rank:
+        return _filter_matches(queryset, text, vendor)
+
+    if vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('english', %s)"
+        return queryset.filter(
+            RawSQL(f'"notes_note"."search_vector" @@ {tsquery}', [text], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f'ts_rank("notes_note"."search_vector", {tsquery})', [text], output_field=FloatField())
+        ).order_by('-search_rank', '-created_at')
+
+    if vendor == 'sqlite':
+        match = _fts5_query(text)
+        if not match:
+            return queryset.none()
+        # Join the FTS table so MATCH and bm25() run once per query rather than
+        # once per row; bm25() is lower-is-better, so negate it to sort like ts_rank
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = "notes_note"."id"', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'-bm25({FTS_TABLE}, 10.0, 1.0)'},
+        ).order_by('-search_rank', '-created_at')
+
+    return queryset.filter(
+        Q(title__icontains=text) | Q(search_text__icontains=text)
+    ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def _filter_matches(queryset, text, vendor):
+    if vendor == 'postgresql':
+        return queryset.filter(id__in=RawSQL(
+            "SELECT id FROM notes_note WHERE search_vector @@ websearch_to_tsquery('english', %s)", [text]
+        ))
+    if vendor == 'sqlite':
+        match = _fts5_query(text)
+        if not match:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+    return queryset.filter(Q(title__icontains=text) | Q(search_text__icontains=text))
@@ -1,5 +1,132 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
 from rest_framework import serializers
+from .counters import download_counter
 from .models import Semester, Subject, Note, Comment, Rating, Feedback
+from .thumbnails import variant_urls
+
+class DownloadCountField(serializers.ReadOnlyField):
+    """Stored download count plus increments still buffered in notes.counters.
+
+    The pending counts come from the ``pending_downloads`` context entry when
+    the caller looked them up already (the async views must, off the event
+    loop), then from the list serializer's lookup for the page.
+    """
+    
+    def get_attribute(self, instance):
+        pending = self.context.get('pending_downloads')
+        if pending is None:
+            pending = getattr(self.parent, 'pending_downloads', None)
+        if pending is None:
+            pending = download_counter.pending([instance.pk])
+        return instance.downloads + pending.get(instance.pk, 0)
+
+class ThumbnailVariantsField(serializers.ReadOnlyField):
+    """{format: {width: url}} for the resized thumbnails, or null until built"""
+    
+    def get_attribute(self, instance):
+        return variant_urls(instance.thumbnail_variants, instance.thumbnail.storage, self.context.get('request'))
+    
+    def to_representation(self, value):
+        return value
+
+def _names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+def _relations(model, path):
+    """The foreign keys followed by a field lookup ``path``, or None when the
+    path does not end at a column (a property, an annotation, a reverse or
+    many-to-many relation)"""
+    parts = path.split('__')
+    relations = []
+    for i, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.many_to_many:
+            return None
+        if i < len(parts) - 1:
+            if not field.many_to_one:
+                return None
+            relations.append('__'.join(parts[:i + 1]))
+            model = field.related_model
+    return relations
+
+class SparseFieldsMixin:
+    """?fields=a,b keeps only the named fields and ?omit=a,b leaves them out.
+    
+    Only the top-level serializer (or each item of a list) is trimmed; nested
+    serializers keep all their fields. Views pass the same selection to
+    prune_queryset() so that only the columns behind it are loaded.
+    """
+    # Columns read by fields whose source is not a model field
+    field_columns = {}
+    
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            fields = self.requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+    
+    @classmethod
+    def requested_fields(cls, request):
+        """The names selected by the request's ?fields= and ?omit=, or None
+        for all of them; unknown names are a validation error"""
+        if request is None:
+            return None
+        params = getattr(request, 'query_params', request.GET)
+        fields, omit = params.get('fields'), params.get('omit')
+        if not fields and not omit:
+            return None
+        selected = _names(fields) if fields else set(cls.Meta.fields)
+        omitted = _names(omit) if omit else set()
+        unknown = (selected | omitted).difference(cls.Meta.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': [f'Unknown field: {name}' for name in sorted(unknown)]})
+        return selected - omitted
+    
+    @classmethod
+    def prune_queryset(cls, queryset, request=None, keep=(), join=True):
+        """Restrict ``queryset`` to the columns read by the selected fields
+        and the relations they follow. ``keep`` adds columns needed for
+        anything else, such as pagination. With ``join=False`` relations are
+        not joined and only their foreign keys are kept, for querysets whose
+        related objects come from elsewhere (a prefetch)."""
+        model = queryset.model
+        fields = cls().fields
+        selected = cls.requested_fields(request)
+        columns = {model._meta.pk.name, *keep}
+        joins = set()
+        for name in (fields if selected is None else selected):
+            default = [fields[name].source.replace('.', '__')]
+            for path in cls.field_columns.get(name, default):
+                relations = _relations(model, path)
+                if relations is None:
+                    continue
+                if relations and not join:
+                    columns.add(relations[0])
+                    continue
+                columns.update([path, *relations])
+                joins.update(relations)
+        queryset = queryset.select_related(None)
+        if joins:
+            queryset = queryset.select_related(*joins)
+        return queryset.only(*columns)
+
+class NoteListSerializerList(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Look up the pending download counts for the whole page at once
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if 'pending_downloads' in self.context:
+            return super().to_representation(items)
+        self.child.pending_downloads = download_counter.pending(item.pk for item in items)
+        try:
+            return super().to_representation(items)
+        finally:
+            self.child.pending_downloads = None
 
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,28 +138,38 @@ class RatingSerializer(serializers.ModelSerializer):
         model = Rating
         fields = ['id', 'author_name', 'author_email', 'score', 'created_at']
 
-class NoteListSerializer(serializers.ModelSerializer):
+class NoteListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    downloads = DownloadCountField()
+    thumbnail_variants = ThumbnailVariantsField()
     average_rating = serializers.ReadOnlyField()
-    total_ratings = serializers.ReadOnlyField()
+    total_ratings = serializers.IntegerField(source='rating_count', read_only=True)
     subject_name = serializers.CharField(source='subject.name', read_only=True)
     subject_code = serializers.CharField(source='subject.code', read_only=True)
+    field_columns = {
+        'average_rating': ['rating_count', 'rating_sum'],
+        'thumbnail_variants': ['thumbnail', 'thumbnail_variants'],
+    }
     
     class Meta:
         model = Note
         fields = [
             'id', 'title', 'description', 'thumbnail', 'tags', 'chapter',
             'note_type', 'created_at', 'downloads', 'average_rating', 
-            'total_ratings', 'subject_name', 'subject_code', 'is_featured'
+            'total_ratings', 'subject_name', 'subject_code', 'is_featured',
+            'thumbnail_variants'
         ]
+        list_serializer_class = NoteListSerializerList
 
-class NoteDetailSerializer(serializers.ModelSerializer):
+class NoteDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     comments = CommentSerializer(many=True, read_only=True)
     ratings = RatingSerializer(many=True, read_only=True)
+    downloads = DownloadCountField()
     average_rating = serializers.ReadOnlyField()
-    total_ratings = serializers.ReadOnlyField()
+    total_ratings = serializers.IntegerField(source='rating_count', read_only=True)
     subject_name = serializers.CharField(source='subject.name', read_only=True)
     subject_code = serializers.CharField(source='subject.code', read_only=True)
     semester_number = serializers.IntegerField(source='subject.semester.number', read_only=True)
+    field_columns = {'average_rating': ['rating_count', 'rating_sum']}
     
     class Meta:
         model = Note
@@ -43,20 +180,32 @@ class NoteDetailSerializer(serializers.ModelSerializer):
             'total_ratings', 'subject_name', 'subject_code', 'semester_number'
         ]
 
-class SubjectListSerializer(serializers.ModelSerializer):
+class NoteSlimSerializer(NoteDetailSerializer):
+    """Note detail without the nested comments and ratings; those are
+    paged from their own endpoints"""
+    comments = None
+    ratings = None
+    
+    class Meta(NoteDetailSerializer.Meta):
+        fields = [field for field in NoteDetailSerializer.Meta.fields if field not in ('comments', 'ratings')]
+
+class SubjectListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     total_notes = serializers.ReadOnlyField()
     total_downloads = serializers.ReadOnlyField()
     average_rating = serializers.ReadOnlyField()
     semester_number = serializers.IntegerField(source='semester.number', read_only=True)
+    thumbnail_variants = ThumbnailVariantsField()
+    field_columns = {'thumbnail_variants': ['thumbnail', 'thumbnail_variants']}
     
     class Meta:
         model = Subject
         fields = [
             'id', 'name', 'code', 'description', 'credits', 'thumbnail',
-            'total_notes', 'total_downloads', 'average_rating', 'semester_number'
+            'total_notes', 'total_downloads', 'average_rating', 'semester_number',
+            'thumbnail_variants'
         ]
 
-class SubjectDetailSerializer(serializers.ModelSerializer):
+class SubjectDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     notes = NoteListSerializer(many=True, read_only=True)
     total_notes = serializers.ReadOnlyField()
     total_downloads = serializers.ReadOnlyField()
@@ -72,7 +221,7 @@ class SubjectDetailSerializer(serializers.ModelSerializer):
             'semester_number', 'semester_name'
         ]
 
-class SemesterListSerializer(serializers.ModelSerializer):
+class SemesterListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     total_subjects = serializers.ReadOnlyField()
     total_notes = serializers.ReadOnlyField()
     
@@ -82,7 +231,7 @@ class SemesterListSerializer(serializers.ModelSerializer):
             'id', 'number', 'name', 'description', 'total_subjects', 'total_notes'
         ]
 
-class SemesterDetailSerializer(serializers.ModelSerializer):
+class SemesterDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     subjects = SubjectListSerializer(many=True, read_only=True)
     total_subjects = serializers.ReadOnlyField()
     total_notes = serializers.ReadOnlyField()
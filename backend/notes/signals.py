@@ -0,0 +1,183 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import stats, thumbnails
+from .cache import bump_generation
+from .aggregates import apply_rating_delta
+from .models import Comment, Note, Rating, Semester, Subject
+from .search import build_search_text, ensure_search_index
+from .storage import note_storage
+
+
+@receiver(pre_save, sender=Rating)
+def remember_previous_rating(sender, instance, raw, **kwargs):
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = (
+            Rating.objects.filter(pk=instance.pk).values_list('note_id', 'score').first()
+        )
+
+
+@receiver(post_save, sender=Rating)
+def add_rating_to_aggregates(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if not created and previous:
+        previous_note_id, previous_score = previous
+        if previous_note_id != instance.note_id:
+            apply_rating_delta(previous_note_id, -1, -previous_score)
+            apply_rating_delta(instance.note_id, 1, instance.score)
+        else:
+            apply_rating_delta(instance.note_id, 0, instance.score - previous_score)
+    else:
+        apply_rating_delta(instance.note_id, 1, instance.score)
+
+
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_aggregates(sender, instance, **kwargs):
+    apply_rating_delta(instance.note_id, -1, -instance.score)
+
+
+@receiver(pre_save, sender=Subject)
+def remember_previous_subject(sender, instance, raw, **kwargs):
+    instance._previous_state = None
+    if instance.pk and not raw:
+        instance._previous_state = (
+            Subject.objects.filter(pk=instance.pk).values_list('name', 'code', 'is_active').first()
+        )
+
+
+@receiver(post_save, sender=Subject)
+def reindex_subject_notes(sender, instance, created, raw, **kwargs):
+    previous = getattr(instance, '_previous_state', None)
+    if raw or created or previous is None or previous[:2] == (instance.name, instance.code):
+        return
+    notes = list(instance.notes.all())
+    for note in notes:
+        note.subject = instance
+        note.search_text = build_search_text(note)
+    Note.objects.bulk_update(notes, ['search_text'], batch_size=500)
+
+
+@receiver(pre_save, sender=Note)
+def remember_previous_file(sender, instance, raw, **kwargs):
+    instance._previous_file = None
+    if instance.pk and not raw:
+        instance._previous_file = Note.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+
+
+@receiver(post_save, sender=Note)
+def release_replaced_file(sender, instance, raw, **kwargs):
+    previous = getattr(instance, '_previous_file', None)
+    if not raw and previous and previous != instance.file.name:
+        note_storage.release(previous)
+
+
+@receiver(post_delete, sender=Note)
+def release_deleted_file(sender, instance, **kwargs):
+    if instance.file:
+        note_storage.release(instance.file.name)
+
+
+# Stats snapshot (notes.stats)
+
+@receiver(pre_save, sender=Semester)
+def remember_previous_semester(sender, instance, raw, **kwargs):
+    instance._previous_state = None
+    if instance.pk and not raw:
+        instance._previous_state = (
+            Semester.objects.filter(pk=instance.pk).values_list('is_active').first()
+        )
+
+
+def _active_delta(instance, created):
+    previous = getattr(instance, '_previous_state', None)
+    was_active = bool(previous and previous[-1]) and not created
+    return int(instance.is_active) - int(was_active)
+
+
+@receiver(post_save, sender=Semester)
+def count_saved_semester(sender, instance, created, raw, **kwargs):
+    if not raw:
+        stats.adjust('total_semesters', _active_delta(instance, created))
+
+
+@receiver(post_save, sender=Subject)
+def count_saved_subject(sender, instance, created, raw, **kwargs):
+    if not raw:
+        stats.adjust('total_subjects', _active_delta(instance, created))
+
+
+@receiver(post_delete, sender=Semester)
+def count_deleted_semester(sender, instance, **kwargs):
+    if instance.is_active:
+        stats.adjust('total_semesters', -1)
+
+
+@receiver(post_delete, sender=Subject)
+def count_deleted_subject(sender, instance, **kwargs):
+    if instance.is_active:
+        stats.adjust('total_subjects', -1)
+
+
+@receiver(post_save, sender=Note)
+def count_saved_note(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        stats.adjust('total_notes', 1)
+        stats.adjust('total_downloads', instance.downloads)
+
+
+@receiver(post_delete, sender=Note)
+def count_deleted_note(sender, instance, **kwargs):
+    stats.adjust('total_notes', -1)
+    stats.adjust('total_downloads', -instance.downloads)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        stats.adjust('total_comments', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    stats.adjust('total_comments', -1)
+
+
+@receiver(post_save, sender=Rating)
+def count_saved_rating(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        stats.adjust('total_ratings', 1)
+
+
+@receiver(post_delete, sender=Rating)
+def count_deleted_rating(sender, instance, **kwargs):
+    stats.adjust('total_ratings', -1)
+
+
+# Response cache generations (notes.cache)
+
+def bump_model_generation(sender, **kwargs):
+    bump_generation(sender)
+
+
+for model in (Semester, Subject, Note, Comment, Rating):
+    post_save.connect(bump_model_generation, sender=model, dispatch_uid=f'bump-generation-save-{model.__name__}')
+    post_delete.connect(bump_model_generation, sender=model, dispatch_uid=f'bump-generation-delete-{model.__name__}')
+
+
+# Thumbnail variants (notes.thumbnails)
+
+def queue_thumbnail_variants(sender, instance, raw, **kwargs):
+    if not raw and thumbnails.is_stale(instance):
+        thumbnails.schedule(sender, instance.pk)
+
+
+for model in (Subject, Note):
+    post_save.connect(queue_thumbnail_variants, sender=model, dispatch_uid=f'thumbnail-variants-{model.__name__}')
+
+
+def reinstall_search_index(sender, using, **kwargs):
+    ensure_search_index(connections[using])
@@ -0,0 +1,66 @@
+"""
+Platform statistics snapshot.
+
+The totals shown by the stats endpoint live in a single PlatformStats row,
+so every worker and management command sees the same numbers. Signal
+handlers in notes.signals adjust them with F() updates, in the transaction
+that makes the change, as rows are created, deleted or (de)activated. The
+download counter adjusts total_downloads when it flushes. Bulk operations
+that skip signals are corrected by ``manage.py reconcile_stats``. A missing
+row is recomputed on the next read.
+"""
+import hashlib
+
+from django.db.models import F, Sum
+
+from .models import Comment, Note, PlatformStats, Rating, Semester, Subject
+
+STAT_FIELDS = [
+    'total_semesters',
+    'total_subjects',
+    'total_notes',
+    'total_downloads',
+    'total_comments',
+    'total_ratings',
+]
+
+ROW_ID = 1
+
+
+def compute_snapshot():
+    return {
+        'total_semesters': Semester.objects.filter(is_active=True).count(),
+        'total_subjects': Subject.objects.filter(is_active=True).count(),
+        'total_notes': Note.objects.count(),
+        'total_downloads': Note.objects.aggregate(total=Sum('downloads'))['total'] or 0,
+        'total_comments': Comment.objects.count(),
+        'total_ratings': Rating.objects.count(),
+    }
+
+
+def reconcile():
+    """Recompute every counter from the database and store it"""
+    snapshot = compute_snapshot()
+    PlatformStats.objects.update_or_create(pk=ROW_ID, defaults=snapshot)
+    return snapshot
+
+
+def get_snapshot():
+    snapshot = PlatformStats.objects.filter(pk=ROW_ID).values(*STAT_FIELDS).first()
+    if snapshot is None:
+        return reconcile()
+    return snapshot
+
+
+def snapshot_etag(snapshot):
+    digest = hashlib.md5(
+        ':'.join(str(snapshot[name]) for name in STAT_FIELDS).encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def adjust(name, delta):
+    """Shift a counter as part of the current transaction"""
+    if delta:
+        PlatformStats.objects.filter(pk=ROW_ID).update(**{name: F(name) + delta})
@@ -0,0 +1,139 @@
+"""
+Content-addressed storage for note files.
+
+A note file is stored once per distinct content, at
+``notes/<d[:2]>/<d><ext>`` where d is its SHA-256 hex digest. Uploading the
+same PDF to several subjects gives every note the same blob instead of a
+copy with a random suffix. The digest doubles as a strong ETag (see
+views.download_note).
+
+Blobs are shared, so they are reference-counted. Note.file_sha256 is
+indexed, and release() deletes a blob only once no note points at its
+digest. notes.signals calls it when a note is deleted or its file replaced.
+
+_save() reusing a blob and release() deleting it take the same file lock,
+and release() counts the references again under it. A note that reused a
+blob is only counted once its row commits, so a release committed in
+between can still delete the blob; Note.save() then calls ensure() after
+its commit, which writes the blob again from the uploaded content.
+Files stored before this scheme keep their names until
+``manage.py dedupe_note_files`` moves them.
+"""
+import hashlib
+import logging
+import os
+import re
+from contextlib import contextmanager
+
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+BLOB_NAME = re.compile(r'(?:^|/)(?P<prefix>[0-9a-f]{2})/(?P<digest>[0-9a-f]{64})(?:\.\w+)?$')
+# Lock files, one per first byte of the digest, under the storage root
+LOCK_DIRECTORY = '.locks'
+
+
+class BlobExists(Exception):
+    pass
+
+
+def digest_from_name(name):
+    """The SHA-256 in a blob name, or None for other names"""
+    match = BLOB_NAME.search(name or '')
+    if match and match['digest'].startswith(match['prefix']):
+        return match['digest']
+    return None
+
+
+def blob_name(directory, digest, extension):
+    return '/'.join(part for part in (directory, digest[:2], f'{digest}{extension.lower()}') if part)
+
+
+def content_digest(content):
+    # HashingTemporaryFileUploadHandler has already hashed uploads
+    digest = getattr(content, 'sha256', None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+    return digest
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    @contextmanager
+    def lock(self, name):
+        """Hold the lock that _save() and release() take for ``name``; it
+        works across processes that share the storage directory"""
+        key = digest_from_name(name) or hashlib.sha256(name.encode()).hexdigest()
+        directory = os.path.join(self.location, LOCK_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, key[:2]), 'ab') as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def get_available_name(self, name, max_length=None):
+        # Blob names are deterministic; an existing blob already holds the same bytes.
+        # FileSystemStorage._save only asks again when it lost a race to write one.
+        if digest_from_name(name) and self.exists(name):
+            raise BlobExists(name)
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1]
+        name = blob_name(directory, content_digest(content), extension)
+        with self.lock(name):
+            if self.exists(name):
+                return name
+            try:
+                return super()._save(name, content)
+            except BlobExists:
+                return name
+
+    def ensure(self, name, content):
+        """Write ``content`` to the blob ``name`` again if it has been
+        deleted since _save() returned it"""
+        with self.lock(name):
+            if self.exists(name):
+                return
+            logger.warning('Blob %s was deleted while a note was being saved with it; rewriting it', name)
+            try:
+                content.seek(0)
+                super()._save(name, content)
+            except (OSError, ValueError):
+                # A temporary upload moved into a blob of its own is gone by now
+                logger.exception('Could not rewrite blob %s', name)
+
+    def references(self, name):
+        """How many notes use the blob ``name``"""
+        from .models import Note
+
+        digest = digest_from_name(name)
+        if digest is None:
+            return Note.objects.filter(file=name).count()
+        return Note.objects.filter(file_sha256=digest).count()
+
+    def delete_if_unreferenced(self, name):
+        with self.lock(name):
+            if not self.references(name):
+                self.delete(name)
+
+    def release(self, name):
+        """Delete ``name`` once the current transaction commits, unless a
+        note still references it"""
+        if name:
+            transaction.on_commit(lambda: self.delete_if_unreferenced(name))
+
+
+note_storage = ContentAddressedStorage()
+
+
+def get_note_storage():
+    return note_storage
@@ -0,0 +1,966 @@
+import asyncio
+import atexit
+import base64
+import hashlib
+import importlib
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import QuerySet, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+
+from notes_platform.middleware import CompressionMiddleware, brotli
+
+from . import async_views, exports, metrics, replicas, stats, throttling
+from .aggregates import recount_rating_aggregates
+from .counters import DownloadCounter, download_counter
+from .storage import note_storage
+from .uploads import CREATED, DUPLICATE, FAILED, HashingTemporaryFileUploadHandler, create_notes_from_uploads
+from .throttling import TokenBucketThrottle, client_ip
+from .models import Comment, Note, PlatformStats, Rating, Semester, Subject, Tag
+
+
+def make_notes(count, subject=None):
+    """``count`` notes in one subject, inserted with bulk_create"""
+    if subject is None:
+        semester = Semester.objects.create(number=1, name='Semester 1')
+        subject = Subject.objects.create(semester=semester, name='Algorithms', code='CS101')
+    Note.objects.bulk_create([
+        Note(subject=subject, title=f'Note {i}', description='Description', tags='sorting, graphs')
+        for i in range(count)
+    ], batch_size=1000)
+    return subject
+
+
+def encode_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+class KeysetCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        subject = make_notes(3)
+        cls.note = subject.notes.first()
+        Comment.objects.bulk_create([
+            Comment(note=cls.note, author_name='A', author_email='a@example.com', content=f'Comment {i}')
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_round_trip(self):
+        response = self.client.get('/api/notes/?pagination=cursor&page_size=2', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+        response = self.client.get(response.json()['next'], secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_malformed_cursors_are_not_found(self):
+        iso = self.note.created_at.isoformat()
+        cursors = [
+            'not-base64!',
+            encode_cursor([1, 2]),
+            encode_cursor({'r': True}),
+            encode_cursor({'p': [iso]}),
+            encode_cursor({'p': [1, 2]}),
+            encode_cursor({'p': ['notadate', 1]}),
+            encode_cursor({'p': ['2024-13-45T99:00:00', 1]}),
+            encode_cursor({'p': [iso[:19], 1]}),
+            encode_cursor({'p': [iso, 'x']}),
+            encode_cursor({'p': [iso, True]}),
+            encode_cursor({'p': [iso, 1.5]}),
+            encode_cursor({'p': [iso, 10 ** 30]}),
+            encode_cursor({'p': [None, None]}),
+        ]
+        for path in ['/api/notes/', f'/api/notes/{self.note.pk}/comments/']:
+            for cursor in cursors:
+                with self.subTest(path=path, cursor=cursor):
+                    response = self.client.get(path, {'cursor': cursor}, secure=True)
+                    self.assertEqual(response.status_code, 404)
+
+
+class StatsSnapshotTests(TestCase):
+    def test_signals_and_reconcile_update_the_shared_row(self):
+        make_notes(2)
+        self.assertEqual(stats.reconcile()['total_notes'], 2)
+        note = Note.objects.first()
+        Comment.objects.create(note=note, author_name='A', author_email='a@example.com', content='Hi')
+        Note.objects.filter(pk=note.pk).delete()
+        snapshot = PlatformStats.objects.values(*stats.STAT_FIELDS).get()
+        self.assertEqual((snapshot['total_notes'], snapshot['total_comments']), (1, 0))
+        response = self.client.get('/api/stats/', secure=True)
+        self.assertEqual(response.json()['total_notes'], 1)
+        self.assertEqual(response['ETag'], stats.snapshot_etag(snapshot))
+
+
+class QueryCountTests(TestCase):
+    """The read endpoints run a fixed number of queries however many notes,
+    comments and ratings there are"""
+    def setUp(self):
+        cache.clear()
+
+    def test_query_counts_do_not_grow_with_the_dataset(self):
+        subject = make_notes(10)
+        notes = list(subject.notes.all())
+        Comment.objects.bulk_create([
+            Comment(note=note, author_name='A', author_email=f'{i}@example.com', content='Useful')
+            for note in notes for i in range(3)
+        ])
+        Rating.objects.bulk_create([
+            Rating(note=note, author_name='A', author_email=f'{i}@example.com', score=i + 1)
+            for note in notes for i in range(3)
+        ])
+        note = notes[0]
+        endpoints = [
+            ('/api/notes/', 2),
+            ('/api/notes/?pagination=cursor', 1),
+            (f'/api/subjects/{subject.pk}/notes/', 2),
+            (f'/api/notes/{note.pk}/', 3),
+            ('/api/subjects/', 2),
+        ]
+        for size in [10, 10000]:
+            make_notes(size - Note.objects.count(), subject)
+            for path, queries in endpoints:
+                with self.subTest(size=size, path=path), self.assertNumQueries(queries):
+                    response = self.client.get(path, secure=True)
+                    self.assertEqual(response.status_code, 200)
+
+
+class SparseFieldsTests(TestCase):
+    """?fields= and ?omit= trim the SQL as well as the output"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = make_notes(3)
+        cls.note = cls.subject.notes.first()
+        Comment.objects.create(note=cls.note, author_name='A', author_email='a@example.com', content='Useful')
+        Rating.objects.create(note=cls.note, author_name='A', author_email='a@example.com', score=4)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, path, queries):
+        with CaptureQueriesContext(connection) as context:
+            with self.assertNumQueries(queries):
+                response = self.client.get(path, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), ' '.join(query['sql'] for query in context.captured_queries)
+
+    def test_note_list_loads_only_the_selected_columns(self):
+        data, sql = self.get('/api/notes/?fields=id,title', 2)
+        self.assertEqual({tuple(sorted(item)) for item in data['results']}, {('id', 'title')})
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('notes_subject', sql)
+
+        data, sql = self.get('/api/notes/?omit=description,subject_name,subject_code', 2)
+        self.assertNotIn('description', data['results'][0])
+        self.assertIn('title', data['results'][0])
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('notes_subject', sql)
+
+    def test_note_detail_skips_unrequested_comments_and_ratings(self):
+        data, sql = self.get(f'/api/notes/{self.note.pk}/', 3)
+        self.assertEqual(len(data['comments']), 1)
+        self.assertIn('notes_rating', sql)
+
+        data, sql = self.get(f'/api/notes/{self.note.pk}/?omit=comments,ratings', 1)
+        self.assertNotIn('comments', data)
+        self.assertNotIn('ratings', data)
+        self.assertIn('content', data)
+        self.assertNotIn('notes_comment', sql)
+        self.assertNotIn('notes_rating', sql)
+
+        data, sql = self.get(f'/api/notes/{self.note.pk}/?fields=id,title', 1)
+        self.assertEqual(set(data), {'id', 'title'})
+        self.assertNotIn('"content"', sql)
+
+    def test_subject_rollups_are_only_computed_when_selected(self):
+        data, sql = self.get('/api/subjects/?fields=id,name', 2)
+        self.assertEqual(set(data['results'][0]), {'id', 'name'})
+        self.assertNotIn('notes_note', sql)
+
+        data, sql = self.get('/api/subjects/?fields=id,total_notes', 2)
+        self.assertEqual(data['results'][0]['total_notes'], 3)
+        self.assertIn('notes_note', sql)
+
+        data, sql = self.get(f'/api/subjects/{self.subject.pk}/?omit=notes,total_notes,total_downloads,average_rating', 1)
+        self.assertNotIn('notes', data)
+        self.assertNotIn('notes_note', sql)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/api/notes/?fields=id,secret', secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown field: secret']})
+
+
+class NoteCommentsAndRatingsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.note, cls.uncommented = make_notes(2).notes.order_by('pk')
+        Rating.objects.bulk_create([
+            Rating(note=cls.note, author_name='A', author_email=f'{i}@example.com', score=i % 5 + 1)
+            for i in range(23)
+        ])
+        recount_rating_aggregates([cls.note.pk])
+        Comment.objects.create(note=cls.note, author_name='A', author_email='a@example.com', content='Useful')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, path):
+        response = self.client.get(path, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_rating_summary_histogram(self):
+        summary = self.get(f'/api/notes/{self.note.pk}/ratings/summary/')
+        # Scores 1-5 repeat, so 1-3 get one extra rating
+        self.assertEqual(summary['histogram'], {'1': 5, '2': 5, '3': 5, '4': 4, '5': 4})
+        self.assertEqual(summary['count'], 23)
+        self.assertAlmostEqual(summary['average'], 66 / 23)
+
+        empty = self.get(f'/api/notes/{self.uncommented.pk}/ratings/summary/')
+        self.assertEqual(empty, {'count': 0, 'average': 0, 'histogram': dict.fromkeys('12345', 0)})
+
+    def test_ratings_are_paged_by_cursor(self):
+        first = self.get(f'/api/notes/{self.note.pk}/ratings/')
+        self.assertEqual(len(first['results']), 20)
+        self.assertIsNone(first['previous'])
+        second = self.get(first['next'])
+        self.assertEqual(len(second['results']), 3)
+        self.assertIsNone(second['next'])
+        ids = [rating['id'] for rating in first['results'] + second['results']]
+        self.assertEqual(ids, list(Rating.objects.filter(note=self.note).order_by('-created_at', '-id').values_list('id', flat=True)))
+        self.assertEqual(self.get(second['previous'])['results'], first['results'])
+
+    def test_slim_detail_leaves_out_comments_and_ratings(self):
+        with self.assertNumQueries(1):
+            slim = self.get(f'/api/notes/{self.note.pk}/?slim=true')
+        self.assertNotIn('comments', slim)
+        self.assertNotIn('ratings', slim)
+        self.assertEqual(slim['total_ratings'], 23)
+        full = self.get(f'/api/notes/{self.note.pk}/')
+        self.assertEqual(len(full['comments']), 1)
+        self.assertEqual({key: full[key] for key in slim}, slim)
+
+    @override_settings(RESPONSE_CACHE=True)
+    def test_cached_lists_are_not_served_for_a_deleted_note(self):
+        for route in ['comments', 'ratings']:
+            with self.subTest(route=route):
+                note = Note.objects.create(subject=self.note.subject, title='Empty', description='D')
+                path = f'/api/notes/{note.pk}/{route}/'
+                self.assertEqual(self.get(path)['results'], [])
+                with self.captureOnCommitCallbacks(execute=True):
+                    note.delete()
+                self.assertEqual(self.client.get(path, secure=True).status_code, 404)
+
+
+class RatingUpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.note = make_notes(1).notes.get()
+
+    def setUp(self):
+        cache.clear()
+
+    def rate(self, score, email='a@example.com', note_id=None):
+        return self.client.post(
+            f'/api/notes/{note_id or self.note.pk}/ratings/',
+            {'author_name': 'A', 'author_email': email, 'score': score},
+            content_type='application/json', secure=True,
+        )
+
+    def assert_aggregates(self, count, total):
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.rating_count, self.note.rating_sum), (count, total))
+        self.assertEqual(Rating.objects.filter(note=self.note).count(), count)
+
+    def test_repeat_submission_replaces_the_rating(self):
+        response = self.rate(4)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['note'], {'id': self.note.pk, 'average_rating': 4.0, 'total_ratings': 1})
+        # The double submit of a retrying client
+        response = self.rate(4)
+        self.assertEqual(response.status_code, 200)
+        self.assert_aggregates(1, 4)
+        response = self.rate(2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['note']['average_rating'], 2.0)
+        self.assert_aggregates(1, 2)
+        self.assertEqual(self.rate(5, email='b@example.com').status_code, 201)
+        self.assert_aggregates(2, 7)
+
+    def test_rating_a_missing_note_is_not_found(self):
+        self.assertEqual(self.rate(3, note_id=self.note.pk + 1000).status_code, 404)
+
+
+class TagIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = make_notes(0)
+        cls.notes = {
+            tags: Note.objects.create(subject=cls.subject, title=tags or 'untagged', description='D', tags=tags)
+            for tags in ['Sorting, Graphs', 'sorting', ' graphs ,  Dynamic   Programming', '']
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def titles(self, query):
+        response = self.client.get(f'/api/notes/?{query}', secure=True)
+        self.assertEqual(response.status_code, 200)
+        return {note['title'] for note in response.json()['results']}
+
+    def test_tag_filter_matches_all_or_any(self):
+        self.assertEqual(self.titles('tag=sorting'), {'Sorting, Graphs', 'sorting'})
+        self.assertEqual(self.titles('tag=sorting,graphs'), {'Sorting, Graphs'})
+        self.assertEqual(self.titles('tag=Sorting&tag=GRAPHS'), {'Sorting, Graphs'})
+        self.assertEqual(
+            self.titles('tag=sorting,dynamic  programming&tag_match=any'),
+            {'Sorting, Graphs', 'sorting', ' graphs ,  Dynamic   Programming'},
+        )
+        self.assertEqual(self.titles('tag=missing'), set())
+        self.assertEqual(self.titles('tag=sorting&pagination=cursor'), {'Sorting, Graphs', 'sorting'})
+
+    def test_save_keeps_the_index_in_sync(self):
+        note = self.notes['sorting']
+        note.tags = 'Trees'
+        note.save(update_fields=['tags'])
+        self.assertEqual(list(note.tag_index.values_list('name', flat=True)), ['trees'])
+        self.assertEqual(self.titles('tag=trees'), {'sorting'})
+
+    def test_migration_populates_the_index(self):
+        migration = importlib.import_module('notes.migrations.0005_tag_index')
+        Note.tag_index.through.objects.all().delete()
+        Tag.objects.all().delete()
+        migration.populate_tag_index(apps, None)
+        self.assertEqual(
+            set(Tag.objects.values_list('name', flat=True)),
+            {'sorting', 'graphs', 'dynamic programming'},
+        )
+        self.assertEqual(
+            set(self.notes[' graphs ,  Dynamic   Programming'].tag_index.values_list('name', flat=True)),
+            {'graphs', 'dynamic programming'},
+        )
+        self.assertFalse(self.notes[''].tag_index.exists())
+
+    def test_admin_bulk_upload_indexes_tags(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post('/admin/notes/note/add/', {
+            'subject': self.subject.pk,
+            'note_type': 'lecture',
+            'tags': 'Exam Prep, Sorting',
+            'files': [SimpleUploadedFile(f'week-{i}.pdf', f'%PDF week {i}'.encode()) for i in range(2)],
+        }, secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.titles('tag=exam prep'), {'Week 0', 'Week 1'})
+        self.assertEqual(len(self.titles('tag=sorting')), 4)
+
+
+class NoteFacetsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = make_notes(0)
+        other = Subject.objects.create(semester=cls.subject.semester, name='Data Structures', code='CS102')
+        for subject, note_type, chapter, tags in [
+            (cls.subject, 'lecture', 'Chapter 1', 'Sorting, Graphs'),
+            (cls.subject, 'lecture', 'Chapter 2', 'sorting'),
+            (cls.subject, 'exam', 'Chapter 1', 'graphs'),
+            (cls.subject, 'exam', '', ''),
+            (other, 'tutorial', 'Chapter 1', 'trees'),
+        ]:
+            Note.objects.create(subject=subject, title='Note', description='D', note_type=note_type, chapter=chapter, tags=tags)
+
+    def setUp(self):
+        cache.clear()
+
+    def facets(self, path):
+        response = self.client.get(path, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_for_one_subject(self):
+        self.assertEqual(self.facets(f'/api/subjects/{self.subject.pk}/notes/facets/'), {
+            'count': 4,
+            'note_type': [
+                {'value': 'exam', 'count': 2, 'label': 'Exam Paper'},
+                {'value': 'lecture', 'count': 2, 'label': 'Lecture Notes'},
+            ],
+            'chapter': [{'value': 'Chapter 1', 'count': 2}, {'value': 'Chapter 2', 'count': 1}],
+            'tag': [{'value': 'graphs', 'count': 2}, {'value': 'sorting', 'count': 2}],
+        })
+
+    def test_counts_for_all_notes(self):
+        facets = self.facets('/api/notes/facets/')
+        self.assertEqual(facets['count'], 5)
+        self.assertEqual(
+            [(item['value'], item['count']) for item in facets['note_type']],
+            [('exam', 2), ('lecture', 2), ('tutorial', 1)],
+        )
+        self.assertEqual(facets['chapter'], [{'value': 'Chapter 1', 'count': 3}, {'value': 'Chapter 2', 'count': 1}])
+        self.assertEqual(
+            facets['tag'],
+            [{'value': 'graphs', 'count': 2}, {'value': 'sorting', 'count': 2}, {'value': 'trees', 'count': 1}],
+        )
+
+    def test_counts_follow_the_list_filters(self):
+        facets = self.facets(f'/api/subjects/{self.subject.pk}/notes/facets/?type=lecture')
+        self.assertEqual(facets['count'], 2)
+        self.assertEqual([(item['value'], item['count']) for item in facets['note_type']], [('lecture', 2)])
+        self.assertEqual(facets['chapter'], [{'value': 'Chapter 1', 'count': 1}, {'value': 'Chapter 2', 'count': 1}])
+        self.assertEqual(facets['tag'], [{'value': 'sorting', 'count': 2}, {'value': 'graphs', 'count': 1}])
+
+        facets = self.facets('/api/notes/facets/?tag=graphs&chapter=chapter 1')
+        self.assertEqual(facets['count'], 2)
+        self.assertEqual(
+            [(item['value'], item['count']) for item in facets['note_type']], [('exam', 1), ('lecture', 1)],
+        )
+        self.assertEqual(facets['tag'], [{'value': 'graphs', 'count': 2}, {'value': 'sorting', 'count': 1}])
+
+    @override_settings(RESPONSE_CACHE=True)
+    def test_cached_facets_are_invalidated_by_note_writes(self):
+        path = f'/api/subjects/{self.subject.pk}/notes/facets/'
+        self.assertEqual(self.facets(path)['count'], 4)
+        # update() sends no signals, so the cached response is still served
+        Note.objects.filter(subject=self.subject, note_type='exam').update(note_type='lecture')
+        self.assertEqual(len(self.facets(path)['note_type']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.create(subject=self.subject, title='New', description='D', note_type='reference', tags='trees')
+        facets = self.facets(path)
+        self.assertEqual(facets['count'], 5)
+        self.assertEqual(
+            [(item['value'], item['count']) for item in facets['note_type']], [('lecture', 4), ('reference', 1)],
+        )
+        self.assertIn({'value': 'trees', 'count': 1}, facets['tag'])
+
+
+LOCMEM_AND_DUMMY = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'dummy': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+@override_settings(CACHES=LOCMEM_AND_DUMMY)
+class DownloadCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.note_ids = list(make_notes(3).notes.values_list('pk', flat=True))
+
+    def setUp(self):
+        cache.clear()
+
+    def counter(self, alias='default'):
+        counter = DownloadCounter(cache_alias=alias, flush_interval=3600)
+        self.addCleanup(atexit.unregister, counter._flush_logged)
+        return counter
+
+    def stored(self):
+        return Note.objects.aggregate(total=Sum('downloads'))['total']
+
+    def test_concurrent_records_and_flushes_lose_nothing(self):
+        threads, per_thread = 8, 500
+        for alias in ['default', 'dummy']:
+            with self.subTest(cache=alias):
+                Note.objects.update(downloads=0)
+                counter = self.counter(alias)
+                start = threading.Barrier(threads + 1)
+
+                def download():
+                    start.wait()
+                    for i in range(per_thread):
+                        counter.record(self.note_ids[i % len(self.note_ids)])
+
+                workers = [threading.Thread(target=download) for _ in range(threads)]
+                for worker in workers:
+                    worker.start()
+                start.wait()
+                while any(worker.is_alive() for worker in workers):
+                    counter.flush(self.note_ids)
+                for worker in workers:
+                    worker.join()
+                counter.flush(self.note_ids)
+                self.assertEqual(self.stored(), threads * per_thread)
+                self.assertEqual(counter.pending(self.note_ids), {})
+
+    def test_failed_flush_keeps_the_pending_counts(self):
+        counter = self.counter()
+        for note_id in self.note_ids:
+            counter.record(note_id, 2)
+        with mock.patch.object(stats, 'adjust', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                counter.flush()
+        self.assertEqual(self.stored(), 0)
+        self.assertEqual(counter.pending(self.note_ids), dict.fromkeys(self.note_ids, 2))
+        self.assertEqual(counter.flush(), 6)
+        self.assertEqual(self.stored(), 6)
+        self.assertEqual(counter.pending(self.note_ids), {})
+
+
+@override_settings(RESPONSE_CACHE=True, ALLOWED_HOSTS=['a.example', 'b.example'])
+class ResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_notes(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_key_includes_scheme_and_host(self):
+        for host, secure in [('a.example', True), ('b.example', True), ('a.example', False)]:
+            with self.subTest(host=host, secure=secure):
+                response = self.client.get('/api/notes/?page_size=2', HTTP_HOST=host, secure=secure)
+                scheme = 'https' if secure else 'http'
+                self.assertTrue(response.json()['next'].startswith(f'{scheme}://{host}/'))
+
+    def test_flushed_downloads_refresh_cached_counts(self):
+        note = Note.objects.order_by('-created_at', '-pk').first()
+        counter = DownloadCounter(flush_interval=3600)
+        self.addCleanup(atexit.unregister, counter._flush_logged)
+
+        def downloads():
+            response = self.client.get('/api/notes/', HTTP_HOST='a.example', secure=True)
+            return next(item['downloads'] for item in response.json()['results'] if item['id'] == note.pk)
+
+        self.assertEqual(downloads(), 0)
+        counter.record(note.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            counter.flush([note.pk])
+        self.assertEqual(downloads(), 1)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = make_notes(3)
+        cls.subject.notes.update(is_featured=True)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_pending_downloads_are_fetched_once_off_the_event_loop(self):
+        calls = []
+        real_pending = download_counter.pending
+
+        def pending(note_ids):
+            try:
+                asyncio.get_running_loop()
+                calls.append('event loop')
+            except RuntimeError:
+                calls.append('thread')
+            return real_pending(note_ids)
+
+        factory = AsyncRequestFactory()
+        views = [
+            (async_views.note_list, '/api/notes/', {}),
+            (async_views.note_detail, '/api/notes/1/', {'pk': await self.subject.notes.values_list('pk', flat=True).afirst()}),
+            (async_views.subject_detail, '/api/subjects/1/', {'pk': self.subject.pk}),
+            (async_views.featured_notes, '/api/featured-notes/', {}),
+        ]
+        with mock.patch.object(download_counter, 'pending', side_effect=pending):
+            for view, path, kwargs in views:
+                with self.subTest(path=path):
+                    calls.clear()
+                    response = await view(factory.get(path, secure=True), **kwargs)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(calls, ['thread'])
+
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=1, CACHES=LOCMEM_AND_DUMMY)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_serializer_time_is_measured_in_the_view(self):
+        make_notes(3)
+        response = self.client.get('/api/notes/', secure=True)
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertNotEqual(timing['serialize'], 'dur=0.0')
+
+    def test_expired_slots_are_reused(self):
+        first, second = metrics.Registry(), metrics.Registry()
+        first.publish(force=True)
+        second.publish(force=True)
+        self.assertEqual((first._slot, second._slot), (0, 1))
+        cache.delete(metrics.SLOT_KEY.format(0))
+        third = metrics.Registry()
+        third.publish(force=True)
+        self.assertEqual(third._slot, 0)
+        first.publish(force=True)
+        self.assertEqual(first._slot, 2)
+        self.assertEqual(len(first.collect()), 3)
+
+    def test_metrics_need_a_token_unless_debugging(self):
+        def status(**headers):
+            return self.client.get('/api/metrics/', secure=True, headers=headers).status_code
+
+        with self.settings(REQUEST_METRICS_TOKEN='', DEBUG=False):
+            self.assertEqual(status(), 404)
+            self.assertEqual(status(Authorization='Bearer '), 404)
+        with self.settings(REQUEST_METRICS_TOKEN='', DEBUG=True):
+            self.assertEqual(status(), 200)
+        with self.settings(REQUEST_METRICS_TOKEN='secret', DEBUG=False):
+            self.assertEqual(status(), 401)
+            self.assertEqual(status(Authorization='Bearer wrong'), 401)
+            self.assertEqual(status(Authorization='Bearer secret'), 200)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.subject = make_notes(0)
+
+    def note(self, content=b'%PDF-1.4 shared'):
+        note = Note(subject=self.subject, title='Shared', description='Description')
+        note.file = ContentFile(content, name='shared.pdf')
+        return note
+
+    def test_release_keeps_a_blob_that_is_still_referenced(self):
+        first, second = self.note(), self.note()
+        first.save()
+        second.save()
+        self.assertEqual(first.file.name, second.file.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(note_storage.exists(second.file.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(note_storage.exists(second.file.name))
+
+    def test_blob_deleted_before_the_reusing_note_commits_is_rewritten(self):
+        first = self.note()
+        first.save()
+        with self.assertLogs('notes.storage', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            second = self.note()
+            second.save()
+            # A release of the first note's blob ran between the second
+            # note reusing it and committing
+            note_storage.delete(first.file.name)
+        with note_storage.open(second.file.name) as blob:
+            self.assertEqual(blob.read(), b'%PDF-1.4 shared')
+
+
+class BulkUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.subject = make_notes(0)
+        existing = Note(subject=self.subject, title='Existing', description='D')
+        existing.file = ContentFile(b'%PDF week 1', name='existing.pdf')
+        existing.save()
+
+    def files(self, *contents):
+        return [SimpleUploadedFile(f'week-{i}.pdf', content) for i, content in enumerate(contents)]
+
+    def upload(self, files, **data):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post('/admin/notes/note/add/', {
+            'subject': self.subject.pk, 'note_type': 'lecture', 'files': files, **data,
+        }, secure=True)
+        self.assertEqual(response.status_code, 302)
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_handler_hashes_uploads_as_they_stream_to_disk(self):
+        content = b'%PDF ' + bytes(range(256)) * 1000
+        handler = HashingTemporaryFileUploadHandler()
+        handler.new_file('files', 'notes.pdf', 'application/pdf', len(content))
+        for start in range(0, len(content), 64 * 1024):
+            handler.receive_data_chunk(content[start:start + 64 * 1024], start)
+        uploaded = handler.file_complete(len(content))
+        self.addCleanup(uploaded.close)
+        self.assertEqual(uploaded.sha256, hashlib.sha256(content).hexdigest())
+        with open(uploaded.temporary_file_path(), 'rb') as file:
+            self.assertEqual(file.read(), content)
+
+    def test_every_file_becomes_a_note_by_default(self):
+        messages = self.upload(self.files(b'%PDF week 1', b'%PDF week 2', b'%PDF week 2'))
+        self.assertEqual(messages, ['Successfully created 3 notes from uploaded files.'])
+        self.assertEqual(self.subject.notes.count(), 4)
+        # Same content, same blob
+        self.assertEqual(self.subject.notes.values('file').distinct().count(), 2)
+
+    def test_duplicates_are_skipped_when_asked(self):
+        messages = self.upload(self.files(b'%PDF week 1', b'%PDF week 2', b'%PDF week 2'), skip_duplicates='on')
+        self.assertEqual(self.subject.notes.count(), 2)
+        self.assertEqual(messages[0], 'Successfully created 1 notes from uploaded files.')
+        self.assertIn('Skipped 2 files', messages[1])
+        self.assertIn('<li>week-0.pdf (already uploaded to this subject)</li>', messages[1])
+        self.assertIn('<li>week-2.pdf (already uploaded to this subject)</li>', messages[1])
+
+    def test_status_per_file(self):
+        storage = type(note_storage)
+        save = storage.save
+
+        def fail_broken(self, name, content, max_length=None):
+            if content.name == 'broken.pdf':
+                raise OSError('disk full')
+            return save(self, name, content, max_length=max_length)
+
+        files = self.files(b'%PDF week 1', b'%PDF week 2') + [SimpleUploadedFile('broken.pdf', b'%PDF broken')]
+        with mock.patch.object(storage, 'save', fail_broken), self.assertLogs('notes.uploads', 'ERROR'):
+            results = create_notes_from_uploads(files, self.subject, 'lecture', skip_duplicates=True)
+        self.assertEqual([(name, status) for name, status, _ in results], [
+            ('week-0.pdf', DUPLICATE), ('week-1.pdf', CREATED), ('broken.pdf', FAILED),
+        ])
+        note = results[1][2]
+        self.assertEqual(Note.objects.get(pk=note.pk).title, 'Week 1')
+        self.assertEqual(note.file_sha256, hashlib.sha256(b'%PDF week 2').hexdigest())
+
+
+@override_settings(
+    DATABASE_REPLICA_ALIAS=settings.TEST_REPLICA_ALIAS,
+    DATABASE_REPLICA_PIN_SECONDS=1,
+    CACHES=LOCMEM_AND_DUMMY,
+    CLIENT_IP_HEADER='',
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    """The replica is a second SQLite database holding different rows from
+    the primary, so each response shows which one it was read from"""
+    databases = {'default', settings.TEST_REPLICA_ALIAS}
+
+    def setUp(self):
+        cache.clear()
+        self.note = self.add_note('default', 'On the primary')
+        self.add_note(settings.TEST_REPLICA_ALIAS, 'On the replica')
+
+    def tearDown(self):
+        # flush skips databases the router keeps migrations away from
+        for model in [Note, Subject, Semester]:
+            model.objects.using(settings.TEST_REPLICA_ALIAS).all().delete()
+
+    def add_note(self, alias, title):
+        semester = Semester(pk=1, number=1, name='Semester 1')
+        subject = Subject(pk=1, semester_id=1, name='Algorithms', code='CS101')
+        note = Note(pk=1, subject_id=1, title=title, description='D')
+        for model, row in [(Semester, semester), (Subject, subject), (Note, note)]:
+            model.objects.using(alias).bulk_create([row])
+        return note
+
+    def title(self, client='10.0.0.1'):
+        response = self.client.get(f'/api/notes/{self.note.pk}/', REMOTE_ADDR=client, secure=True)
+        return response.json()['title']
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(replicas.replica_alias(), settings.TEST_REPLICA_ALIAS)
+        self.assertEqual(self.title(), 'On the replica')
+        response = self.client.post(
+            f'/api/notes/{self.note.pk}/comments/',
+            {'author_name': 'A', 'author_email': 'a@example.com', 'content': 'Thanks'},
+            content_type='application/json', REMOTE_ADDR='10.0.0.1', secure=True,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Comment.objects.using('default').count(), 1)
+        self.assertEqual(Comment.objects.using(settings.TEST_REPLICA_ALIAS).count(), 0)
+
+        # The writer reads its own write from the primary until the pin expires;
+        # other clients stay on the replica
+        self.assertEqual(self.title(), 'On the primary')
+        self.assertEqual(self.title(client='10.0.0.2'), 'On the replica')
+        time.sleep(1.1)
+        self.assertEqual(self.title(), 'On the replica')
+
+    @override_settings(RESPONSE_CACHE=True)
+    def test_responses_read_soon_after_a_write_are_not_cached(self):
+        replicas.record_write()
+        self.assertEqual(self.title(), 'On the replica')
+        Note.objects.using(settings.TEST_REPLICA_ALIAS).update(title='Caught up')
+        self.assertEqual(self.title(), 'Caught up')
+
+        cache.delete(replicas.RECENT_WRITE_KEY)
+        self.assertEqual(self.title(), 'Caught up')
+        Note.objects.using(settings.TEST_REPLICA_ALIAS).update(title='Changed again')
+        self.assertEqual(self.title(), 'Caught up')
+
+
+@override_settings(CACHES=LOCMEM_AND_DUMMY)
+class ThrottleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.note = make_notes(1).notes.get()
+
+    def setUp(self):
+        cache.clear()
+        rates = {'create-comment': '2/min', 'create-rating': '3/hour'}
+        patcher = mock.patch.object(TokenBucketThrottle, 'THROTTLE_RATES', rates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, route, data, **extra):
+        return self.client.post(
+            f'/api/notes/{self.note.pk}/{route}/', data, content_type='application/json',
+            REMOTE_ADDR='10.0.0.1', secure=True, **extra,
+        )
+
+    def comment(self, i, **extra):
+        return self.post('comments', {'author_name': 'A', 'author_email': 'a@example.com', 'content': f'Comment {i}'}, **extra)
+
+    def rate(self, i):
+        return self.post('ratings', {'author_name': 'A', 'author_email': f'{i}@example.com', 'score': 5})
+
+    def test_burst_then_429_with_retry_after(self):
+        self.assertEqual([self.comment(i).status_code for i in range(2)], [201, 201])
+        response = self.comment(2)
+        self.assertEqual(response.status_code, 429)
+        # 2/min refills a token every 30 seconds
+        self.assertIn(int(response['Retry-After']), (29, 30))
+        self.assertEqual(self.client.get(f'/api/notes/{self.note.pk}/comments/', secure=True).status_code, 200)
+
+    def test_rates_are_per_route(self):
+        for i in range(2):
+            self.comment(i)
+        self.assertEqual(self.comment(2).status_code, 429)
+        self.assertEqual([self.rate(i).status_code for i in range(4)], [201, 201, 201, 429])
+        # 3/hour refills a token every 20 minutes
+        self.assertGreater(int(self.rate(4)['Retry-After']), 1190)
+
+    def test_forwarded_for_is_ignored_by_default(self):
+        for i in range(2):
+            self.comment(i, HTTP_X_FORWARDED_FOR=f'192.0.2.{i}')
+        self.assertEqual(self.comment(2, HTTP_X_FORWARDED_FOR='192.0.2.2').status_code, 429)
+
+    def test_client_ip_from_the_proxy_header(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.9', HTTP_X_FORWARDED_FOR='192.0.2.1, 203.0.113.5')
+        self.assertEqual(client_ip(request), '10.0.0.9')
+        with self.settings(CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR'):
+            # Only the entry the proxy appended counts, whatever the client sent
+            self.assertEqual(client_ip(request), '203.0.113.5')
+            with self.settings(CLIENT_IP_PROXY_COUNT=2):
+                self.assertEqual(client_ip(request), '192.0.2.1')
+
+    def test_redis_takes_a_token_in_one_round_trip(self):
+        redis_cache = mock.Mock(spec=RedisCache)
+        redis_cache.make_and_validate_key.side_effect = lambda key: f':1:{key}'
+        client = redis_cache._cache.get_client.return_value
+        client.register_script.return_value.side_effect = [0, 30000]
+        with mock.patch.object(throttling, '_script', None), \
+                mock.patch.object(throttling, 'caches', {'default': redis_cache}):
+            self.assertEqual(throttling.take('throttle:create-comment:10.0.0.1', 2, 60), 0)
+            self.assertEqual(throttling.take('throttle:create-comment:10.0.0.1', 2, 60), 30)
+        script = client.register_script.return_value
+        self.assertEqual(script.call_count, 2)
+        self.assertEqual(script.call_args.kwargs['keys'], [':1:throttle:create-comment:10.0.0.1'])
+        self.assertEqual(client.method_calls, [mock.call.register_script(throttling.TAKE_SCRIPT)])
+        redis_cache.get.assert_not_called()
+        redis_cache.set.assert_not_called()
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = make_notes(2)
+        other = Subject.objects.create(semester=cls.subject.semester, name='Data Structures', code='CS102')
+        make_notes(1, other)
+        for note in Note.objects.all():
+            for content in ['Exam tips', '=HYPERLINK("http://example.com")']:
+                Comment.objects.create(note=note, author_name='A', author_email='a@example.com', content=content)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def export(self, model, query, **extra):
+        response = self.client.get(f'/admin/notes/{model}/export/?{query}', secure=True, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_has_a_header_row_and_escapes_formulas(self):
+        content = self.export('comment', 'format=csv')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'id,note_id,note_title,author_name,author_email,content,created_at')
+        self.assertEqual(len(lines), 1 + Comment.objects.count())
+        self.assertIn(',"\'=HYPERLINK(""http://example.com"")",', content)
+
+    def test_ndjson_has_one_object_per_row(self):
+        rows = [json.loads(line) for line in self.export('note', 'format=ndjson').splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(
+            list(rows[0]),
+            [name for name, _ in exports.COLUMNS[Note]],
+        )
+        self.assertEqual({row['subject_code'] for row in rows}, {'CS101', 'CS102'})
+        self.assertEqual(rows[0]['average_rating'], None)
+
+    def test_export_applies_the_changelist_filters_and_search(self):
+        rows = self.export('comment', f'format=ndjson&note__subject__id__exact={self.subject.pk}&q=tips').splitlines()
+        notes = set(self.subject.notes.values_list('pk', flat=True))
+        self.assertEqual({json.loads(row)['note_id'] for row in rows}, notes)
+        self.assertEqual({json.loads(row)['content'] for row in rows}, {'Exam tips'})
+
+        # The same rows as the changelist, for every filter it offers
+        for query in [f'note__subject__id__exact={self.subject.pk}', 'created_at__gte=2000-01-01', 'q=tips']:
+            with self.subTest(query=query):
+                request = RequestFactory().get(f'/admin/notes/comment/?{query}')
+                request.user = self.admin
+                changelist = admin.site._registry[Comment].get_changelist_instance(request)
+                rows = self.export('comment', f'format=ndjson&{query}').splitlines()
+                self.assertEqual(
+                    sorted(json.loads(row)['id'] for row in rows),
+                    sorted(changelist.queryset.values_list('pk', flat=True)),
+                )
+
+        # Lookups the changelist would not allow are rejected, not ignored
+        response = self.client.get('/admin/notes/comment/export/?format=csv&note__title=Note 0', secure=True)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/admin/notes/comment/export/?format=xml', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_selected_rows_action(self):
+        comments = list(Comment.objects.filter(note__subject=self.subject).values_list('pk', flat=True))
+        response = self.client.post('/admin/notes/comment/', {
+            'action': 'export_ndjson', '_selected_action': comments,
+        }, secure=True)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(sorted(json.loads(row)['id'] for row in rows), sorted(comments))
+
+    def test_rows_are_streamed_from_a_chunked_iterator(self):
+        iterator = QuerySet.iterator
+        with mock.patch.object(QuerySet, 'iterator', autospec=True, side_effect=iterator) as patched, \
+                mock.patch.object(exports, 'CHUNK_ROWS', 2):
+            response = exports.export_response(Comment.objects.order_by('pk'), 'csv')
+            self.assertIsInstance(response, StreamingHttpResponse)
+            chunks = list(response.streaming_content)
+        self.assertEqual(patched.call_args.kwargs, {'chunk_size': 2})
+        # The header, then two rows per chunk
+        self.assertEqual(len(chunks), 1 + 3)
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [1, 2, 2, 2])
+        self.assertTrue(response['Content-Disposition'].endswith('.csv"'))
+
+
+class CompressionTests(SimpleTestCase):
+    def compress(self, content_type):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, br')
+        middleware = CompressionMiddleware(lambda request: HttpResponse('x' * 4096, content_type=content_type))
+        return middleware(request)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_only_for_api_formats(self):
+        self.assertEqual(self.compress('application/json')['Content-Encoding'], 'br')
+        self.assertEqual(self.compress('application/msgpack')['Content-Encoding'], 'br')
+        self.assertEqual(self.compress('text/html; charset=utf-8')['Content-Encoding'], 'gzip')
@@ -0,0 +1,122 @@
+"""
+Rate limits for the unauthenticated write endpoints.
+
+TokenBucketThrottle gives each (route, client address) pair a token bucket.
+A rate of 'N/period' in DEFAULT_THROTTLE_RATES, keyed by the route's URL
+name, lets a client make N requests in a burst, then refills the bucket
+evenly over the period (one token every period / N). GET, HEAD and OPTIONS
+requests, and routes without a rate, are not limited. A rejected request
+gets DRF's 429 response with a Retry-After header.
+
+The bucket is stored as a single timestamp, the time at which it will be
+full again (the generic cell rate algorithm), so checking and updating it
+is one operation:
+
+* with RedisCache, a Lua script run in one round trip, atomic across workers;
+* with the local-memory cache, a get and set under a process lock. Each
+  process then has its own buckets, like the rest of that cache.
+
+Other cache backends fall back to the get and set, which is two round trips
+and can let a few extra requests through under concurrency.
+
+The client address is REMOTE_ADDR, or CLIENT_IP_HEADER when a deployment
+behind a proxy sets it (see client_ip()).
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import SimpleRateThrottle
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# KEYS[1]: bucket; ARGV: now, interval, period, all in milliseconds.
+# Returns 0 when a token was taken, else milliseconds until one is available.
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local period = tonumber(ARGV[3])
+local full_at = tonumber(redis.call('GET', KEYS[1]) or now)
+if full_at < now then
+    full_at = now
+end
+full_at = full_at + interval
+local wait = full_at - now - period
+if wait > 0 then
+    return math.ceil(wait)
+end
+redis.call('SET', KEYS[1], tostring(full_at), 'PX', math.ceil(full_at - now))
+return 0
+"""
+
+_lock = threading.Lock()
+_script = None
+
+
+def client_ip(request):
+    """The client's address. CLIENT_IP_HEADER names a request header (as a
+    META key, like SECURE_PROXY_SSL_HEADER) that the reverse proxy sets. For
+    a list such as X-Forwarded-For, the proxy appends the address it saw, so
+    the entry CLIENT_IP_PROXY_COUNT from the right is the client; entries
+    further left are whatever the client sent."""
+    header = getattr(settings, 'CLIENT_IP_HEADER', '')
+    if header and request.META.get(header, '').strip(', '):
+        addresses = [address.strip() for address in request.META[header].split(',') if address.strip()]
+        proxies = getattr(settings, 'CLIENT_IP_PROXY_COUNT', 1)
+        return addresses[-min(proxies, len(addresses))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _take_redis(cache, key, now, interval, period):
+    global _script
+    client = cache._cache.get_client(key, write=True)
+    if _script is None:
+        _script = client.register_script(TAKE_SCRIPT)
+    return _script(keys=[cache.make_and_validate_key(key)], args=[now, interval, period], client=client)
+
+
+def _take_local(cache, key, now, interval, period):
+    with _lock:
+        full_at = max(cache.get(key) or now, now) + interval
+        wait = full_at - now - period
+        if wait > 0:
+            return math.ceil(wait)
+        cache.set(key, full_at, timeout=math.ceil((full_at - now) / 1000))
+        return 0
+
+
+def take(key, capacity, period):
+    """Take a token from bucket ``key``, which holds ``capacity`` tokens and
+    refills completely in ``period`` seconds. Returns 0 when a token was
+    taken, else the seconds until one is available."""
+    now = time.time() * 1000
+    interval = period * 1000 / capacity
+    cache = caches[DEFAULT_CACHE_ALIAS]
+    take_token = _take_redis if isinstance(cache, RedisCache) else _take_local
+    return take_token(cache, key, now, interval, period * 1000) / 1000
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    cache_format = 'throttle:{route}:{ident}'
+
+    def __init__(self):
+        # The rate depends on the route; see allow_request()
+        self.retry_after = None
+
+    def allow_request(self, request, view):
+        match = request.resolver_match
+        if request.method in SAFE_METHODS or match is None:
+            return True
+        rate = self.THROTTLE_RATES.get(match.view_name)
+        if rate is None:
+            return True
+        capacity, period = self.parse_rate(rate)
+        key = self.cache_format.format(route=match.view_name, ident=client_ip(request))
+        self.retry_after = take(key, capacity, period)
+        return not self.retry_after
+
+    def wait(self):
+        return self.retry_after
@@ -0,0 +1,154 @@
+"""
+Resized thumbnail variants.
+
+Saving a Subject or Note whose thumbnail changed queues a job (see
+notes.signals) that runs after the transaction commits on a small thread
+pool, off the request path. The job writes WebP and JPEG copies at each
+width in THUMBNAIL_VARIANT_WIDTHS under content-hashed names, so they can be
+cached forever and identical outputs are stored once. It records them in
+the row's ``thumbnail_variants``:
+
+    {"source": "note_thumbnails/a.png",
+     "webp": {"160": "thumbnails/3f1c....webp", ...},
+     "jpeg": {"160": "thumbnails/9ab0....jpg", ...}}
+
+Existing media is backfilled by ``manage.py build_thumbnail_variants``.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .cache import bump_generation
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'thumbnails'
+# (key in the variant map, Pillow format, extension, save options)
+FORMATS = [
+    ('webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_widths():
+    return getattr(settings, 'THUMBNAIL_VARIANT_WIDTHS', (160, 320, 640))
+
+
+def is_stale(instance):
+    """Whether the stored variants were not built from the current thumbnail"""
+    source = instance.thumbnail.name if instance.thumbnail else ''
+    return source != (instance.thumbnail_variants or {}).get('source', '')
+
+
+def _encode(image, pil_format, options):
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # No alpha in JPEG; flatten onto white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def _store(storage, content, extension):
+    name = f'{VARIANT_DIR}/{hashlib.sha256(content).hexdigest()[:32]}.{extension}'
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return name
+
+
+def build_variants(field_file):
+    """Resize ``field_file`` to every configured width and format, returning
+    the variant map. Images are never scaled up."""
+    with field_file.open('rb') as fh:
+        image = Image.open(fh)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA')
+
+    variants = {'source': field_file.name}
+    for key, _, _, _ in FORMATS:
+        variants[key] = {}
+    for width in variant_widths():
+        if image.width > width:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        else:
+            resized = image
+        for key, pil_format, extension, options in FORMATS:
+            content = _encode(resized, pil_format, options)
+            variants[key][str(width)] = _store(field_file.storage, content, extension)
+    return variants
+
+
+def refresh_variants(model, pk, force=False):
+    """Bring one row's variants up to date; returns whether it changed"""
+    instance = model._default_manager.filter(pk=pk).only('pk', 'thumbnail', 'thumbnail_variants').first()
+    if instance is None or not (force or is_stale(instance)):
+        return False
+    if instance.thumbnail:
+        variants = build_variants(instance.thumbnail)
+        rows = model._default_manager.filter(pk=pk, thumbnail=instance.thumbnail.name)
+    else:
+        variants = {}
+        rows = model._default_manager.filter(pk=pk)
+    # update() rather than save(): no signals, so no new job is queued, and a
+    # thumbnail replaced while this one was resizing is left to its own job
+    if not rows.update(thumbnail_variants=variants):
+        return False
+    bump_generation(model)
+    return True
+
+
+def _run(label, pk):
+    try:
+        refresh_variants(apps.get_model(label), pk)
+    except Exception:
+        logger.exception('Failed to build thumbnail variants for %s %s', label, pk)
+    finally:
+        # The pool thread opened its own database connection
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def schedule(model, pk):
+    """Build the variants for a row once the current transaction commits"""
+    label = model._meta.label
+    if getattr(settings, 'THUMBNAIL_ASYNC', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run, label, pk))
+    else:
+        transaction.on_commit(lambda: refresh_variants(model, pk))
+
+
+def variant_urls(variants, storage, request=None):
+    """The public form of a variant map: {format: {width: url}}"""
+    urls = {}
+    for key, _, _, _ in FORMATS:
+        sizes = (variants or {}).get(key)
+        if not sizes:
+            continue
+        urls[key] = {
+            width: request.build_absolute_uri(storage.url(name)) if request else storage.url(name)
+            for width, name in sizes.items()
+        }
+    return urls or None
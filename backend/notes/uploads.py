@@ -0,0 +1,124 @@
+"""
+Bulk note uploads.
+
+Uploaded files are streamed to temporary files on disk in chunks by
+HashingTemporaryFileUploadHandler, which also computes each file's SHA-256
+as the chunks arrive, so no upload is held in memory or read twice.
+create_notes_from_uploads() moves the files into storage and inserts every
+note with one bulk_create in a single transaction. It then does the
+bookkeeping that Note.save() and the post_save signals would otherwise do
+once per note.
+"""
+import hashlib
+import logging
+import os
+from functools import partial
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+
+from . import stats
+from .cache import bump_generation
+from .models import Note, Tag, parse_tags
+from .search import build_search_text
+from .storage import content_digest, note_storage
+
+logger = logging.getLogger(__name__)
+
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads to disk and set ``sha256`` on each uploaded file"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.hasher.hexdigest()
+        return uploaded
+
+
+def title_from_filename(name):
+    stem = os.path.basename(name).rsplit('.', 1)[0]
+    return stem.replace('_', ' ').replace('-', ' ').title()
+
+
+def create_notes_from_uploads(files, subject, note_type, chapter='', tags='', skip_duplicates=False):
+    """Create one note per uploaded file; returns [(filename, status, note)].
+
+    With ``skip_duplicates``, a file whose content is already attached to a
+    note of ``subject``, or that repeats an earlier file of the batch, is
+    not added and is reported as a duplicate.
+    """
+    existing = set()
+    if skip_duplicates:
+        existing.update(
+            Note.objects.filter(subject=subject).exclude(file_sha256='').values_list('file_sha256', flat=True)
+        )
+    results = []
+    notes = []
+    stored = []
+    for uploaded in files:
+        digest = content_digest(uploaded)
+        if skip_duplicates:
+            if digest in existing:
+                results.append((uploaded.name, DUPLICATE, None))
+                continue
+            existing.add(digest)
+        title = title_from_filename(uploaded.name)
+        note = Note(
+            subject=subject,
+            note_type=note_type,
+            chapter=chapter,
+            tags=tags,
+            title=title,
+            description=f'Notes for {title}',
+            file_sha256=digest,
+        )
+        try:
+            # Stored under its digest; temporary uploads are moved, not copied
+            note.file.save(uploaded.name, uploaded, save=False)
+        except Exception:
+            logger.exception('Failed to store uploaded file %s', uploaded.name)
+            results.append((uploaded.name, FAILED, None))
+            continue
+        note.search_text = build_search_text(note)
+        notes.append(note)
+        stored.append((note.file.name, uploaded))
+        results.append((uploaded.name, CREATED, note))
+
+    if notes:
+        try:
+            with transaction.atomic():
+                Note.objects.bulk_create(notes)
+                _index_tags(notes, tags)
+                stats.adjust('total_notes', len(notes))
+                bump_generation(Note)
+                # As in Note.save(): a release may have deleted a reused blob
+                for name, uploaded in stored:
+                    transaction.on_commit(partial(note_storage.ensure, name, uploaded))
+        except Exception:
+            # Blobs may be shared with existing notes
+            for note in notes:
+                note_storage.delete_if_unreferenced(note.file.name)
+            raise
+    return results
+
+
+def _index_tags(notes, tags):
+    names = parse_tags(tags)
+    if not names:
+        return
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    tag_ids = list(Tag.objects.filter(name__in=names).values_list('pk', flat=True))
+    through = Note.tag_index.through
+    through.objects.bulk_create([through(note_id=note.pk, tag_id=tag_id) for note in notes for tag_id in tag_ids])
@@ -1,31 +1,42 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+
+def read_view(view, async_view):
+    """The async variant from notes.async_views when ASYNC_VIEWS is on (ASGI)"""
+    return async_view if settings.ASYNC_VIEWS else view
+
 
 urlpatterns = [
     # Semesters
-    path('semesters/', views.SemesterListView.as_view(), name='semester-list'),
-    path('semesters/<int:pk>/', views.SemesterDetailView.as_view(), name='semester-detail'),
-    path('semesters/<int:semester_id>/subjects/', views.SubjectListView.as_view(), name='semester-subjects'),
+    path('semesters/', read_view(views.SemesterListView.as_view(), async_views.semester_list), name='semester-list'),
+    path('semesters/<int:pk>/', read_view(views.SemesterDetailView.as_view(), async_views.semester_detail), name='semester-detail'),
+    path('semesters/<int:semester_id>/subjects/', read_view(views.SubjectListView.as_view(), async_views.subject_list), name='semester-subjects'),
     
     # Subjects
-    path('subjects/', views.SubjectListView.as_view(), name='subject-list'),
-    path('subjects/<int:pk>/', views.SubjectDetailView.as_view(), name='subject-detail'),
-    path('subjects/<int:subject_id>/notes/', views.NoteListView.as_view(), name='subject-notes'),
+    path('subjects/', read_view(views.SubjectListView.as_view(), async_views.subject_list), name='subject-list'),
+    path('subjects/<int:pk>/', read_view(views.SubjectDetailView.as_view(), async_views.subject_detail), name='subject-detail'),
+    path('subjects/<int:subject_id>/notes/', read_view(views.NoteListView.as_view(), async_views.note_list), name='subject-notes'),
+    path('subjects/<int:subject_id>/notes/facets/', views.NoteFacetsView.as_view(), name='subject-note-facets'),
     
     # Notes
-    path('notes/', views.NoteListView.as_view(), name='note-list'),
-    path('notes/<int:pk>/', views.NoteDetailView.as_view(), name='note-detail'),
+    path('notes/', read_view(views.NoteListView.as_view(), async_views.note_list), name='note-list'),
+    path('notes/facets/', views.NoteFacetsView.as_view(), name='note-facets'),
+    path('notes/<int:pk>/', read_view(views.NoteDetailView.as_view(), async_views.note_detail), name='note-detail'),
     
     # Download endpoints only (removed serve_note_file)
-    path('notes/<int:pk>/download/', views.download_note, name='download-note'),
+    path('notes/<int:pk>/download/', read_view(views.download_note, async_views.download_note), name='download-note'),
     path('notes/<int:pk>/increment-download/', views.increment_download, name='increment-download'),
     
     # Comments and Ratings
-    path('notes/<int:note_id>/comments/', views.CommentCreateView.as_view(), name='create-comment'),
-    path('notes/<int:note_id>/ratings/', views.RatingCreateView.as_view(), name='create-rating'),
+    path('notes/<int:note_id>/comments/', views.CommentListCreateView.as_view(), name='create-comment'),
+    path('notes/<int:note_id>/ratings/', views.RatingListCreateView.as_view(), name='create-rating'),
+    path('notes/<int:note_id>/ratings/summary/', views.rating_summary, name='rating-summary'),
     
     # Other endpoints
     path('feedback/', views.FeedbackCreateView.as_view(), name='create-feedback'),
-    path('stats/', views.stats, name='stats'),
-    path('featured-notes/', views.featured_notes, name='featured-notes'),
+    path('stats/', read_view(views.stats, async_views.stats), name='stats'),
+    path('featured-notes/', read_view(views.featured_notes, async_views.featured_notes), name='featured-notes'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
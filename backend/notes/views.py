@@ -1,55 +1,108 @@
 from rest_framework import generics, status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.http import HttpResponse, Http404, FileResponse
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
 from django.conf import settings
+from django.db.models import CharField, Count, F, Prefetch, Value
+from django.db.models.functions import Cast
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+from django.utils.text import get_valid_filename
 import os
-import mimetypes
-from .models import Semester, Subject, Note, Comment, Rating, Feedback
+from .aggregates import upsert_rating
+from .cache import DOWNLOADS, cache_response
+from .counters import download_counter
+from .files import is_new_download, serve_file
+from .metrics import SerializationTimingMixin, registry as metrics_registry, render_prometheus, serializing
+from .models import Semester, Subject, Note, Comment, Rating, Feedback, parse_tags
+from .pagination import KeysetPagination, NoteListPagination
+from .search import search_notes
+from .stats import get_snapshot as get_stats_snapshot, snapshot_etag
+from .storage import digest_from_name
 from .serializers import (
     SemesterListSerializer, SemesterDetailSerializer,
     SubjectListSerializer, SubjectDetailSerializer,
-    NoteListSerializer, NoteDetailSerializer,
+    NoteListSerializer, NoteDetailSerializer, NoteSlimSerializer,
     CommentSerializer, RatingSerializer, FeedbackSerializer
 )
 
-class SemesterListView(generics.ListAPIView):
-    queryset = Semester.objects.filter(is_active=True)
+class SparseFieldsViewMixin:
+    """For views whose serializer takes ?fields= and ?omit= (see
+    serializers.SparseFieldsMixin): aggregates and prefetches are only added
+    for fields that are selected, and only the columns they read are loaded"""
+    
+    def wants(self, *names):
+        selected = self.get_serializer_class().requested_fields(self.request)
+        return selected is None or not selected.isdisjoint(names)
+    
+    def prune(self, queryset, **kwargs):
+        return self.get_serializer_class().prune_queryset(queryset, self.request, **kwargs)
+
+@method_decorator(cache_response(Semester, Subject, Note), name='dispatch')
+class SemesterListView(SparseFieldsViewMixin, SerializationTimingMixin, generics.ListAPIView):
     serializer_class = SemesterListSerializer
+    
+    def get_queryset(self):
+        queryset = Semester.objects.filter(is_active=True)
+        if self.wants('total_subjects', 'total_notes'):
+            queryset = queryset.with_counts()
+        return self.prune(queryset)
 
-class SemesterDetailView(generics.RetrieveAPIView):
+@method_decorator(cache_response(Semester, Subject, Note, Rating, DOWNLOADS), name='dispatch')
+class SemesterDetailView(SparseFieldsViewMixin, SerializationTimingMixin, generics.RetrieveAPIView):
     serializer_class = SemesterDetailSerializer
+    # Semesters are addressed by number
+    lookup_field = 'number'
+    lookup_url_kwarg = 'pk'
     
-    def get_object(self):
-        semester_number = self.kwargs['pk']
-        try:
-            return Semester.objects.get(number=semester_number, is_active=True)
-        except Semester.DoesNotExist:
-            raise Http404(f"Semester {semester_number} not found")
+    def get_queryset(self):
+        queryset = Semester.objects.filter(is_active=True)
+        if self.wants('subjects', 'total_subjects', 'total_notes'):
+            queryset = queryset.with_tree()
+        return self.prune(queryset)
 
-class SubjectListView(generics.ListAPIView):
+@method_decorator(cache_response(Semester, Subject, Note, Rating, DOWNLOADS), name='dispatch')
+class SubjectListView(SparseFieldsViewMixin, SerializationTimingMixin, generics.ListAPIView):
     serializer_class = SubjectListSerializer
     
     def get_queryset(self):
+        # Meta.ordering is not applied to aggregated querysets
+        queryset = Subject.objects.filter(is_active=True).order_by('code')
+        if self.wants('total_notes', 'total_downloads', 'average_rating'):
+            queryset = queryset.with_rollups()
         semester_number = self.kwargs.get('semester_id')
         if semester_number:
-            try:
-                semester = Semester.objects.get(number=semester_number, is_active=True)
-                return Subject.objects.filter(semester=semester, is_active=True)
-            except Semester.DoesNotExist:
-                return Subject.objects.none()
-        return Subject.objects.filter(is_active=True)
-
-class SubjectDetailView(generics.RetrieveAPIView):
-    queryset = Subject.objects.filter(is_active=True)
+            # An unknown or inactive semester lists no subjects
+            queryset = queryset.filter(semester__number=semester_number, semester__is_active=True)
+        return self.prune(queryset)
+
+@method_decorator(cache_response(Semester, Subject, Note, Rating, DOWNLOADS), name='dispatch')
+class SubjectDetailView(SparseFieldsViewMixin, SerializationTimingMixin, generics.RetrieveAPIView):
     serializer_class = SubjectDetailSerializer
+    
+    def get_queryset(self):
+        queryset = Subject.objects.filter(is_active=True)
+        if self.wants('total_notes', 'total_downloads', 'average_rating'):
+            queryset = queryset.with_rollups()
+        if not self.wants('notes'):
+            return self.prune(queryset)
+        # The prefetch points each note at this subject, whose name and code
+        # the notes show
+        notes = NoteListSerializer.prune_queryset(Note.objects.all(), join=False)
+        queryset = queryset.prefetch_related(Prefetch('notes', queryset=notes))
+        return self.prune(queryset, keep=['name', 'code'])
 
-class NoteListView(generics.ListAPIView):
+@method_decorator(cache_response(Subject, Note, Rating, DOWNLOADS), name='dispatch')
+class NoteListView(SparseFieldsViewMixin, SerializationTimingMixin, generics.ListAPIView):
     serializer_class = NoteListSerializer
+    # ?pagination=cursor / ?cursor= switch to keyset pages ordered by (-created_at, -id)
+    pagination_class = NoteListPagination
+    rank_search = True
     
     def get_queryset(self):
         subject_id = self.kwargs.get('subject_id')
@@ -64,20 +117,121 @@ class NoteListView(generics.ListAPIView):
         chapter = self.request.query_params.get('chapter')
         featured = self.request.query_params.get('featured')
         
-        if search:
-            queryset = queryset.filter(title__icontains=search)
         if note_type:
             queryset = queryset.filter(note_type=note_type)
         if chapter:
             queryset = queryset.filter(chapter__icontains=chapter)
         if featured:
             queryset = queryset.filter(is_featured=True)
+        # ?tag=a,b or ?tag=a&tag=b; all must match unless ?tag_match=any
+        tags = parse_tags(','.join(self.request.query_params.getlist('tag')))
+        if tags:
+            match_any = self.request.query_params.get('tag_match') == 'any'
+            queryset = queryset.tagged(tags, match_any=match_any)
+        if search:
+            # Relevance-ranked; see notes.search for the per-database backends
+            queryset = search_notes(queryset, search, rank=self.rank_search)
+        
+        # created_at is the keyset cursor
+        return self.prune(queryset, keep=['created_at'])
+
+@method_decorator(cache_response(Subject, Note, Rating), name='dispatch')
+class NoteFacetsView(NoteListView):
+    """Counts per note_type, chapter and tag for the notes matching the
+    same filters as NoteListView, computed with one UNION ALL of GROUP BYs"""
+    pagination_class = None
+    rank_search = False
+    facet_limit = 50
+    
+    def get(self, request, *args, **kwargs):
+        note_ids = self.get_queryset().order_by().values('id')
+        notes = Note.objects.filter(id__in=note_ids).order_by()
+        tags = Note.tag_index.through.objects.filter(note_id__in=note_ids).order_by()
+        
+        def grouped(queryset, facet, value):
+            return queryset.annotate(
+                facet=Value(facet), value=Cast(value, CharField())
+            ).values('facet', 'value').annotate(count=Count('*'))
         
-        return queryset
+        rows = grouped(notes, 'total', Value('')).union(
+            grouped(notes, 'note_type', F('note_type')),
+            grouped(notes.exclude(chapter=''), 'chapter', F('chapter')),
+            grouped(tags, 'tag', F('tag__name')),
+            all=True,
+        )
+        
+        facets = {'note_type': [], 'chapter': [], 'tag': []}
+        total = 0
+        for row in rows:
+            if row['facet'] == 'total':
+                total = row['count']
+            else:
+                facets[row['facet']].append({'value': row['value'], 'count': row['count']})
+        
+        type_labels = dict(Note._meta.get_field('note_type').choices)
+        for item in facets['note_type']:
+            item['label'] = type_labels.get(item['value'], item['value'])
+        for items in facets.values():
+            items.sort(key=lambda item: (-item['count'], item['value']))
+        facets['tag'] = facets['tag'][:self.facet_limit]
+        
+        return Response({'count': total, **facets})
 
-class NoteDetailView(generics.RetrieveAPIView):
-    queryset = Note.objects.all()
+@method_decorator(cache_response(Semester, Subject, Note, Comment, Rating, DOWNLOADS), name='dispatch')
+class NoteDetailView(SparseFieldsViewMixin, SerializationTimingMixin, generics.RetrieveAPIView):
     serializer_class = NoteDetailSerializer
+    
+    def is_slim(self):
+        return self.request.query_params.get('slim', '').lower() in ('1', 'true', 'yes')
+    
+    def get_queryset(self):
+        queryset = self.prune(Note.objects.all())
+        if self.is_slim():
+            return queryset
+        return queryset.prefetch_related(*[name for name in ('comments', 'ratings') if self.wants(name)])
+    
+    def get_serializer_class(self):
+        # ?slim=true leaves out the comments and ratings arrays
+        return NoteSlimSerializer if self.is_slim() else NoteDetailSerializer
+
+def note_file_response(request, note, asynchronous=False):
+    """The download response for ``note``'s file; raises Http404 if it is missing"""
+    if not note.file:
+        raise Http404("No file attached to this note")
+    
+    # Get the actual file path
+    try:
+        file_path = note.file.path
+    except ValueError:
+        raise Http404("File path error")
+    
+    # Check if file exists
+    if not os.path.exists(file_path):
+        # Try alternative paths
+        media_root = getattr(settings, 'MEDIA_ROOT', '')
+        alt_path = os.path.join(media_root, str(note.file))
+        
+        if os.path.exists(alt_path):
+            file_path = alt_path
+        else:
+            raise Http404("File not found on disk")
+    
+    # Get filename
+    filename = os.path.basename(file_path)
+    etag = None
+    digest = digest_from_name(note.file.name)
+    if digest:
+        # Content-addressed blob: name the download after the note, and the
+        # digest is a strong validator
+        filename = get_valid_filename(f'{note.title}{os.path.splitext(filename)[1]}')
+        etag = quote_etag(digest)
+    
+    # Handles Range, If-None-Match and If-Modified-Since (206/304/416)
+    response = serve_file(request, file_path, filename, etag=etag, asynchronous=asynchronous)
+    response['Access-Control-Allow-Origin'] = '*'
+    response['Access-Control-Allow-Methods'] = 'GET'
+    response['Access-Control-Allow-Headers'] = '*'
+    return response
 
 @api_view(['GET'])
 @require_http_methods(["GET"])
@@ -85,44 +239,10 @@ def download_note(request, pk):
     """Download note file"""
     try:
         note = get_object_or_404(Note, pk=pk)
-        
-        if not note.file:
-            raise Http404("No file attached to this note")
-        
-        # Get the actual file path
-        try:
-            file_path = note.file.path
-        except ValueError:
-            raise Http404("File path error")
-        
-        # Check if file exists
-        if not os.path.exists(file_path):
-            # Try alternative paths
-            media_root = getattr(settings, 'MEDIA_ROOT', '')
-            alt_path = os.path.join(media_root, str(note.file))
-            
-            if os.path.exists(alt_path):
-                file_path = alt_path
-            else:
-                raise Http404("File not found on disk")
-        
-        # Get filename
-        filename = os.path.basename(file_path)
-        
-        # Increment download counter
-        note.downloads += 1
-        note.save(update_fields=['downloads'])
-        
-        # Create download response
-        response = FileResponse(
-            open(file_path, 'rb'),
-            content_type='application/octet-stream'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Access-Control-Allow-Origin'] = '*'
-        response['Access-Control-Allow-Methods'] = 'GET'
-        response['Access-Control-Allow-Headers'] = '*'
-        
+        response = note_file_response(request, note)
+        if is_new_download(request, response):
+            # Buffered; applied to the row in bulk by notes.counters
+            download_counter.record(note.pk)
         return response
         
     except Exception as e:
@@ -133,16 +253,26 @@ def download_note(request, pk):
 def increment_download(request, pk):
     """Increment download counter only"""
     try:
-        note = get_object_or_404(Note, pk=pk)
-        note.downloads += 1
-        note.save(update_fields=['downloads'])
-        return Response({'downloads': note.downloads, 'success': True})
+        note = get_object_or_404(Note.objects.only('pk', 'downloads'), pk=pk)
+        download_counter.record(note.pk)
+        downloads = note.downloads + download_counter.pending([note.pk]).get(note.pk, 0)
+        return Response({'downloads': downloads, 'success': True})
     except Exception as e:
         return Response({'error': str(e)}, status=400)
 
 @method_decorator(csrf_exempt, name='dispatch')
-class CommentCreateView(generics.CreateAPIView):
+@method_decorator(cache_response(Note, Comment), name='dispatch')
+class CommentListCreateView(SerializationTimingMixin, generics.ListCreateAPIView):
+    """A note's comments, newest first, in keyset pages"""
     serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
+    
+    def get_queryset(self):
+        return Comment.objects.filter(note_id=self.kwargs['note_id'])
+    
+    def list(self, request, *args, **kwargs):
+        get_object_or_404(Note.objects.only('pk'), pk=self.kwargs['note_id'])
+        return super().list(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         note_id = self.kwargs['note_id']
@@ -150,38 +280,85 @@ class CommentCreateView(generics.CreateAPIView):
         serializer.save(note=note)
 
 @method_decorator(csrf_exempt, name='dispatch')
-class RatingCreateView(generics.CreateAPIView):
+@method_decorator(cache_response(Note, Rating), name='dispatch')
+class RatingListCreateView(SerializationTimingMixin, generics.ListCreateAPIView):
+    """A note's ratings, newest first, in keyset pages"""
     serializer_class = RatingSerializer
+    pagination_class = KeysetPagination
     
-    def perform_create(self, serializer):
-        note_id = self.kwargs['note_id']
-        note = get_object_or_404(Note, id=note_id)
-        serializer.save(note=note)
+    def get_queryset(self):
+        return Rating.objects.filter(note_id=self.kwargs['note_id'])
+    
+    def list(self, request, *args, **kwargs):
+        get_object_or_404(Note.objects.only('pk'), pk=self.kwargs['note_id'])
+        return super().list(request, *args, **kwargs)
+    
+    def create(self, request, *args, **kwargs):
+        """Add the rating, or replace the author's earlier rating of the note
+        (201 or 200). The response includes the note's new aggregates."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            rating, created, note = upsert_rating(self.kwargs['note_id'], **serializer.validated_data)
+        except Note.DoesNotExist:
+            raise Http404
+        with serializing():
+            data = self.get_serializer(rating).data
+        data['note'] = {'id': note.pk, 'average_rating': note.average_rating, 'total_ratings': note.total_ratings}
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+@cache_response(Note, Rating)
+@api_view(['GET'])
+def rating_summary(request, note_id):
+    """Count, average and 1-5 histogram of a note's ratings"""
+    get_object_or_404(Note.objects.only('pk'), pk=note_id)
+    histogram = {score: 0 for score in range(1, 6)}
+    rows = Rating.objects.filter(note_id=note_id).order_by().values('score').annotate(count=Count('id'))
+    for row in rows:
+        histogram[row['score']] = row['count']
+    count = sum(histogram.values())
+    total = sum(score * n for score, n in histogram.items())
+    return Response({
+        'count': count,
+        'average': total / count if count else 0,
+        'histogram': histogram,
+    })
 
 @method_decorator(csrf_exempt, name='dispatch')
-class FeedbackCreateView(generics.CreateAPIView):
+class FeedbackCreateView(SerializationTimingMixin, generics.CreateAPIView):
     serializer_class = FeedbackSerializer
 
+def stats_etag(request, *args, **kwargs):
+    # Read once; the view returns the same snapshot
+    request.stats_snapshot = get_stats_snapshot()
+    return snapshot_etag(request.stats_snapshot)
+
+@condition(etag_func=stats_etag)
+@cache_control(public=True, max_age=60)
 @api_view(['GET'])
 def stats(request):
-    total_semesters = Semester.objects.filter(is_active=True).count()
-    total_subjects = Subject.objects.filter(is_active=True).count()
-    total_notes = Note.objects.count()
-    total_downloads = sum(Note.objects.values_list('downloads', flat=True))
-    total_comments = Comment.objects.count()
-    total_ratings = Rating.objects.count()
-    
-    return Response({
-        'total_semesters': total_semesters,
-        'total_subjects': total_subjects,
-        'total_notes': total_notes,
-        'total_downloads': total_downloads,
-        'total_comments': total_comments,
-        'total_ratings': total_ratings
-    })
+    """Platform totals, served from the snapshot row in notes.stats"""
+    return Response(request.stats_snapshot)
 
+@cache_response(Subject, Note, Rating, DOWNLOADS)
 @api_view(['GET'])
 def featured_notes(request):
-    notes = Note.objects.filter(is_featured=True)[:6]
-    serializer = NoteListSerializer(notes, many=True)
-    return Response(serializer.data)
+    notes = NoteListSerializer.prune_queryset(Note.objects.filter(is_featured=True), request)[:6]
+    serializer = NoteListSerializer(notes, many=True, fields=NoteListSerializer.requested_fields(request))
+    with serializing():
+        return Response(serializer.data)
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Request timing histograms in Prometheus text format (see notes.metrics)"""
+    token = settings.REQUEST_METRICS_TOKEN
+    if not token:
+        # Only served without a token in development
+        if not settings.DEBUG:
+            raise Http404
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        render_prometheus(metrics_registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
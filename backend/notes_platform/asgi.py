@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notes_platform.settings')
+# Route the read-only endpoints to notes.async_views
+os.environ.setdefault('ASYNC_VIEWS', 'true')
 
 application = get_asgi_application()
@@ -0,0 +1,118 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_string
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r'\bbr\b')
+re_accepts_gzip = _lazy_re_compile(r'\bgzip\b')
+# Formats that are compressed already
+COMPRESSED_TYPES = (
+    'image/', 'video/', 'audio/', 'font/woff',
+    'application/zip', 'application/gzip', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/x-bzip2', 'application/pdf',
+)
+# Brotli has no BREACH padding, so it is kept to the API's formats, which
+# carry no secrets such as CSRF tokens; HTML (admin, browsable API) gets gzip
+BROTLI_TYPES = ('application/json', 'application/msgpack')
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """WhiteNoise 6 is sync-only. Under ASGI that would run every request
+    in a thread, so this subclass awaits the rest of the stack instead.
+    Static files are looked up in memory, so that part runs unchanged."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class CompressionMiddleware:
+    """Like Django's GZipMiddleware, but prefers brotli for JSON and
+    MessagePack when the client accepts it and the brotli package is
+    installed, and skips responses smaller than COMPRESSION_MIN_SIZE bytes.
+
+    Streaming responses (note downloads, media files) are passed through:
+    compressing them would drop Content-Length and break Range requests,
+    and most are PDFs or images, which are compressed already. So are other
+    responses with such a Content-Type. Unlike GZipMiddleware this stays
+    async under ASGI instead of running in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+    # Random bytes in the gzip header against BREACH, as in GZipMiddleware
+    max_random_bytes = 100
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.brotli_quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or len(response.content) < self.min_size
+            or response.get('Content-Type', '').startswith(COMPRESSED_TYPES)
+        ):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if (
+            brotli is not None
+            and re_accepts_brotli.search(accept_encoding)
+            and response.get('Content-Type', '').startswith(BROTLI_TYPES)
+        ):
+            encoding = 'br'
+            content = brotli.compress(response.content, quality=self.brotli_quality)
+        elif re_accepts_gzip.search(accept_encoding):
+            encoding = 'gzip'
+            content = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response.headers['Content-Length'] = str(len(content))
+        # The compressed body is a different representation; a weak ETag
+        # still matches If-None-Match
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
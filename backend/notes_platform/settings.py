@@ -1,4 +1,6 @@
 import os
+import sys
+from importlib.util import find_spec
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
@@ -32,9 +34,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'notes.metrics.RequestMetricsMiddleware',
+    # Before anything that reads or changes the body
+    'notes_platform.middleware.CompressionMiddleware',
+    # Inactive unless N_PLUS_ONE_MODE is 'log' or 'raise'
+    'notes.nplusone.NPlusOneMiddleware',
+    # Inactive unless DATABASE_REPLICA_URL is set
+    'notes.replicas.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware', 
+    # WhiteNoise that stays async under ASGI
+    'notes_platform.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -68,6 +79,73 @@ DATABASES = {
     'default': dj_database_url.config(default=os.getenv('DATABASE_URL'))
 }
 
+# Optional read replica for GET traffic (notes.replicas)
+DATABASE_REPLICA_ALIAS = os.getenv('DATABASE_REPLICA_ALIAS', 'replica')
+if os.getenv('DATABASE_REPLICA_URL'):
+    DATABASES[DATABASE_REPLICA_ALIAS] = dj_database_url.config(env='DATABASE_REPLICA_URL')
+    DATABASES[DATABASE_REPLICA_ALIAS]['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['notes.replicas.ReplicaRouter']
+# manage.py test adds a second, empty SQLite database. It is unused unless
+# a test points DATABASE_REPLICA_ALIAS at it (notes.tests.ReplicaRoutingTests)
+TEST_REPLICA_ALIAS = 'test_replica'
+if sys.argv[1:2] == ['test'] and TEST_REPLICA_ALIAS not in DATABASES:
+    DATABASES[TEST_REPLICA_ALIAS] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'test_replica.sqlite3'}
+# Clients read from the primary for this long after a write
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DATABASE_REPLICA_PIN_SECONDS', '5'))
+
+# Cache: Redis when REDIS_URL is set (shared between gunicorn workers),
+# otherwise a per-process in-memory cache
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Response cache for the read endpoints (notes.cache). Its invalidation relies
+# on a cache shared by every worker, so it is off with the per-process cache
+# unless the server runs a single process
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'True' if REDIS_URL else 'False').lower() == 'true'
+
+# Serve the read-only endpoints and downloads from notes.async_views;
+# notes_platform.asgi turns this on
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
+
+# Buffered download counters (notes.counters)
+DOWNLOAD_COUNTER_CACHE = 'default'
+DOWNLOAD_COUNTER_FLUSH_INTERVAL = int(os.getenv('DOWNLOAD_COUNTER_FLUSH_INTERVAL', '30'))
+
+# Request timing: Server-Timing headers and /api/metrics/ (notes.metrics)
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', '1' if DEBUG else '0.1'))
+REQUEST_METRICS_PUBLISH_INTERVAL = 15
+# /api/metrics/ requires "Authorization: Bearer <token>"; without a token
+# it is only served when DEBUG is on, and is a 404 otherwise
+REQUEST_METRICS_TOKEN = os.getenv('REQUEST_METRICS_TOKEN', '')
+
+# N+1 query detection (notes.nplusone): 'off', 'log' or 'raise'
+N_PLUS_ONE_MODE = os.getenv('N_PLUS_ONE_MODE', 'off')
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+N_PLUS_ONE_SAMPLE_RATE = float(os.getenv('N_PLUS_ONE_SAMPLE_RATE', '1'))
+
+# Resized thumbnail variants (notes.thumbnails)
+THUMBNAIL_VARIANT_WIDTHS = (160, 320, 640)
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+# False builds them synchronously when the saving transaction commits
+THUMBNAIL_ASYNC = os.getenv('THUMBNAIL_ASYNC', 'true').lower() == 'true'
+
+# Response compression (notes_platform.middleware): brotli if installed, else gzip
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+# 0-11; higher levels cost far more CPU for a few percent smaller bodies
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -106,10 +184,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST Framework settings
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'notes.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # orjson when installed (notes.renderers); MessagePack when msgpack is
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'notes.renderers.FastJSONRenderer',
+        *(['notes.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -118,8 +198,26 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [],
     'DEFAULT_PERMISSION_CLASSES': [],
+    # Token buckets per client address for the anonymous writes, keyed by URL
+    # name (notes.throttling). 'N/period': bursts of N, refilled over the period
+    'DEFAULT_THROTTLE_CLASSES': ['notes.throttling.TokenBucketThrottle'],
+    'DEFAULT_THROTTLE_RATES': {
+        'create-comment': os.getenv('THROTTLE_COMMENTS', '10/min'),
+        'create-rating': os.getenv('THROTTLE_RATINGS', '10/min'),
+        'create-feedback': os.getenv('THROTTLE_FEEDBACK', '5/hour'),
+        'increment-download': os.getenv('THROTTLE_DOWNLOAD_COUNTS', '60/min'),
+    },
 }
 
+# Where the client address comes from, for throttling and replica pins:
+# REMOTE_ADDR, or a request header set by the reverse proxy (as a META key,
+# like SECURE_PROXY_SSL_HEADER, e.g. HTTP_X_FORWARDED_FOR). Only set it in a
+# deployment where clients cannot reach the app without going through the
+# proxy; otherwise a client can send any address it likes. With a list such as
+# X-Forwarded-For, the client is the entry CLIENT_IP_PROXY_COUNT from the right.
+CLIENT_IP_HEADER = os.getenv('CLIENT_IP_HEADER', '')
+CLIENT_IP_PROXY_COUNT = int(os.getenv('CLIENT_IP_PROXY_COUNT', '1'))
+
 # CORS settings for frontend
 CORS_ALLOWED_ORIGINS = [
     'https://angelmainali.com.np',
@@ -153,7 +251,11 @@ SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# Stream every upload to a temporary file, hashing it on the way (notes.uploads)
+FILE_UPLOAD_HANDLERS = ['notes.uploads.HashingTemporaryFileUploadHandler']
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# Bulk note uploads in the admin send one file per note
+DATA_UPLOAD_MAX_NUMBER_FILES = 500
 
 # Add these to your existing CORS settings
 CORS_ALLOW_HEADERS = [
@@ -167,6 +269,19 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
     'range', 
+    'if-range',
+    'if-none-match',
+    'if-modified-since',
+]
+
+# Let the PDF viewers read range/validator headers on cross-origin downloads
+CORS_EXPOSE_HEADERS = [
+    'accept-ranges',
+    'content-range',
+    'content-length',
+    'content-disposition',
+    'etag',
+    'last-modified',
 ]
 
 # Add these new settings
@@ -43,7 +43,7 @@ const RatingSection = ({ noteId, onRatingSubmit }) => {
         const data = await response.json()
         console.log("Rating submitted successfully:", data)
 
-        setMessage("Rating submitted successfully!")
+        setMessage(response.status === 201 ? "Rating submitted successfully!" : "Your rating has been updated!")
         setRating(0)
         setAuthorName("")
         setAuthorEmail("")